@@ -0,0 +1,25 @@
+import os
+
+from cube_store import build_cube_store
+from daily_readers import open_reader
+
+# Daily inputs to transpose (any daily_readers backend; the converted GeoTIFFs by default)
+readers = {
+    "pre": {"backend": "geotiff", "data_dir": r"F:\phdl1\QTP_CN05.1_converted\pre", "prefix": "pre"},
+    "tmax": {"backend": "geotiff", "data_dir": r"F:\phdl1\QTP_CN05.1_converted\tmax", "prefix": "tmax"},
+    "tmin": {"backend": "geotiff", "data_dir": r"F:\phdl1\QTP_CN05.1_converted\tmin", "prefix": "tmin"},
+    "tm": {"backend": "geotiff", "data_dir": r"F:\phdl1\QTP_CN05.1_converted\tmean", "prefix": "tm"},
+}
+
+# Output: one time-contiguous store per variable, read with {"backend": "store", "store_dir": ...}
+store_base_dir = r"F:\phdl1\QTP_CN05.1_cube"
+
+# Years to include (whole record, or a scenario period)
+start_year, end_year = 1961, 2014
+
+years = range(start_year, end_year + 1)
+for var, spec in readers.items():
+    store_dir = os.path.join(store_base_dir, var)
+    build_cube_store(open_reader(spec), years, store_dir, desc=f"Transposing {var}")
+
+print("Cube stores written to:", store_base_dir)
@@ -1,8 +1,9 @@
 import os
-import numpy as np
 import rasterio
 from tqdm import tqdm
 
+from spell_kernel import consecutive_dry_wet_days
+
 # Input precipitation data directory
 pre_dir = r"F:\phdl1\QTP_CN05.1_converted\pre"
 # Output directories
@@ -14,6 +15,11 @@ os.makedirs(output_dir_cwd, exist_ok=True)
 # Processing year range (only 1961-2014)
 start_year, end_year = 1961, 2014
 
+# Daily precipitation (mm) separating dry and wet days
+wet_threshold = 1.0
+# Treatment of missing days: "wet" (counted as wet days), "break" (end both streaks) or "skip" (ignored)
+nan_policy = "wet"
+
 # Process each year's data
 for year in tqdm(range(start_year, end_year + 1), desc="Computing CDD & CWD"):
     input_file = os.path.join(pre_dir, f"pre_{year}.tif")
@@ -28,40 +34,11 @@ for year in tqdm(range(start_year, end_year + 1), desc="Computing CDD & CWD"):
         meta = src.meta.copy()
         meta.update({"count": 1, "dtype": "float32", "compress": "lzw"})  # Adapt for single-band output
 
-        cdd_max = np.zeros((src.height, src.width), dtype=np.float32)  # Maximum consecutive dry days
-        cwd_max = np.zeros((src.height, src.width), dtype=np.float32)  # Maximum consecutive wet days
-
         # Read all daily precipitation data
         precip_data = src.read()  # Shape: (days, height, width)
 
-        # Iterate over each pixel
-        for i in range(src.height):
-            for j in range(src.width):
-                pixel_precip = precip_data[:, i, j]
-
-                if np.all(np.isnan(pixel_precip)):  # Skip invalid data
-                    cdd_max[i, j] = np.nan
-                    cwd_max[i, j] = np.nan
-                    continue
-
-                # Calculate CDD (longest consecutive days with <1 mm precipitation)
-                cdd_count = 0
-                max_cdd = 0
-                cwd_count = 0
-                max_cwd = 0
-
-                for day in range(len(pixel_precip)):
-                    if pixel_precip[day] < 1:
-                        cdd_count += 1
-                        max_cdd = max(max_cdd, cdd_count)
-                        cwd_count = 0  # Break wet day streak
-                    else:
-                        cwd_count += 1
-                        max_cwd = max(max_cwd, cwd_count)
-                        cdd_count = 0  # Break dry day streak
-
-                cdd_max[i, j] = max_cdd
-                cwd_max[i, j] = max_cwd
+        # Longest consecutive dry (< wet_threshold) and wet day streaks for every pixel at once
+        cdd_max, cwd_max = consecutive_dry_wet_days(precip_data, wet_threshold, nan_policy)
 
         # Save CDD result
         with rasterio.open(output_file_cdd, "w", **meta) as dst:
@@ -7,15 +7,19 @@ Created on Tue Feb  6 13:08:05 2024
 
 import numpy as np
 import netCDF4 as nc
-from osgeo import gdal, osr, ogr
+from osgeo import gdal, osr
 import os
 # import glob
-import re
-import datetime
 from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor
 import time
 
+from daily_readers import year_bounds
+from stage_profiler import StageProfiler, load_records, new_run_id, print_summary
+
+# Stage timings (open, dates, read, mask, write per year) appended as JSON lines (see stage_profiler.py; None = off)
+stage_log = "F:\\CN05.1_converted\\nc2tiff_stage_log.jsonl"
+
 def img_resample(path, out_folder):
     ds = gdal.Open(path, gdal.OF_RASTER | gdal.OF_UPDATE)
     dsRes = gdal.Warp(out_folder + '\\' + path.split("\\")[-1].split('.')[0] + '.tif', ds, width=720, 
@@ -23,28 +27,41 @@ def img_resample(path, out_folder):
     del ds
     del dsRes
 
-def main():
+def write_year_tif(out_tif_name, arr, dates, geotransform, projection, profiler=None, year=None, var=None):
+    """Write one year of daily grids (days, lat, lon; latitude ascending) as a multi-band GeoTIFF."""
+    with (profiler or StageProfiler()).stage("write", year, var) as record:
+        driver = gdal.GetDriverByName('GTiff')
+        out_tif = driver.Create(out_tif_name, arr.shape[2], arr.shape[1], len(dates), gdal.GDT_Float32, options=["COMPRESS=LZW"])
+        out_tif.SetGeoTransform(geotransform)
+        out_tif.SetProjection(projection)#给新建图层创建投影信息
+        for i in range(len(dates)):
+            raster_band = out_tif.GetRasterBand(i + 1)
+            raster_band.SetDescription(dates[i])
+            raster_band.SetNoDataValue(np.nan)
+            raster_band.WriteArray(arr[i, ::-1, :])
+        out_tif.FlushCache()
+        del out_tif
+        record["bytes_written"] = os.path.getsize(out_tif_name)
+    return out_tif_name
+
+
+def main(profiler=None):
     input_vars = ["pre"]
                   # , "tas"]
+    write_workers = 4  # Number of year files compressed and written concurrently
+    max_pending = write_workers + 1  # Years held in memory at once (read ahead + being written)
+    profiler = profiler or StageProfiler()
+
     for _var in tqdm(input_vars):
         input_folder = "F:\\CN05.1\\00 - CN051-2021\\1961-2021"
         output_folder1 ="F:\\CN05.1_converted\\pre"
-        # nc_path_list = [input_folder + '\\' + d for d in os.listdir(input_folder) if d[-3:] == '.nc']
-        # print(f'number of nc file:{len(nc_path_list)}')
-        # print('**ss*****************************')
-        # file_count = len(nc_path_list)
-        # for path in nc_path_list:
         path = input_folder + "\\CN05.1_Pre_1961_2021_daily_025x025.nc"
-        data = nc.Dataset(path)
+        with profiler.stage("open", index=_var):
+            data = nc.Dataset(path)
         lon = data.variables['lon'][:]
         lat = data.variables['lat'][:]
-        # print(lon)
-        miss_value = data.variables[_var].missing_value
-        out_arr = np.asarray(data.variables[_var])#输入需要转换的波段名称
-        out_arr[out_arr==int(miss_value)] = np.nan
-        # print(out_arr.shape)
-        # print(out_arr[0, 1, 1])
-        # print(len(out_arr[:]))
+        variable = data.variables[_var]#输入需要转换的波段名称
+        miss_value = variable.missing_value
         #影像的左上角和右下角坐标
         lonMin, latMax, lonMax, latMin = [lon.min(), lat.max(), lon.max(), lat.min()]
 
@@ -53,56 +70,39 @@ def main():
         n_lon = len(lon)
         lon_res = (lonMax - lonMin)/(float(n_lon) - 1)
         lat_res = (latMax - latMin)/(float(n_lat) - 1)
-        # print(lon_res)
-        # print(lat_res)
-        # print(data.variables['time'][:].data)
-        # print(data.variables['time'].units)
+        geotransform = (lonMin-0.5*lon_res, lon_res, 0, latMax+0.5*abs(lat_res), 0, -abs(lat_res))#GeoTransform存储了6个用于描述数据位置的参数，是GeoTiff非常重要的一个信息
+
+        #获取地理坐标系
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(4326)#定义输出的坐标系统为WGS84
+        projection = srs.ExportToWkt()
+
         #读取时间信息
-        time = list(nc.num2date(data.variables['time'][:], data.variables['time'].units,\
-                            calendar=data.variables['time'].calendar).data)
-        # time = list(data.variables['time'][:])
-
-        # # 下面是转换过程
-        for t in range(len(time)):
-            time[t] = str(time[t]).split()[0]
-
-
-        count = 0
-        while time != []:
-            temp_time = []
-            for i in range(len(time)):
-                if temp_time == []:
-                    temp_time.append(time[i])
-                elif time[i].split('-')[0] == temp_time[0].split('-')[0]:
-                    temp_time.append(time[i])
-            driver = gdal.GetDriverByName('GTiff')
-            out_tif_name = output_folder1 + '\\' + _var + "_" +\
-                temp_time[0].split('-')[0] + '.tif'
-            out_tif = driver.Create(out_tif_name, n_lon, n_lat, len(temp_time), gdal.GDT_Float32, options=["COMPRESS=LZW"])
-            geotransform = (lonMin-0.5*lon_res, lon_res, 0, latMax+0.5*abs(lat_res), 0, -abs(lat_res))#GeoTransform存储了6个用于描述数据位置的参数，是GeoTiff非常重要的一个信息
-            out_tif.SetGeoTransform(geotransform)
-
-            #获取地理坐标系
-            srs = osr.SpatialReference()
-            srs.ImportFromEPSG(4326)#定义输出的坐标系统为WGS84
-            out_tif.SetProjection(srs.ExportToWkt())#给新建图层创建投影信息
-            for i in range(len(temp_time)):
-                raster_band = out_tif.GetRasterBand(i + 1)
-                raster_band.SetDescription(temp_time[i])
-                raster_band.SetNoDataValue(np.nan)
-                # arr[arr == miss_value] = np.nan
-                # arr = arr * 1000
-
-                raster_band.WriteArray(out_arr[count+i, ::-1, :])
-            out_tif.FlushCache()
-            del out_tif
-            count += len(temp_time)
-            for i in temp_time:
-                time.remove(i)
+        with profiler.stage("dates", index=_var):
+            time_var = data.variables['time']
+            dates = [str(t).split()[0] for t in nc.num2date(time_var[:], time_var.units, calendar=time_var.calendar)]
+
+        # Read one year's hyperslab at a time; the netCDF reads stay on this thread while
+        # GDAL compresses and writes earlier years on the pool
+        with ThreadPoolExecutor(max_workers=write_workers) as executor:
+            pending = []
+            for year, (start, stop) in tqdm(year_bounds(dates).items(), desc=_var):
+                with profiler.stage("read", year, _var) as record:
+                    out_arr = np.asarray(variable[start:stop])
+                    record["bytes_read"] = out_arr.nbytes
+                with profiler.stage("mask", year, _var):
+                    out_arr[out_arr==int(miss_value)] = np.nan
+                out_tif_name = os.path.join(output_folder1, _var + "_" + str(year) + '.tif')
+                pending.append(executor.submit(write_year_tif, out_tif_name, out_arr, dates[start:stop],
+                                               geotransform, projection, profiler, year, _var))
+
+                # Bound memory: wait for the oldest year once max_pending years are in flight
+                while len(pending) >= max_pending:
+                    pending.pop(0).result()
+            for future in pending:
+                future.result()
+        data.close()
 
-                
-                
-                
         # print('---script ending---')
         
         # resampling file
@@ -124,7 +124,10 @@ if __name__ == '__main__':
     start = time.time()
 
     # input_vars = ["tasmax", "tas", "sfcwind", "rsds", "hurs"]
-    main()
+    run = new_run_id("nc2tiff")
+    main(StageProfiler(stage_log, run))
     end = time.time()
     print("----------script ending----------")
-    print(f"time: {end - start}")
\ No newline at end of file
+    print(f"time: {end - start}")
+    if stage_log:
+        print_summary(load_records(stage_log, run))
\ No newline at end of file
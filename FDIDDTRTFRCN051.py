@@ -33,7 +33,6 @@ for year in tqdm(range(start_year, end_year + 1), desc="Computing FD, ID, DTR, T
         tn_data = src.read()
         meta = src.meta.copy()
         meta.update({"count": 1, "dtype": "float32", "compress": "lzw"})  # Adapt for single-band output
-        height, width = src.height, src.width
 
     # Read TX (maximum temperature)
     with rasterio.open(tmax_file) as src:
@@ -43,44 +42,23 @@ for year in tqdm(range(start_year, end_year + 1), desc="Computing FD, ID, DTR, T
     with rasterio.open(tmean_file) as src:
         tm_data = src.read()
 
-    # Initialise result arrays
-    fd = np.zeros((height, width), dtype=np.float32)
-    id = np.zeros((height, width), dtype=np.float32)
-    dtr = np.zeros((height, width), dtype=np.float32)
-    thaw_index = np.zeros((height, width), dtype=np.float32)  # Thawing index
-    freeze_index = np.zeros((height, width), dtype=np.float32)  # Freezing index
-
-    # Iterate over all pixels
-    for i in range(height):
-        for j in range(width):
-            tn_series = tn_data[:, i, j]  # TN time series
-            tx_series = tx_data[:, i, j]  # TX time series
-            tm_series = tm_data[:, i, j]  # TM time series
-
-            # Handle invalid values
-            if np.any(np.isnan(tn_series)) or np.any(np.isnan(tx_series)) or np.any(np.isnan(tm_series)):
-                fd[i, j] = np.nan
-                id[i, j] = np.nan
-                dtr[i, j] = np.nan
-                thaw_index[i, j] = np.nan
-                freeze_index[i, j] = np.nan
-                continue
-
-            # Calculate FD (Frost Days)
-            fd[i, j] = np.sum(tn_series < 0)
-
-            # Calculate ID (Ice Days)
-            id[i, j] = np.sum(tx_series < 0)
-
-            # Calculate DTR (Diurnal Temperature Range)
-            dtr[i, j] = np.mean(tx_series - tn_series)
-
-            # Calculate thawing index (cumulative absolute temperature > 0°C)
-            thaw_index[i, j] = np.sum(tm_series[tm_series > 0])
-
-            # Calculate freezing index (cumulative absolute temperature < 0°C)
-            print(tm_series[tm_series < 0].shape)
-            freeze_index[i, j] = np.abs(np.sum(tm_series[tm_series < 0]))
+    # Pixels with any missing day in TN, TX or TM are invalid for every index
+    nan_mask = np.isnan(tn_data).any(axis=0) | np.isnan(tx_data).any(axis=0) | np.isnan(tm_data).any(axis=0)
+
+    # Calculate FD (Frost Days) and ID (Ice Days)
+    fd = np.sum(tn_data < 0, axis=0, dtype=np.int32).astype(np.float32)
+    id = np.sum(tx_data < 0, axis=0, dtype=np.int32).astype(np.float32)
+
+    # Calculate DTR (Diurnal Temperature Range)
+    dtr = np.mean(tx_data - tn_data, axis=0, dtype=np.float32)
+
+    # Calculate thawing index (cumulative temperature > 0°C) and freezing index (cumulative |temperature| < 0°C)
+    thaw_index = np.sum(np.where(tm_data > 0, tm_data, 0), axis=0, dtype=np.float32)
+    freeze_index = np.abs(np.sum(np.where(tm_data < 0, tm_data, 0), axis=0, dtype=np.float32))
+
+    # Handle invalid values
+    for arr in (fd, id, dtr, thaw_index, freeze_index):
+        arr[nan_mask] = np.nan
 
     # Calculate TFR (thawing index / freezing index)
     tfr = np.divide(thaw_index, freeze_index, out=np.full_like(thaw_index, np.nan), where=freeze_index != 0)
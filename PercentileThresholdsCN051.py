@@ -0,0 +1,48 @@
+import os
+
+from percentile_thresholds import build_calendar_thresholds, build_store_thresholds
+
+# Input data paths
+data_dirs = {
+    "tmin": r"F:\phdl1\QTP_CN05.1_converted\tmin",
+    "tmax": r"F:\phdl1\QTP_CN05.1_converted\tmax",
+}
+
+# Optional time-contiguous cube stores (BuildCubeStoreCN051.py); variables listed here are read
+# from their store instead of the GeoTIFFs, e.g. {"tmin": r"F:\phdl1\QTP_CN05.1_cube\tmin"}
+store_dirs = {}
+
+# Output thresholds per variable: quantile -> GeoTIFF with one band per calendar day
+output_files = {
+    "tmin": {
+        10: r"F:\phdl1\climate extremes\TN10p\threshold\TNin10.tif",
+        90: r"F:\phdl1\climate extremes\TN90p\threshold\TNin90.tif",
+    },
+    "tmax": {
+        10: r"F:\phdl1\climate extremes\TX10p\threshold\TXin10.tif",
+        90: r"F:\phdl1\climate extremes\TX90p\threshold\TXin90.tif",
+    },
+}
+
+# Target baseline period
+start_year, end_year = 1961, 2014
+
+# Memory budget (MB) for the baseline record of one spatial tile
+memory_budget_mb = 1024
+
+# CF calendar of the daily band dates: "standard", "noleap"/"365_day" or "360_day" (e.g. CMIP6 models)
+calendar = "standard"
+
+years = range(start_year, end_year + 1)
+for var, quantile_files in output_files.items():
+    # All quantiles of a variable share one read and one sort of each 5-day window
+    if var in store_dirs:
+        build_store_thresholds(store_dirs[var], years, quantile_files, window=5, memory_budget_mb=memory_budget_mb,
+                               desc=f"Computing {var} thresholds")
+        continue
+
+    tif_files = [os.path.join(data_dirs[var], f"{var}_{year}.tif") for year in years]
+    build_calendar_thresholds(tif_files, quantile_files, window=5, memory_budget_mb=memory_budget_mb,
+                              calendar=calendar, desc=f"Computing {var} thresholds")
+
+print("TNin10, TNin90, TXin10 and TXin90 calculation completed.")
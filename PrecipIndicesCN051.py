@@ -0,0 +1,143 @@
+import os
+
+from build_manifest import BuildManifest, code_version
+from index_engine import (PRECIP_MODULES, build_valid_pixels, plan_outputs, process_precip_year, record_output,
+                          record_outputs, run_parameters, run_years)
+from numba_kernels import use_backend
+from precip_indices import PRECIP_INDICES
+from stage_profiler import load_records, new_run_id, print_summary, stage_profiler
+from threshold_cache import ThresholdCache
+from tiled_engine import run_tiled
+
+# Input precipitation data directory
+pre_dir = r"F:\phdl1\QTP_CN05.1_converted\pre"
+
+# Daily input backend (see daily_readers.py). The converted GeoTIFFs by default; the NetCDF
+# files can be read directly instead, skipping CN051_nc2tiff.py, e.g.
+#   readers = {"pre": {"backend": "netcdf", "paths": r"F:\phdl1\CN05.1\CN05.1_Pre_1961_2022_daily_025x025.nc",
+#                      "variable": "pre"}}
+# or, for CMIP6 precipitation flux in kg m-2 s-1:
+#   readers = {"pre": {"backend": "netcdf", "paths": [...], "variable": "pr", "scale": 86400}}
+# or the time-contiguous cube store written by BuildCubeStoreCN051.py (no decoding at all):
+#   readers = {"pre": {"backend": "store", "store_dir": r"F:\phdl1\QTP_CN05.1_cube\pre"}}
+readers = {"pre": {"backend": "geotiff", "data_dir": pre_dir, "prefix": "pre"}}
+
+# PRwn95 (needed for R95p) is looked up in the threshold cache, keyed by baseline years and a fingerprint
+# of the input files, and only built (from the reader above) when no matching entry exists
+threshold_cache_dir = r"F:\phdl1\climate extremes\threshold_cache"
+prune_threshold_cache = False  # Remove earlier builds of the same thresholds (see ThresholdCache.prune)
+baseline_start, baseline_end = 1961, 2014
+# PRwn95 file used as given instead of the cache, e.g. r"F:\phdl1\climate extremes\PRwn95\PRwn95_1961-2014.tif"
+prwn95_file = None
+
+# Output directories (same layout as the single-index scripts)
+output_base_dir = r"F:\phdl1\climate extremes"
+
+# Indices to compute; every one is derived from the same decoded year of precipitation.
+# Any RXnday window length and RXnday_DOY (day of year the maximum window ends on) can be added,
+# e.g. PRECIP_INDICES + ("RX3day", "RX1day_DOY", "RX5day_DOY")
+indices = PRECIP_INDICES
+output_dirs = {name: os.path.join(output_base_dir, name) for name in indices}
+
+# Processing year range
+start_year, end_year = 1961, 2014
+
+# Daily precipitation (mm) separating dry and wet days, and missing-day handling for CDD/CWD
+wet_threshold = 1.0
+nan_policy = "wet"
+
+# RXnday missing days: "zero" (count as 0, as RX1day&RX5dayCN051.py) or "skip" (ignore incomplete windows),
+# and whether windows may start in the previous year (costs a second read of each previous year)
+rx_nan_policy = "zero"
+rx_cross_year = False
+
+# Recompute only outputs whose inputs, PRwn95, code or settings changed since they were written
+# (recorded in the manifest file); False recomputes everything
+incremental = True
+manifest_file = os.path.join(output_base_dir, "precip_build_manifest.json")
+
+# Number of worker processes; years are independent, so each worker handles whole years (1 = serial)
+workers = 1
+
+# Per-pixel kernel backend (see the index_engine.py docstring)
+kernel_backend = "auto"  # "auto" (Numba if installed) or "numpy"
+
+# Background decoding and writing (see the index_engine.py docstring)
+prefetch_years = 1  # Years decoded ahead (0 = off)
+write_queue = 4  # Outputs queued for writing (0 = write synchronously)
+
+# Spatially tiled, resumable execution for large grids (see the index_engine.py docstring)
+tile_memory_mb = None  # MB of daily inputs per strip and worker (None = whole years)
+tile_work_dir = os.path.join(output_base_dir, "precip_tiles")
+
+# Stage timings of each run (see the index_engine.py docstring)
+stage_log = os.path.join(output_base_dir, "precip_stage_log.jsonl")  # None = off
+print_stage_summary = True
+
+config = {
+    "readers": readers,
+    "output_dirs": output_dirs,
+    "indices": indices,
+    "wet_threshold": wet_threshold,
+    "nan_policy": nan_policy,
+    "rx_nan_policy": rx_nan_policy,
+    "rx_cross_year": rx_cross_year,
+    "prefetch_years": prefetch_years,
+    "write_queue": write_queue,
+    "stage_log": stage_log,
+}
+
+
+def main():
+    use_backend(kernel_backend, threads=max(1, (os.cpu_count() or 1) // workers))  # Cores shared among workers
+    for name in indices:
+        os.makedirs(output_dirs[name], exist_ok=True)
+    config["stage_run"] = new_run_id("precip")  # Tags the records of this run, worker processes included
+    profiler = stage_profiler(config)
+
+    # PRwn95 from the cache, built there first if the inputs or baseline changed
+    config["prwn95_file"] = prwn95 = prwn95_file
+    if "R95p" in indices and prwn95 is None:
+        cache = ThresholdCache(threshold_cache_dir)
+        with profiler.stage("thresholds", index="R95p"):
+            config["prwn95_file"] = prwn95 = cache.wet_day_thresholds(readers["pre"], "pre", [95],
+                                                                      range(baseline_start, baseline_end + 1))[95]
+        if prune_threshold_cache:
+            print(f"Removed {len(cache.prune())} stale threshold rasters from the cache")
+    if "R95p" in indices and not os.path.exists(prwn95):
+        print(f"Warning: {prwn95} not found, R95p will be skipped...")
+        config["indices"] = [name for name in indices if name != "R95p"]
+
+    # Outputs to (re)compute and the years they need
+    years = range(start_year, end_year + 1)
+    manifest = BuildManifest(manifest_file, code_version(PRECIP_MODULES), run_parameters(config))
+    outputs = plan_outputs(manifest, years, config, incremental)
+    print(f"{len(outputs)} of {len(config['indices']) * len(years)} outputs to compute")
+    if not outputs:
+        return
+
+    # Compute only over cells inside the data mask (taken from the first year)
+    keep_files = [prwn95] if "R95p" in config["indices"] else []
+    if tile_memory_mb:
+        for name, year in run_tiled(process_precip_year, config, years, outputs, tile_work_dir, tile_memory_mb,
+                                    workers, code_version(PRECIP_MODULES), keep_files,
+                                    desc="Computing precipitation indices"):
+            record_output(manifest, config, name, year, years)
+        manifest.save()
+    else:
+        config["valid_pixels"] = pixels = build_valid_pixels(readers.values(), years, keep_files)
+        print(f"Computing over {pixels.count} valid cells ({pixels.fraction:.0%} of the grid)")
+
+        year_results = run_years(process_precip_year, config["year_indices"], config, workers,
+                                 desc="Computing precipitation indices")
+        for _ in record_outputs(year_results, manifest, config, outputs, years):
+            pass
+        manifest.save()
+
+    print("Precipitation indices calculation completed. Results saved to:", output_base_dir)
+    if stage_log and print_stage_summary:
+        print_summary(load_records(stage_log, config["stage_run"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,7 @@ from tqdm import tqdm
 # 📂 Directory settings
 pre_dir = r"F:\phdl1\QTP_CN05.1_converted\pre"  # Precipitation data directory
 output_dir = r"F:\phdl1\climate extremes\R95p"  # Result output directory
-prwn95_file = r"F:\phdl1\climate extremes\PRwn95\PRwn95.tif"  # Precomputed PRwn95 file
+prwn95_file = r"F:\phdl1\climate extremes\PRwn95\PRwn95_1961-2014.tif"  # Precomputed PRwn95 file (PRwn95CN051.py)
 os.makedirs(output_dir, exist_ok=True)
 
 # Load PRwn95
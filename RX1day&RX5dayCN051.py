@@ -3,52 +3,65 @@ import numpy as np
 import rasterio
 from tqdm import tqdm
 
+from precip_indices import rx_nday
+
 # Input data paths
 data_dir = r"F:\phdl1\QTP_CN05.1_converted\pre"
-output_dir_rx1 = r"F:\phdl1\climate extremes\RX1day"
-output_dir_rx5 = r"F:\phdl1\climate extremes\RX5day"
+output_base_dir = r"F:\phdl1\climate extremes"  # RX{n}day and RX{n}day_DOY subdirectories
 
-# Ensure output directories exist
-os.makedirs(output_dir_rx1, exist_ok=True)
-os.makedirs(output_dir_rx5, exist_ok=True)
+# Window lengths (days); all are computed from one cumulative sum, e.g. (1, 3, 5)
+windows = (1, 5)
+
+# Missing days: "zero" counts them as 0 (pixels missing on 1 January are NaN),
+# "skip" ignores every window containing a missing day
+nan_policy = "zero"
+
+# Let windows start in the previous year (a window belongs to the year it ends in)
+cross_year = False
+
+# Also write the day of year on which each maximum window ends (RX{n}day_DOY)
+save_day_of_year = True
 
 # Target computation years
 start_year, end_year = 1961, 2014
 
-# Compute RX1day and RX5day for each year
-for year in tqdm(range(start_year, end_year + 1), desc="Computing RX1day & RX5day"):
+# Ensure output directories exist
+output_dirs = {}
+for n in windows:
+    for name in [f"RX{n}day"] + ([f"RX{n}day_DOY"] if save_day_of_year else []):
+        output_dirs[name] = os.path.join(output_base_dir, name)
+        os.makedirs(output_dirs[name], exist_ok=True)
+
+# Compute RXnday for each year
+prev_days = None  # Last days of the previous year for cross-year windows
+for year in tqdm(range(start_year, end_year + 1), desc="Computing RXnday"):
     input_file = os.path.join(data_dir, f"pre_{year}.tif")
 
     with rasterio.open(input_file) as src:
-        num_days = src.count  # Number of days in the year (365 or 366)
         meta = src.meta.copy()
         meta.update({"count": 1, "dtype": "float32", "compress": "lzw"})  # Single-band output
 
         # Read all daily precipitation data
         pre_data = src.read().astype(np.float32)  # Shape (num_days, height, width)
-        nan_mask = np.isnan(pre_data[0])  # Record invalid value areas
-
-        # Compute RX1day (maximum daily precipitation)
-        rx1day = np.nanmax(pre_data, axis=0)
-        rx1day[nan_mask] = np.nan  # Handle invalid values
-
-        # Compute RX5day (maximum 5-day sliding window cumulative precipitation)
-        rx5day = np.full_like(rx1day, np.nan, dtype=np.float32)  # Initialise RX5day
-        for d in range(num_days - 4):  # Only slide until the 5th-to-last day
-            window_sum = np.nansum(pre_data[d:d+5], axis=0)  # Compute 5-day cumulative precipitation
-            rx5day = np.nanmax(np.stack([rx5day, window_sum]), axis=0)  # Progressively take maximum
-        rx5day[nan_mask] = np.nan  # Handle invalid values
-
-    # Save RX1day
-    output_file_rx1 = os.path.join(output_dir_rx1, f"RX1day_{year}.tif")
-    with rasterio.open(output_file_rx1, "w", **meta) as dst:
-        dst.write(rx1day, 1)
-        dst.set_band_description(1, f"RX1day_{year}")
-
-    # Save RX5day
-    output_file_rx5 = os.path.join(output_dir_rx5, f"RX5day_{year}.tif")
-    with rasterio.open(output_file_rx5, "w", **meta) as dst:
-        dst.write(rx5day, 1)
-        dst.set_band_description(1, f"RX5day_{year}")
-
-print("RX1day & RX5day calculation completed. Results saved.")
+
+    # The first year can still start from the previous year's file
+    tail_days = max(windows) - 1
+    if cross_year and prev_days is None and tail_days > 0:
+        prev_file = os.path.join(data_dir, f"pre_{year - 1}.tif")
+        if os.path.exists(prev_file):
+            with rasterio.open(prev_file) as src:
+                prev_days = src.read(list(range(src.count - tail_days + 1, src.count + 1))).astype(np.float32)
+
+    results = rx_nday(pre_data, windows, nan_policy, prev_days if cross_year else None)
+    prev_days = pre_data[pre_data.shape[0] - tail_days:] if tail_days > 0 else None
+
+    # Save RXnday (and the day of year of each maximum)
+    for n, (rx, day) in results.items():
+        outputs = [(f"RX{n}day", rx)] + ([(f"RX{n}day_DOY", day)] if save_day_of_year else [])
+        for name, data in outputs:
+            output_file = os.path.join(output_dirs[name], f"{name}_{year}.tif")
+            with rasterio.open(output_file, "w", **meta) as dst:
+                dst.write(data, 1)
+                dst.set_band_description(1, f"{name}_{year}")
+
+print("RXnday calculation completed. Results saved to:", output_base_dir)
@@ -0,0 +1,64 @@
+import os
+import sys
+
+from pipeline import Node, run_pipeline
+
+# Script pipelines: Node(name, script, dependencies, CPU cores, approximate peak memory in MB)
+# The memory figures are rough estimates for the QTP CN05.1 grid; adjust them to the data being processed.
+PIPELINES = {
+    # The single-index scripts listed in README.md
+    "scripts": [
+        Node("CN051_nc2tiff", "CN051_nc2tiff.py", [], 4, 3000),
+        Node("TNin10p", "TNin10p_CN051.py", ["CN051_nc2tiff"], 1, 1500),
+        Node("TXin10p", "TXin10p_CN051.py", ["CN051_nc2tiff"], 1, 1500),
+        Node("TNin90p", "TNin90p.py", ["CN051_nc2tiff"], 1, 1500),
+        Node("TXin90p", "TXin90p.py", ["CN051_nc2tiff"], 1, 1500),
+        Node("PRwn95", "PRwn95CN051.py", ["CN051_nc2tiff"], 1, 2000),
+        Node("TN10p", "TN10p_CN051.py", ["TNin10p"], 1, 1000),
+        Node("TX10p", "TX10p_CN051.py", ["TXin10p"], 1, 1000),
+        Node("TN90p", "TN90p.py", ["TNin90p"], 1, 1000),
+        Node("TX90p", "TX90p.py", ["TXin90p"], 1, 1000),
+        Node("WSDI", "WSDI_CN051.py", ["TXin90p"], 1, 1000),
+        Node("CSDI", "CSDI_CN051.py", ["TNin10p"], 1, 1000),
+        Node("TXxTXnTNxTNn", "TXxTXnTNxTNnCN051.py", ["CN051_nc2tiff"], 1, 1000),
+        Node("FDIDDTRTFR", "FDIDDTRTFRCN051.py", ["CN051_nc2tiff"], 1, 1500),
+        Node("FreezeAndThaw", "FreezeAndThawIndex.py", ["CN051_nc2tiff"], 1, 1000),
+        Node("RX1day&RX5day", "RX1day&RX5dayCN051.py", ["CN051_nc2tiff"], 1, 1000),
+        Node("SDII", "SDIICN051.py", ["CN051_nc2tiff"], 1, 1000),
+        Node("R1mm&R10mm", "R1mm&R10mmCN051.py", ["CN051_nc2tiff"], 1, 1000),
+        Node("CDD&CWD", "CDD&CWDCN051.py", ["CN051_nc2tiff"], 1, 1000),
+        Node("R95p", "R95pCN051.py", ["PRwn95"], 1, 1000),
+        Node("PRCPTOT", "PRCPTOTCN051.py", ["CN051_nc2tiff"], 1, 1000),
+    ],
+    # The fused engines, which build their thresholds in the threshold cache themselves
+    "engines": [
+        Node("CN051_nc2tiff", "CN051_nc2tiff.py", [], 4, 3000),
+        Node("TempIndices", "TempIndicesCN051.py", ["CN051_nc2tiff"], 1, 3000),
+        Node("PrecipIndices", "PrecipIndicesCN051.py", ["CN051_nc2tiff"], 1, 2000),
+    ],
+}
+
+# Pipeline to run
+pipeline = "scripts"
+
+# Global budget shared by all concurrently running scripts
+cpu_budget = os.cpu_count()
+memory_budget_mb = 16000
+
+# Pipeline state (completed nodes) and per-script logs
+state_dir = r"F:\phdl1\climate extremes\pipeline"
+state_file = os.path.join(state_dir, f"{pipeline}_state.json")
+log_dir = os.path.join(state_dir, "logs")
+
+# Skip the nodes completed by an earlier (failed or interrupted) run; False runs every node again
+resume = True
+
+if __name__ == "__main__":
+    status = run_pipeline(PIPELINES[pipeline], state_file, log_dir, cpu_budget, memory_budget_mb, resume,
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    for name, node_status in status.items():
+        print(f"{name:<16} {node_status}")
+    if any(node_status in ("failed", "blocked") for node_status in status.values()):
+        sys.exit(1)
+    print("Pipeline completed. Logs saved to:", log_dir)
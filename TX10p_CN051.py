@@ -2,7 +2,10 @@ import os
 import numpy as np
 import rasterio
 from tqdm import tqdm
-from datetime import datetime
+
+from bitpack import count_days, pack_exceedance
+from bootstrap import build_inbase_exceedance
+from calendar_index import day_of_year_index
 
 # Input data paths (tmax)
 data_dir = r"F:\phdl1\QTP_CN05.1_converted\tmax"
@@ -12,43 +15,51 @@ output_dir = r"F:\phdl1\climate extremes\TX10p\yearly"
 # Target baseline period
 start_year, end_year = 1961, 2014
 
+# CF calendar of the daily band dates (must match the threshold file): "standard", "noleap" or "360_day"
+calendar = "standard"
+
+# ETCCDI in-base bootstrap (see bootstrap.py): years of the TXin10 baseline are compared against the thresholds of
+# pseudo-baselines in which they are replaced by each other baseline year; later years use TXin10 as is
+inbase_bootstrap = False
+baseline_start, baseline_end = 1961, 2014  # Baseline TXin10 was computed over
+
 # Ensure output directory exists
 os.makedirs(output_dir, exist_ok=True)
 
 # Read TXin10 (10th percentile for baseline period)
 with rasterio.open(txin10_file) as src:
-    txin10 = src.read()  # Read all 366 days of 10th percentile values
+    txin10 = src.read()  # Read all calendar days of 10th percentile values
     meta = src.meta.copy()  # Copy metadata
     meta.update({"count": 1, "dtype": "float32", "compress": "lzw"})  # Adapt for single-band output
 
+# Bootstrapped TX10p of the in-base years, all from one pass over the baseline record
+inbase_tx10p = {}
+if inbase_bootstrap:
+    reader_spec = {"backend": "geotiff", "data_dir": data_dir, "prefix": "tmax", "calendar": calendar}
+    _, rates = build_inbase_exceedance(reader_spec, range(baseline_start, baseline_end + 1), {"TX10p": (10, False)},
+                                       desc="Bootstrapping in-base TX10p")
+    inbase_tx10p = rates["TX10p"]
+
 # Compute TX10p for each year
 for year in tqdm(range(start_year, end_year + 1), desc="Computing TX10p"):
     input_file = os.path.join(data_dir, f"tmax_{year}.tif")
 
     # Read maximum temperature data for the year
     with rasterio.open(input_file) as src:
-        num_days = src.count  # Number of days in the year (365 or 366)
-        tx10p = np.zeros((src.height, src.width), dtype=np.float32)  # Initialise TX10p count array
-        valid_pixel_count = np.zeros((src.height, src.width), dtype=np.float32)  # Count valid days
-        nan_mask = np.zeros((src.height, src.width), dtype=bool)  # Record which pixels should be NaN
-
-        for band in range(1, num_days + 1):  # 1-based index
-            date_str = src.descriptions[band - 1]  # Read date
-            _, month, day = map(int, date_str.split("-"))
-            day_of_year = (datetime(year, month, day) - datetime(year, 1, 1)).days  # 0-based
-
-            data = src.read(band)  # Read data for the day
-            invalid_mask = np.isnan(data)  # Invalid value mask
-            nan_mask |= invalid_mask  # Record whether pixel is invalid
+        data = src.read()  # Read all days of the year, shape (num_days, height, width)
+        day_of_year = day_of_year_index(src.descriptions, calendar)  # 0-based calendar day of every band
+        invalid_mask = np.isnan(data)  # Invalid value mask
 
-            # Calculate TX10p
-            tx10p += (data < txin10[day_of_year]).astype(np.float32)  # Count occurrences below TXin10
-            valid_pixel_count += (~invalid_mask).astype(np.float32)  # Count valid days
+        # Calculate TX10p: days below TXin10, bit-packed along time and counted by popcount
+        tx10p = count_days(pack_exceedance(data, txin10, day_of_year, above=False)).astype(np.float32)  # Count occurrences below TXin10
+        valid_pixel_count = np.sum(~invalid_mask, axis=0, dtype=np.int32).astype(np.float32)  # Count valid days
 
         # Calculate final percentage
         valid_mask = valid_pixel_count > 0  # Only compute for pixels with data
         tx10p[valid_mask] /= valid_pixel_count[valid_mask]  # Calculate TX10p percentage
         tx10p[~valid_mask] = np.nan  # Keep invalid areas as NaN
+        if year in inbase_tx10p:
+            tx10p = inbase_tx10p[year]  # In-base year: bootstrapped rate
 
         # Debug output
         print(f"Year {year}: Valid pixels count min={valid_pixel_count.min()}, max={valid_pixel_count.max()}")
@@ -0,0 +1,154 @@
+import os
+
+from build_manifest import BuildManifest, code_version
+from index_engine import (TEMP_MODULES, build_valid_pixels, merge_spell_summaries, plan_outputs, process_temp_year,
+                          record_output, record_outputs, resolve_temp_thresholds, run_parameters, run_years,
+                          write_inbase_exceedance)
+from numba_kernels import use_backend
+from stage_profiler import load_records, new_run_id, print_summary, stage_profiler
+from temp_indices import TEMP_INDICES
+from threshold_cache import ThresholdCache
+from tiled_engine import run_tiled
+
+# Input data paths
+input_dirs = {
+    "tmax": r"F:\phdl1\QTP_CN05.1_converted\tmax",
+    "tmin": r"F:\phdl1\QTP_CN05.1_converted\tmin",
+    "tm": r"F:\phdl1\QTP_CN05.1_converted\tmean",
+}
+
+# Daily input backend per variable (see daily_readers.py). The converted GeoTIFFs by default;
+# NetCDF files can be read directly instead, e.g. CN05.1
+#   readers["tmax"] = {"backend": "netcdf", "paths": r"F:\phdl1\CN05.1\CN05.1_Tmax_1961_2022_daily_025x025.nc",
+#                      "variable": "tmax"}
+# or CMIP6 near-surface temperature in K:
+#   readers["tmax"] = {"backend": "netcdf", "paths": [...], "variable": "tasmax", "offset": -273.15}
+# or the time-contiguous cube store written by BuildCubeStoreCN051.py (no decoding at all):
+#   readers["tmax"] = {"backend": "store", "store_dir": r"F:\phdl1\QTP_CN05.1_cube\tmax"}
+# Day-of-year slots follow the reader's calendar (from the CF time axis; pass "calendar": "noleap"
+# etc. to the geotiff backend for converted model output), which must match the threshold files.
+readers = {var: {"backend": "geotiff", "data_dir": data_dir, "prefix": var} for var, data_dir in input_dirs.items()}
+
+# Calendar-day percentile thresholds (one band per calendar day) are looked up in the threshold cache,
+# keyed by variable, quantile, window, baseline years and a fingerprint of the input files, and only
+# built (from the readers above) when no matching entry exists
+threshold_cache_dir = r"F:\phdl1\climate extremes\threshold_cache"
+prune_threshold_cache = False  # Remove earlier builds of the same thresholds (see ThresholdCache.prune)
+baseline_start, baseline_end = 1961, 2014
+threshold_window = 5
+memory_budget_mb = 1024  # Per spatial tile while building thresholds
+
+# ETCCDI in-base bootstrap of TN10p/TX10p/TN90p/TX90p (see bootstrap.py): baseline years are compared against
+# the thresholds of pseudo-baselines in which they are replaced by each other baseline year, all from one pass
+# over the baseline per variable; years after the baseline use the thresholds above. False uses them for every year
+inbase_bootstrap = False
+
+# Threshold files used as given instead of the cache, e.g.
+#   {"TNin10": r"F:\phdl1\climate extremes\TN10p\threshold\TNin10.tif"}
+threshold_files = {}
+
+# Output directories (same layout as the single-index scripts)
+output_base_dir = r"F:\phdl1\climate extremes"
+output_dirs = {name: os.path.join(output_base_dir, name) for name in TEMP_INDICES}
+for name in ("TN10p", "TX10p", "TN90p", "TX90p", "WSDI", "CSDI"):
+    output_dirs[name] = os.path.join(output_base_dir, name, "yearly")
+
+# Indices to compute; each daily variable is decoded at most once per year
+indices = TEMP_INDICES
+
+# Target baseline period
+start_year, end_year = 1961, 2014
+TFR_max = 1000  # Set maximum allowable (thaw-freeze rate) TFR value
+
+# Recompute only outputs whose inputs, thresholds, code or settings changed since they were written
+# (recorded in the manifest file); False recomputes everything
+incremental = True
+manifest_file = os.path.join(output_base_dir, "temp_build_manifest.json")
+
+# Number of worker processes (1 = serial). Years run independently; WSDI/CSDI are
+# chained across years afterwards, so results match the serial run.
+workers = 1
+
+# Per-pixel kernel backend (see the index_engine.py docstring)
+kernel_backend = "auto"  # "auto" (Numba if installed) or "numpy"
+
+# Background decoding and writing (see the index_engine.py docstring)
+prefetch_years = 1  # Years decoded ahead (0 = off)
+write_queue = 4  # Outputs queued for writing (0 = write synchronously)
+
+# Spatially tiled, resumable execution for large grids (see the index_engine.py docstring)
+tile_memory_mb = None  # MB of daily inputs per strip and worker (None = whole years)
+tile_work_dir = os.path.join(output_base_dir, "temp_tiles")
+
+# Stage timings of each run (see the index_engine.py docstring)
+stage_log = os.path.join(output_base_dir, "temp_stage_log.jsonl")  # None = off
+print_stage_summary = True
+
+config = {
+    "readers": readers,
+    "output_dirs": output_dirs,
+    "indices": indices,
+    "tfr_max": TFR_max,
+    "prefetch_years": prefetch_years,
+    "write_queue": write_queue,
+    "stage_log": stage_log,
+}
+if inbase_bootstrap:
+    config["inbase_bootstrap"] = {"years": list(range(baseline_start, baseline_end + 1)), "window": threshold_window}
+
+
+def main():
+    use_backend(kernel_backend, threads=max(1, (os.cpu_count() or 1) // workers))  # Cores shared among workers
+    for name in indices:
+        os.makedirs(output_dirs[name], exist_ok=True)
+    config["stage_run"] = new_run_id("temp")  # Tags the records of this run, worker processes included
+    profiler = stage_profiler(config)
+
+    # Thresholds from the cache, built there first if the inputs or baseline changed
+    cache = ThresholdCache(threshold_cache_dir)
+    with profiler.stage("thresholds", index=indices):
+        config["threshold_files"] = resolve_temp_thresholds(indices, readers, cache,
+                                                            range(baseline_start, baseline_end + 1),
+                                                            threshold_window, threshold_files, memory_budget_mb)
+    if prune_threshold_cache:
+        print(f"Removed {len(cache.prune())} stale threshold rasters from the cache")
+
+    # Outputs to (re)compute and the years they need
+    years = range(start_year, end_year + 1)
+    manifest = BuildManifest(manifest_file, code_version(TEMP_MODULES), run_parameters(config))
+    outputs = plan_outputs(manifest, years, config, incremental)
+    print(f"{len(outputs)} of {len(indices) * len(years)} outputs to compute")
+    if not outputs:
+        return
+
+    if tile_memory_mb:
+        # Strip by strip, spells chained per strip after all years
+        for name, year in run_tiled(process_temp_year, config, years, outputs, tile_work_dir, tile_memory_mb,
+                                    workers, code_version(TEMP_MODULES), desc="Computing temperature indices"):
+            record_output(manifest, config, name, year, years)
+        manifest.save()
+    else:
+        # Compute only over cells inside the data mask (taken from the first year)
+        config["valid_pixels"] = pixels = build_valid_pixels(readers.values(), years)
+        print(f"Computing over {pixels.count} valid cells ({pixels.fraction:.0%} of the grid)")
+
+        # Thresholds are read once per process; spells are merged in year order as results arrive
+        year_results = run_years(process_temp_year, config["year_indices"], config, workers,
+                                 desc="Computing temperature indices")
+        year_results = record_outputs(year_results, manifest, config, outputs, years)
+        for name, year in merge_spell_summaries(year_results, output_dirs, pixels, outputs, profiler):
+            record_output(manifest, config, name, year, years)
+        manifest.save()
+
+    # Bootstrapped in-base years of the percentile-exceedance indices
+    for name, year in write_inbase_exceedance(config, outputs, memory_budget_mb):
+        record_output(manifest, config, name, year, years)
+    manifest.save()
+
+    print("Temperature indices calculation completed. Results saved to:", output_base_dir)
+    if stage_log and print_stage_summary:
+        print_summary(load_records(stage_log, config["stage_run"]))
+
+
+if __name__ == "__main__":
+    main()
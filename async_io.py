@@ -0,0 +1,130 @@
+"""
+Overlap input decoding and output writing with computation.
+
+GDAL releases the GIL while it decodes and compresses GeoTIFFs, so a
+background thread can decode the next year or write finished rasters while
+the main thread computes indices.
+
+- :class:`PrefetchingReader` wraps a daily reader (see daily_readers.py) so
+  that reading year N queues the decode of the following planned year(s)
+  on a background thread (double buffering with ``depth=1``).
+- :class:`AsyncWriter` writes single-band rasters on a background thread
+  through a bounded queue; ``write`` blocks only while the queue is full.
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import rasterio
+
+from stage_profiler import StageProfiler
+
+# Prefetching wrappers of this process, keyed by the wrapped reader
+_prefetch_cache = {}
+
+
+class PrefetchingReader:
+    """
+    A daily reader whose ``read_year`` decodes the next ``depth`` planned years ahead on a background thread.
+
+    Only the years of ``planned_years`` (set by :func:`prefetching`) are
+    prefetched, so nothing is decoded past the last year a run or a worker's
+    block of years will read; without a plan, nothing is. All reads of the
+    wrapped reader run on that one thread, so backends whose file handles are
+    not thread-safe (netCDF4) are never read concurrently. Other attributes
+    (``years``, ``has_year``, ``calendar``, ...) are those of the wrapped
+    reader.
+    """
+
+    def __init__(self, reader, depth=1):
+        self.reader = reader
+        self.depth = depth
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = {}  # year -> Future of reader.read_year(year)
+        self.newest = None  # Latest year requested so far
+        self.planned_years = []  # Years the caller will read, in order
+
+    def __getattr__(self, name):
+        return getattr(self.reader, name)
+
+    def read_year(self, year):
+        future = self.pending.pop(year, None)
+        if future is None:
+            future = self.executor.submit(self.reader.read_year, year)
+
+        # Years that were prefetched but skipped are not needed anymore
+        for skipped in [y for y in self.pending if y < year]:
+            self.pending.pop(skipped).cancel()
+
+        # Queue the planned years after the newest one requested (looking back, e.g. at year - 1, queues nothing new)
+        self.newest = year if self.newest is None else max(self.newest, year)
+        upcoming = [y for y in self.planned_years if y > self.newest and self.reader.has_year(y)]
+        for next_year in upcoming[:self.depth]:
+            if next_year not in self.pending:
+                self.pending[next_year] = self.executor.submit(self.reader.read_year, next_year)
+        return future.result()
+
+
+def prefetching(reader, depth=1, planned_years=()):
+    """
+    The (per-process) :class:`PrefetchingReader` of ``reader``, or ``reader`` itself if ``depth`` is 0.
+
+    ``planned_years`` replaces the years the wrapper may prefetch.
+    """
+    if depth <= 0:
+        return reader
+    if id(reader) not in _prefetch_cache:
+        _prefetch_cache[id(reader)] = PrefetchingReader(reader, depth)
+    _prefetch_cache[id(reader)].planned_years = sorted(planned_years)
+    return _prefetch_cache[id(reader)]
+
+
+class AsyncWriter:
+    """
+    Write single-band rasters on a background thread, at most ``max_pending`` queued at a time.
+
+    Use as a context manager: leaving it waits for all writes and re-raises
+    the first write error. The arrays passed to :meth:`write` must not be
+    modified afterwards. Writes are timed as "write" stages of ``profiler``
+    (see stage_profiler.py).
+    """
+
+    def __init__(self, max_pending=4, profiler=None):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.profiler = profiler or StageProfiler()
+        self.errors = []
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, path, data, meta, description, year=None, index=None):
+        self.queue.put((path, data, meta, description, year, index))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            path, data, meta, description, year, index = item
+            try:
+                with self.profiler.stage("write", year, index) as record:
+                    with rasterio.open(path, "w", **meta) as dst:
+                        dst.write(data, 1)
+                        dst.set_band_description(1, description)
+                    record["bytes_written"] = os.path.getsize(path)
+            except Exception as e:
+                self.errors.append(e)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.errors:
+            raise self.errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
@@ -0,0 +1,143 @@
+"""
+Benchmark every index script on synthetic CN05.1-like archives.
+
+For each grid size a synthetic archive is generated once (see
+synthetic_cn051.py), then every script of the "scripts" pipeline
+(RunPipelineCN051.py: nc2tiff conversion, thresholds, TN10p ... PRCPTOT,
+WSDI/CSDI) and the fused engines run in dependency order, each in its own
+process (run_script.py). Every run is appended to a JSON-lines log with the
+code version, its time, throughput in grid pixel-days per second and peak
+resident memory, and the summary table compares each script with its last
+run at another code version, so regressions show up between versions.
+"""
+
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import numba_kernels  # noqa: E402
+from pipeline import topological_order  # noqa: E402
+from RunPipelineCN051 import PIPELINES  # noqa: E402
+from synthetic_cn051 import generate  # noqa: E402
+
+# Synthetic archives (one per grid) and the benchmark log (kept across runs, ignored by git)
+bench_root = os.path.join(tempfile.gettempdir(), "cn051_benchmarks")
+results_file = os.path.join(BENCH_DIR, "results", "benchmarks.jsonl")
+
+# Grid sizes (rows, columns); CN05.1 over the QTP at 0.25 degree is in the range of "qtp"
+grids = {
+    "small": (40, 80),
+    "qtp": (100, 180),
+}
+
+# Synthetic period; the scripts' 1961-2014 period and baseline are cut to end in end_year
+start_year, end_year = 1961, 1970
+
+# Scripts to time, in dependency order: the single-index scripts, then the fused engines
+scripts = [node.script for node in topological_order(PIPELINES["scripts"])]
+scripts += ["PercentileThresholdsCN051.py", "TempIndicesCN051.py", "PrecipIndicesCN051.py"]
+
+
+def code_version():
+    """Short commit hash of the repository, with "-dirty" if tracked files are modified."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if dirty else "")
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def previous_result(results, result):
+    """Latest earlier successful run of the same script and setup at another code version, or None."""
+    key = ("grid_shape", "years", "script")
+    for earlier in reversed(results):
+        if (all(earlier[k] == result[k] for k in key) and earlier["version"] != result["version"]
+                and earlier["status"] == "done"):
+            return earlier
+    return None
+
+
+def run_script(script, root, log_dir):
+    """Run one script on the archive under ``root``; returns run_script.py's result."""
+    result_file = os.path.join(log_dir, "result.json")
+    if os.path.exists(result_file):
+        os.remove(result_file)
+    with open(os.path.join(log_dir, os.path.splitext(script)[0] + ".log"), "w") as log:
+        subprocess.run([sys.executable, os.path.join(BENCH_DIR, "run_script.py"), script, root, str(end_year),
+                        result_file], stdout=log, stderr=subprocess.STDOUT)
+    if not os.path.exists(result_file):  # The runner itself crashed
+        return {"seconds": None, "peak_rss_mb": None, "status": "failed"}
+    with open(result_file) as f:
+        return json.load(f)
+
+
+def main():
+    version = code_version()
+    history = load_results(results_file)
+    os.makedirs(os.path.dirname(results_file), exist_ok=True)
+    environment = {"version": version, "host": platform.node(), "python": platform.python_version(),
+                   "numpy": np.__version__, "kernels": "numba" if numba_kernels.enabled() else "numpy"}
+
+    rows = []
+    for grid, (height, width) in grids.items():
+        root = os.path.join(bench_root, grid)
+        print(f"Generating the {grid} archive ({height} x {width}, {start_year}-{end_year})")
+        valid_cells = generate(root, range(start_year, end_year + 1), height, width)
+        pixel_days = height * width * sum((datetime.date(year + 1, 1, 1) - datetime.date(year, 1, 1)).days
+                                          for year in range(start_year, end_year + 1))
+
+        # Start from no outputs, so incremental engines and caches are timed cold
+        for outputs in ("climate extremes", "QTP_CN05.1_cube"):
+            shutil.rmtree(os.path.join(root, "phdl1", outputs), ignore_errors=True)
+        log_dir = os.path.join(root, "logs")
+        os.makedirs(log_dir, exist_ok=True)
+
+        for script in scripts:
+            run = run_script(script, root, log_dir)
+            result = dict(environment, timestamp=datetime.datetime.now().isoformat(timespec="seconds"), grid=grid,
+                          grid_shape=[height, width], valid_cells=valid_cells, years=[start_year, end_year],
+                          script=script, **run)
+            result["pixel_days_per_second"] = pixel_days / run["seconds"] if run["status"] == "done" else None
+            with open(results_file, "a") as f:
+                f.write(json.dumps(result) + "\n")
+            rows.append((result, previous_result(history, result)))
+            print(f"  {script:<32} {run['status']:<7} {run['seconds'] or 0:8.2f} s")
+
+    print(f"\nVersion {version}, kernels: {environment['kernels']}; logs in {bench_root}")
+    print(f"{'grid':<7} {'script':<32} {'seconds':>9} {'Mpx-days/s':>11} {'peak MB':>8}  change")
+    for result, previous in rows:
+        if result["status"] != "done":
+            print(f"{result['grid']:<7} {result['script']:<32} {'failed':>9}")
+            continue
+        change = ""
+        if previous is not None:
+            change = f"{result['seconds'] / previous['seconds'] - 1:+.0%} vs {previous['version']}"
+        peak = f"{result['peak_rss_mb']:8.0f}" if result["peak_rss_mb"] is not None else f"{'-':>8}"
+        print(f"{result['grid']:<7} {result['script']:<32} {result['seconds']:9.2f} "
+              f"{result['pixel_days_per_second'] / 1e6:11.2f} {peak}  {change}")
+    print("Results appended to:", results_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Run one index script against a synthetic archive and report its time and peak memory.
+
+Usage: python run_script.py <script> <root> <end_year> <result_json>
+
+The script's ``F:\\`` paths are redirected below ``<root>`` and its period
+(1961-2014) is cut to end in ``<end_year>``; the script then runs unchanged
+as ``__main__``. The result file receives the seconds spent in the script,
+the peak resident memory of this process and its children in MB and whether
+it completed.
+"""
+
+import json
+import os
+import re
+import sys
+import time
+import traceback
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def redirect_source(source, root, end_year):
+    """Script source with its F: paths under ``root`` (forward slashes) and its end year replaced."""
+    root = root.replace("\\", "/").rstrip("/")
+    source = re.sub(r'r"F:\\([^"]*)"', lambda m: '"' + root + "/" + m.group(1).replace("\\", "/") + '"', source)
+    source = re.sub(r'"F:\\\\([^"]*)"', lambda m: '"' + root + "/" + m.group(1).replace("\\\\", "/") + '"', source)
+    source = source.replace('"\\\\', '"/')  # Path pieces joined with "\\" (CN051_nc2tiff.py)
+    return re.sub(r"\b2014\b", str(end_year), source)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and its finished children, in MB (None if unavailable)."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 1024 ** 2
+    peak = max(resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024  # Bytes on macOS, KB elsewhere
+
+
+def main():
+    script, root, end_year, result_file = sys.argv[1:5]
+    with open(os.path.join(REPO_DIR, script), encoding="utf-8") as f:
+        source = redirect_source(f.read(), root, int(end_year))
+
+    os.chdir(REPO_DIR)
+    sys.path.insert(0, REPO_DIR)
+    sys.argv = [script]
+    status = "done"
+    start = time.perf_counter()
+    try:
+        exec(compile(source, script, "exec"), {"__name__": "__main__", "__file__": os.path.join(REPO_DIR, script)})
+    except SystemExit as e:
+        status = "done" if not e.code else "failed"
+    except Exception:
+        traceback.print_exc()
+        status = "failed"
+    seconds = time.perf_counter() - start
+
+    with open(result_file, "w") as f:
+        json.dump({"seconds": seconds, "peak_rss_mb": peak_rss_mb(), "status": status}, f)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Synthetic CN05.1-like daily data for the benchmarks.
+
+Writes yearly multi-band GeoTIFFs laid out like the converted CN05.1 archive
+(``<root>/phdl1/QTP_CN05.1_converted/{tmax,tmin,tmean,pre}/{prefix}_{year}.tif``,
+one LZW-compressed float32 band per day described as ``YYYY-MM-DD``, NaN
+outside a plateau-shaped mask), plus the CN05.1 precipitation NetCDF read by
+CN051_nc2tiff.py. ``<root>`` stands for ``F:\\`` of the index scripts.
+
+Temperatures follow a seasonal cycle that cools with elevation plus spatially
+smooth, day-to-day correlated anomalies; precipitation has a monsoon-shaped
+wet-day probability and gamma-distributed amounts. The values are meant to
+exercise the code paths realistically (spells, ties, wet/dry runs), not to
+reproduce the climate.
+"""
+
+import datetime
+import json
+import os
+
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+
+# Variables of the converted archive: directory -> file prefix
+VARIABLES = {"tmax": "tmax", "tmin": "tmin", "tmean": "tm", "pre": "pre"}
+
+# Grid origin and resolution of CN05.1 (0.25 degree)
+WEST, NORTH, RESOLUTION = 73.0, 40.0, 0.25
+
+# Written last; a root with a matching stamp is reused instead of regenerated
+STAMP_FILE = "synthetic.json"
+
+
+def plateau_mask(height, width, rng):
+    """Boolean (height, width) mask of an irregular plateau-shaped blob covering roughly 60% of the grid."""
+    rows, cols = np.mgrid[0:height, 0:width]
+    y = (rows + 0.5) / height * 2 - 1
+    x = (cols + 0.5) / width * 2 - 1
+    angle = np.arctan2(y, x)
+    radius = 0.85 + sum(0.08 / k * np.sin(k * angle + rng.uniform(0, 2 * np.pi)) for k in range(2, 6))
+    return np.hypot(x * 1.1, y * 1.3) < radius
+
+
+def smooth_field(height, width, rng, scale=8):
+    """Spatially smooth standard-normal-ish field (bilinear upsampling of a coarse random grid)."""
+    coarse = rng.standard_normal((height // scale + 2, width // scale + 2))
+    y = np.linspace(0, coarse.shape[0] - 1.001, height)
+    x = np.linspace(0, coarse.shape[1] - 1.001, width)
+    y0, x0 = y.astype(int), x.astype(int)
+    fy, fx = (y - y0)[:, None], (x - x0)[None, :]
+    top = coarse[y0][:, x0] * (1 - fx) + coarse[y0][:, x0 + 1] * fx
+    bottom = coarse[y0 + 1][:, x0] * (1 - fx) + coarse[y0 + 1][:, x0 + 1] * fx
+    return top * (1 - fy) + bottom * fy
+
+
+def year_dates(year):
+    start = datetime.date(year, 1, 1)
+    days = (datetime.date(year + 1, 1, 1) - start).days
+    return [(start + datetime.timedelta(days=d)).isoformat() for d in range(days)]
+
+
+class SyntheticClimate:
+    """Daily tmax, tmin, tmean and precipitation on one grid, generated year after year."""
+
+    def __init__(self, height, width, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.shape = (height, width)
+        self.mask = plateau_mask(height, width, self.rng)
+        self.elevation = 4000 + 700 * smooth_field(height, width, self.rng)  # m
+        self.latitude = NORTH - RESOLUTION * (np.arange(height) + 0.5)
+        self.anomaly = np.zeros(self.shape)  # Temperature anomaly carried from day to day
+
+    def year(self, year):
+        """{directory: (days, H, W) float32} and the band dates of one year."""
+        dates = year_dates(year)
+        day_of_year = np.arange(len(dates))
+        season = -np.cos(2 * np.pi * (day_of_year - 15) / len(dates))  # -1 mid-January, 1 mid-July
+
+        # Mean temperature: lapse rate, latitude gradient, seasonal cycle and AR(1) anomalies
+        base = 15 - 0.0065 * (self.elevation - 3000) - 0.4 * (self.latitude[:, None] - 32)
+        tmean = np.empty((len(dates),) + self.shape, dtype=np.float32)
+        for d in range(len(dates)):
+            self.anomaly = 0.8 * self.anomaly + 1.8 * smooth_field(*self.shape, self.rng)
+            tmean[d] = base + 11 * season[d] + self.anomaly
+        dtr = np.clip(14 - 2 * season[:, None, None] + 2 * self.rng.standard_normal(tmean.shape), 2, None)
+
+        # Precipitation: monsoon-shaped wet-day probability, gamma amounts, dry days exactly 0
+        wet_probability = 0.08 + 0.5 * np.clip(season, 0, None)[:, None, None] ** 2
+        wet = self.rng.random(tmean.shape) < wet_probability
+        amount = self.rng.gamma(0.8, 2 + 6 * np.clip(season, 0, None)[:, None, None], size=tmean.shape)
+        pre = np.where(wet, np.round(amount, 1), 0)
+
+        data = {"tmean": tmean, "tmax": tmean + dtr / 2, "tmin": tmean - dtr / 2, "pre": pre}
+        for name, values in data.items():
+            values = np.round(values, 2).astype(np.float32)  # Same precision as CN05.1
+            values[:, ~self.mask] = np.nan
+            data[name] = values
+        return data, dates
+
+
+def grid_meta(height, width, count):
+    return {"driver": "GTiff", "dtype": "float32", "nodata": np.nan, "width": width, "height": height,
+            "count": count, "crs": CRS.from_epsg(4326), "transform": from_origin(WEST, NORTH, RESOLUTION, RESOLUTION),
+            "compress": "lzw"}
+
+
+def write_year(path, data, dates):
+    with rasterio.open(path, "w", **grid_meta(data.shape[1], data.shape[2], len(dates))) as dst:
+        dst.write(data)
+        for band, date in enumerate(dates, start=1):
+            dst.set_band_description(band, date)
+
+
+def write_netcdf(path, years, pre_years):
+    """CN05.1-style precipitation NetCDF (time, lat ascending, lon) with a -99 missing value."""
+    import netCDF4 as nc
+
+    first = datetime.date(years[0], 1, 1)
+    height, width = pre_years[0].shape[1:]
+    with nc.Dataset(path, "w") as ds:
+        ds.createDimension("time", None)
+        ds.createDimension("lat", height)
+        ds.createDimension("lon", width)
+        time = ds.createVariable("time", "f8", ("time",))
+        time.units = f"days since {first.isoformat()}"
+        time.calendar = "standard"
+        ds.createVariable("lat", "f4", ("lat",))[:] = NORTH - RESOLUTION * (np.arange(height)[::-1] + 0.5)
+        ds.createVariable("lon", "f4", ("lon",))[:] = WEST + RESOLUTION * (np.arange(width) + 0.5)
+        pre = ds.createVariable("pre", "f4", ("time", "lat", "lon"), fill_value=-99.0)
+        pre.missing_value = -99.0
+
+        start = 0
+        for data in pre_years:
+            time[start:start + len(data)] = np.arange(start, start + len(data))
+            pre[start:start + len(data)] = np.where(np.isnan(data), -99.0, data)[:, ::-1, :]
+            start += len(data)
+
+
+def generate(root, years, height, width, seed=0, netcdf=True):
+    """
+    Write the synthetic archive for ``years`` on a ``height`` x ``width`` grid under ``root``.
+
+    An existing archive with the same settings is reused. Returns the number
+    of grid cells inside the plateau mask.
+    """
+    years = list(years)
+    settings = {"years": years, "height": height, "width": width, "seed": seed, "netcdf": netcdf}
+    stamp_path = os.path.join(root, STAMP_FILE)
+    if os.path.exists(stamp_path):
+        with open(stamp_path) as f:
+            stamp = json.load(f)
+        if stamp["settings"] == settings:
+            return stamp["valid_cells"]
+
+    climate = SyntheticClimate(height, width, seed)
+    converted_dir = os.path.join(root, "phdl1", "QTP_CN05.1_converted")
+    for directory in VARIABLES:
+        os.makedirs(os.path.join(converted_dir, directory), exist_ok=True)
+
+    pre_years = []
+    for year in years:
+        data, dates = climate.year(year)
+        for directory, prefix in VARIABLES.items():
+            write_year(os.path.join(converted_dir, directory, f"{prefix}_{year}.tif"), data[directory], dates)
+        if netcdf:
+            pre_years.append(data["pre"])
+
+    if netcdf:
+        # Input and output folders of CN051_nc2tiff.py
+        nc_dir = os.path.join(root, "CN05.1", "00 - CN051-2021", "1961-2021")
+        os.makedirs(nc_dir, exist_ok=True)
+        os.makedirs(os.path.join(root, "CN05.1_converted", "pre"), exist_ok=True)
+        write_netcdf(os.path.join(nc_dir, "CN05.1_Pre_1961_2021_daily_025x025.nc"), years, pre_years)
+
+    valid_cells = int(climate.mask.sum())
+    with open(stamp_path, "w") as f:
+        json.dump({"settings": settings, "valid_cells": valid_cells}, f, indent=1)
+    return valid_cells
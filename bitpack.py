@@ -0,0 +1,131 @@
+"""
+Exceedance masks bit-packed along the time axis (8 days per byte).
+
+A packed mask has shape (ceil(days / 8), H, W) and dtype uint8; day ``d`` is
+bit ``d % 8`` of byte ``d // 8``. Day counts (TN10p, TX90p, ...) are popcounts
+and the WSDI/CSDI run statistics are scanned byte by byte with 256-entry
+lookup tables, so the (days, H, W) bool mask is never held in memory.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+import numba_kernels
+from spell_kernel import SPELL_MIN_LENGTH, apply_carry_over
+
+# Set bits of every byte value
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def pack_days(mask):
+    """Pack a (days, ...) bool mask into bytes along the time axis."""
+    return np.packbits(mask, axis=0, bitorder="little")
+
+
+def unpack_days(packed, num_days):
+    """Inverse of :func:`pack_days`."""
+    return np.unpackbits(packed, axis=0, count=num_days, bitorder="little").astype(bool)
+
+
+def pack_exceedance(data, threshold, day_of_year, above, block_days=64):
+    """
+    Packed mask of valid days beyond the calendar-day threshold.
+
+    Equivalent to packing ``(data > threshold[day_of_year]) & ~isnan(data)`` (or
+    ``<`` when ``above`` is False), but only ``block_days`` days are unpacked at a time.
+    ``block_days`` must be a positive multiple of 8, so that blocks start on byte boundaries.
+    """
+    if block_days < 8 or block_days % 8:
+        raise ValueError(f"block_days must be a positive multiple of 8: {block_days!r}")
+    num_days = data.shape[0]
+    packed = np.empty(((num_days + 7) // 8,) + data.shape[1:], dtype=np.uint8)
+    for start in range(0, num_days, block_days):
+        block = data[start:start + block_days]
+        day_threshold = threshold[day_of_year[start:start + block_days]]
+        mask = block > day_threshold if above else block < day_threshold
+        mask &= ~np.isnan(block)
+        packed[start // 8:(start + block.shape[0] + 7) // 8] = pack_days(mask)
+    return packed
+
+
+def count_days(packed):
+    """Number of set days per pixel (popcount along time), int32."""
+    counts = np.bitwise_count(packed) if hasattr(np, "bitwise_count") else _POPCOUNT[packed]
+    return counts.sum(axis=0, dtype=np.int32)
+
+
+@lru_cache(maxsize=None)
+def _byte_tables(num_bits, min_length):
+    """
+    Per-byte-value run tables for a byte holding ``num_bits`` days.
+
+    ``lead``: run of set bits from the first day (``num_bits`` if all set);
+    ``trail``: run of set bits ending on the last day;
+    ``inner``: days in runs of at least ``min_length`` touching neither end.
+    """
+    lead = np.zeros(256, dtype=np.int32)
+    trail = np.zeros(256, dtype=np.int32)
+    inner = np.zeros(256, dtype=np.int32)
+    for value in range(256):
+        bits = [(value >> i) & 1 for i in range(num_bits)]
+        runs, start = [], None  # (start, stop) of every run of set bits
+        for i, bit in enumerate(bits + [0]):
+            if bit and start is None:
+                start = i
+            elif not bit and start is not None:
+                runs.append((start, i))
+                start = None
+        for start, stop in runs:
+            if start == 0:
+                lead[value] = stop
+            if stop == num_bits:
+                trail[value] = stop - start
+            if start > 0 and stop < num_bits and stop - start >= min_length:
+                inner[value] += stop - start
+    return lead, trail, inner
+
+
+def packed_spell_summary(packed, num_days, min_length=SPELL_MIN_LENGTH):
+    """
+    :func:`spell_kernel.spell_summary` computed directly on a packed mask.
+
+    Returns ``(closed_spell_days, lead, year_end_tail)``: days in runs of at
+    least ``min_length`` that end before the last day, the leading run length
+    and the run length ending on the last day.
+    """
+    if numba_kernels.enabled():
+        return numba_kernels.packed_spell_summary(packed, num_days, min_length)
+
+    shape = packed.shape[1:]
+    run = np.zeros(shape, dtype=np.int32)  # Run ending on the last day scanned so far
+    closed_spell_days = np.zeros(shape, dtype=np.int32)
+    lead = np.full(shape, num_days, dtype=np.int32)
+    in_lead = np.ones(shape, dtype=bool)  # Leading run of the year not yet ended
+
+    for index in range(packed.shape[0]):
+        num_bits = min(8, num_days - 8 * index)
+        lead_table, trail_table, inner_table = _byte_tables(num_bits, min_length)
+        byte = packed[index]
+        if num_bits < 8:
+            byte = byte & ((1 << num_bits) - 1)
+
+        # Unless the whole byte is set, the current run ends inside it after its leading bits
+        byte_lead = lead_table[byte]
+        ends = byte_lead < num_bits
+        ended_run = run + byte_lead
+        closed_spell_days += np.where(ends & (ended_run >= min_length), ended_run, 0) + inner_table[byte]
+
+        first_end = ends & in_lead
+        lead[first_end] = ended_run[first_end]
+        in_lead &= ~ends
+
+        run = np.where(ends, trail_table[byte], ended_run)
+
+    return closed_spell_days, lead, run
+
+
+def count_packed_spell_days(packed, num_days, prev_tail, min_length=SPELL_MIN_LENGTH):
+    """:func:`spell_kernel.count_spell_days` for a packed mask of ``num_days`` days."""
+    closed_spell_days, lead, year_end_tail = packed_spell_summary(packed, num_days, min_length)
+    return apply_carry_over(closed_spell_days, lead, year_end_tail, num_days, prev_tail, min_length)
@@ -0,0 +1,217 @@
+"""
+In-base bootstrap of the percentile-exceedance indices (TN10p, TX10p, TN90p, TX90p).
+
+Years inside the baseline are compared against thresholds estimated from
+those same years, which biases their exceedance rates. The ETCCDI correction
+(Zhang et al. 2005) estimates, for every in-base year y and every other
+baseline year j, the thresholds of a pseudo-baseline in which year y is
+replaced by a copy of year j, and averages year y's exceedance rate over the
+n - 1 resamples. Out-of-base years keep the ordinary thresholds.
+
+Done naively that is n (n - 1) threshold passes. Here every calendar-day
+window is sorted once per tile: the pseudo-baseline of (y, j) is the sorted
+window pool without year y's values plus year j's (at most ``window``)
+values, and any order statistic of it follows from the sorted pool, the
+sorted positions of year y's values and year j's sorted values without
+re-sorting (:func:`replicate_order_statistic`). The resample thresholds are
+identical to :func:`percentile_thresholds.calendar_day_percentiles` on the
+pseudo-baseline; they are never stored, only year y's exceedance counts.
+"""
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from tqdm import tqdm
+
+from calendar_index import calendar_days, day_of_year_index
+from compaction import ValidPixels
+from cube_store import CubeStoreReader
+from daily_readers import open_reader
+from percentile_thresholds import linear_interpolate, quantile_ranks, window_members
+
+
+def replicate_order_statistic(pool, removed, k, added):
+    """
+    k-th smallest value (0-based) of ``pool`` without its ``removed`` entries plus each set of ``added`` values.
+
+    ``pool`` is (N, P) sorted along axis 0, ``removed`` the (r, P) positions of
+    the dropped entries in ``pool`` sorted along axis 0, and ``added`` a
+    (g, m, P) stack of value sets sorted along axis 1. Returns (g, P).
+
+    The k-th smallest value of the union of two sorted sequences A and B is the
+    minimum over t (the number of B values among the k + 1 smallest) of
+    max(A[k - t], B[t - 1]), so only A[k - m] ... A[k] are needed. A[i] is
+    pool[i + c] where c counts the removed entries at position - rank <= i.
+    """
+    n_removed, n_added = removed.shape[0], added.shape[1]
+    kept = pool.shape[0] - n_removed
+    shifted = removed - np.arange(n_removed)[:, None]
+    columns = np.arange(pool.shape[1])
+
+    kept_values = np.empty((n_added + 1,) + pool.shape[1:], dtype=pool.dtype)
+    for t in range(n_added + 1):
+        i = k - t
+        if i == -1:  # All k + 1 smallest values are added ones
+            kept_values[t] = -np.inf
+        elif i < -1 or i >= kept:  # Not a possible split
+            kept_values[t] = np.inf
+        else:
+            kept_values[t] = pool[i + (shifted <= i).sum(axis=0), columns]
+
+    added_values = np.concatenate([np.full((added.shape[0], 1) + added.shape[2:], -np.inf, dtype=added.dtype), added],
+                                  axis=1)
+    return np.maximum(kept_values, added_values).min(axis=1)
+
+
+def inbase_exceedance_counts(tile_data, day_of_year, year_index, n_years, specs, window=5, days=366):
+    """
+    Bootstrap exceedance counts of a (T, P) baseline record, shape (len(specs), n_years, n_years, P).
+
+    ``year_index`` is the baseline year (0 .. n_years - 1) of every day and
+    ``specs`` a list of (quantile, above) pairs. Entry [s, y, j] counts the
+    valid days of year y beyond (``above``) or below the calendar-day
+    threshold of the pseudo-baseline in which year y is replaced by year j;
+    the diagonal is 0. Pseudo-baselines whose window contains a NaN give a NaN
+    threshold (no exceedance), as np.percentile does.
+    """
+    n_pixels = tile_data.shape[1]
+    slot_day = np.full((n_years, days), -1, dtype=np.intp)  # Band of every calendar-day slot of every year
+    slot_day[year_index, day_of_year] = np.arange(len(day_of_year))
+    counts = np.zeros((len(specs), n_years, n_years, n_pixels), dtype=np.int32)
+    years = np.arange(n_years)
+
+    for day in range(days):
+        bands = slot_day[:, window_members(day, window, days)]  # (n_years, window)
+        present = bands >= 0
+        if not present.any():
+            continue
+
+        # Window values per year, absent slots and NaNs as +inf so that they sort last
+        values = np.where(present[..., None], tile_data[np.maximum(bands, 0)], np.float32(np.inf))
+        nan = np.isnan(values)
+        values[nan] = np.inf
+        nan_count = nan.sum(axis=1)  # (n_years, P)
+        window_count = present.sum(axis=1)  # Values per year in this window
+
+        # Sort the whole pool once; positions of each year's values in it, sorted per year
+        flat = values.reshape(-1, n_pixels)
+        order = np.argsort(flat, axis=0, kind="stable")
+        pool = np.take_along_axis(flat, order, axis=0)
+        positions = np.empty_like(order)
+        np.put_along_axis(positions, order, np.arange(flat.shape[0])[:, None], axis=0)
+        positions = np.sort(positions.reshape(values.shape), axis=1)
+        added = np.sort(values, axis=1)
+
+        for y in range(n_years):
+            if slot_day[y, day] < 0:  # Year y has no such day (e.g. Feb 29), nothing to count
+                continue
+            day_values = tile_data[slot_day[y, day]]
+            others = years != y
+            for size in np.unique(window_count[others]):
+                # Pseudo-baselines of the same size share their ranks
+                replacements = np.flatnonzero(others & (window_count == size))
+                n = int(window_count.sum() - window_count[y] + size)  # A Python int keeps the weight a weak float
+                has_nan = nan_count.sum(axis=0) - nan_count[y] + nan_count[replacements] > 0
+                for s, (quantile, above) in enumerate(specs):
+                    lower, upper, weight = quantile_ranks(n, quantile)
+                    lower_values = replicate_order_statistic(pool, positions[y], lower, added[replacements])
+                    upper_values = (lower_values if upper == lower else
+                                    replicate_order_statistic(pool, positions[y], upper, added[replacements]))
+                    with np.errstate(invalid="ignore"):  # inf - inf where a NaN pushed the rank past the window
+                        threshold = linear_interpolate(lower_values, upper_values, weight)
+                    threshold[has_nan] = np.nan
+                    counts[s, y, replacements] += day_values > threshold if above else day_values < threshold
+    return counts
+
+
+def inbase_exceedance_rates(tile_data, day_of_year, year_index, n_years, specs, window=5, days=366):
+    """
+    Bootstrapped exceedance fraction of every baseline year, shape (len(specs), n_years, P).
+
+    Year y's rate is its exceedance count averaged over the n - 1 resamples,
+    divided by its valid days (NaN where it has none).
+    """
+    if n_years < 2:
+        raise ValueError("The in-base bootstrap needs at least two baseline years")
+    counts = inbase_exceedance_counts(tile_data, day_of_year, year_index, n_years, specs, window, days)
+    rates = counts.sum(axis=2).astype(np.float32) / np.float32(n_years - 1)
+
+    valid_count = np.zeros((n_years, tile_data.shape[1]), dtype=np.int32)
+    np.add.at(valid_count, year_index, ~np.isnan(tile_data))
+    valid_count = valid_count.astype(np.float32)
+    valid_mask = np.broadcast_to(valid_count > 0, rates.shape)
+    rates[valid_mask] /= np.broadcast_to(valid_count, rates.shape)[valid_mask]
+    rates[~valid_mask] = np.nan
+    return rates
+
+
+def bootstrap_tile_rows(width, total_days, n_years, n_specs, memory_budget_mb):
+    """Rows per tile so that the tile's baseline record and bootstrap counts fit the budget."""
+    bytes_per_pixel = 4 * total_days + 4 * n_specs * n_years * n_years
+    rows = int(memory_budget_mb * 1024 ** 2 // (bytes_per_pixel * width))
+    return max(rows, 1)
+
+
+def build_inbase_exceedance(reader_spec, years, specs, window=5, memory_budget_mb=1024, desc="Bootstrapping"):
+    """
+    Bootstrapped in-base exceedance fractions over the baseline ``years``.
+
+    ``specs`` maps index names to (quantile, above). Returns the grid meta and
+    ``{name: {year: (H, W) float32}}`` for the baseline years the reader has.
+    GeoTIFF inputs are streamed in strips of rows, cube stores (cube_store.py)
+    are read directly; other backends need a cube store.
+    """
+    reader = open_reader(reader_spec)
+    years = [year for year in years if reader.has_year(year)]
+    names = list(specs)
+    days = calendar_days(reader.calendar)
+
+    if reader_spec["backend"] == "geotiff":
+        tif_files = [reader.path(year) for year in years]
+        day_of_year, year_index = [], []
+        for y, tif_file in enumerate(tif_files):
+            with rasterio.open(tif_file) as src:
+                day_of_year.append(day_of_year_index(src.descriptions, reader.calendar))
+                meta = src.meta.copy()
+            year_index.append(np.full(len(day_of_year[-1]), y))
+        day_of_year, year_index = np.concatenate(day_of_year), np.concatenate(year_index)
+
+        def tile_record(tile):
+            tile_data = []
+            for f in tif_files:
+                with rasterio.open(f) as src:
+                    tile_data.append(src.read(window=tile))
+            tile_data = np.concatenate(tile_data, axis=0)
+            tile_pixels = ValidPixels.from_data(tile_data)
+            return tile_pixels.gather(tile_data), tile_pixels
+
+    elif reader_spec["backend"] == "store":
+        store = CubeStoreReader(reader_spec["store_dir"])
+        columns = np.concatenate([np.arange(*store.offsets[year]) for year in years])
+        day_of_year = day_of_year_index([store.dates[c] for c in columns], store.calendar)
+        year_index = np.concatenate([np.full(store.day_count(year), y) for y, year in enumerate(years)])
+        meta = store.meta.copy()
+
+        def tile_record(tile):
+            # Stored rows of the valid cells in this strip (the store is ordered row-major)
+            first, last = np.searchsorted(store.pixels.index,
+                                          [tile.row_off * meta["width"], (tile.row_off + tile.height) * meta["width"]])
+            tile_pixels = ValidPixels(store.pixels.valid_mask[tile.row_off:tile.row_off + tile.height])
+            return np.ascontiguousarray(store.data[first:last][:, columns].T), tile_pixels
+
+    else:
+        raise ValueError(f"The in-base bootstrap cannot read the {reader_spec['backend']} backend, "
+                         "convert it to a cube store with BuildCubeStoreCN051.py first")
+
+    height, width = meta["height"], meta["width"]
+    rates = np.full((len(names), len(years), height, width), np.nan, dtype=np.float32)
+    rows = bootstrap_tile_rows(width, len(day_of_year), len(years), len(names), memory_budget_mb)
+    for row_off in tqdm(range(0, height, rows), desc=desc):
+        tile = Window(0, row_off, width, min(rows, height - row_off))
+        tile_data, tile_pixels = tile_record(tile)
+        if tile_pixels.count:
+            tile_rates = inbase_exceedance_rates(tile_data, day_of_year, year_index, len(years),
+                                                 [specs[name] for name in names], window, days)
+            rates[:, :, row_off:row_off + tile.height] = tile_pixels.scatter(tile_rates)
+
+    return meta, {name: dict(zip(years, rates[s])) for s, name in enumerate(names)}
@@ -0,0 +1,89 @@
+"""
+Incremental rebuild manifest for the per-year index outputs.
+
+For every output raster (e.g. ``CDD_1990.tif``, ``TN10p_1990.tif``) the
+manifest records the input files it was computed from with their
+modification times and SHA-1 digests, the digests of the thresholds it used,
+the code version (a digest of the engine modules' sources) and a digest of
+the run parameters. An output is stale when it is missing, was never
+recorded, or any of these changed; engines recompute only stale outputs.
+Touching a file without changing its bytes does not make it stale. A missing
+input is recorded too, so outputs that depend on the following year (WSDI,
+CSDI) are rebuilt once that year appears.
+"""
+
+import hashlib
+import importlib
+import json
+import os
+
+from threshold_cache import file_digest
+
+
+def code_version(module_names):
+    """Digest of the source files of the named modules."""
+    digest = hashlib.sha1()
+    for name in sorted(module_names):
+        with open(importlib.import_module(name).__file__, "rb") as f:
+            digest.update(name.encode())
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def params_digest(params):
+    """Digest of the JSON-serialisable run parameters an output depends on."""
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class BuildManifest:
+    """JSON record of how each output was built, stored next to the outputs."""
+
+    def __init__(self, path, code, params):
+        self.path = path
+        self.code = code
+        self.params = params_digest(params)
+        self.outputs, self.memo = {}, {}
+        if os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+            self.outputs, self.memo = manifest["outputs"], manifest["digests"]
+
+    def file_state(self, path):
+        """[mtime_ns, sha1] of an input file, or None if it does not exist."""
+        if not os.path.exists(path):
+            return None
+        return [os.stat(path).st_mtime_ns, file_digest(path, self.memo)]
+
+    def signature(self, inputs, thresholds=()):
+        return {
+            "inputs": {path: self.file_state(path) for path in inputs},
+            "thresholds": {path: self.file_state(path) for path in thresholds},
+            "code": self.code,
+            "params": self.params,
+        }
+
+    def is_current(self, output, inputs, thresholds=()):
+        """Whether ``output`` exists and was built from the same input and threshold contents, code and parameters."""
+        entry = self.outputs.get(os.path.abspath(output))
+        if entry is None or not os.path.exists(output):
+            return False
+        current = self.signature(inputs, thresholds)
+        if (entry["code"], entry["params"]) != (current["code"], current["params"]):
+            return False
+        for kind in ("inputs", "thresholds"):
+            if entry[kind].keys() != current[kind].keys():
+                return False
+            for path, state in current[kind].items():
+                recorded = entry[kind][path]
+                if (state is None) != (recorded is None) or (state is not None and state[1] != recorded[1]):
+                    return False
+        return True
+
+    def record(self, output, inputs, thresholds=()):
+        self.outputs[os.path.abspath(output)] = self.signature(inputs, thresholds)
+
+    def save(self):
+        partial = self.path + ".partial"
+        with open(partial, "w") as f:
+            json.dump({"outputs": self.outputs, "digests": self.memo}, f)
+        os.replace(partial, self.path)
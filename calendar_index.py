@@ -0,0 +1,70 @@
+"""
+Band -> calendar-day index for daily data in CF calendars.
+
+Percentile thresholds hold one band per calendar-day slot: 366 for the
+standard (Gregorian) calendar, 365 for noleap/365_day and 360 for 360_day
+model output. :func:`day_of_year_index` turns the "YYYY-MM-DD" dates of a
+file's bands into the slot of every band in one vectorised step, so a whole
+year can be compared against ``threshold[day_of_year]`` at once.
+"""
+
+import numpy as np
+
+# Days before each month in a 365-day year and in a 360-day year
+_MONTH_OFFSETS_365 = np.array([0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334], dtype=np.intp)
+_MONTH_OFFSETS_360 = np.arange(0, 360, 30, dtype=np.intp)
+
+# Canonical name of every supported CF calendar
+CALENDAR_ALIASES = {
+    "standard": "standard", "gregorian": "standard", "proleptic_gregorian": "standard",
+    "noleap": "noleap", "365_day": "noleap",
+    "all_leap": "all_leap", "366_day": "all_leap",
+    "360_day": "360_day",
+}
+
+# Number of calendar-day slots (day of year 0 .. n-1) of each calendar
+CALENDAR_DAYS = {"standard": 366, "noleap": 365, "all_leap": 366, "360_day": 360}
+
+
+def canonical_calendar(calendar):
+    """Canonical name of a CF calendar attribute, e.g. "365_day" -> "noleap"."""
+    try:
+        return CALENDAR_ALIASES[calendar.lower()]
+    except KeyError:
+        raise ValueError(f"Unsupported calendar '{calendar}', expected one of {sorted(CALENDAR_ALIASES)}") from None
+
+
+def calendar_days(calendar="standard"):
+    """Number of calendar-day slots (threshold bands) of ``calendar``."""
+    return CALENDAR_DAYS[canonical_calendar(calendar)]
+
+
+def parse_dates(dates):
+    """Year, month and day arrays of zero-padded "YYYY-MM-DD" strings (any trailing time is ignored)."""
+    digits = np.asarray(dates, dtype="S10").view(np.uint8).reshape(-1, 10).astype(np.intp) - ord("0")
+    year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    month = digits[:, 5] * 10 + digits[:, 6]
+    day = digits[:, 8] * 10 + digits[:, 9]
+    return year, month, day
+
+
+def day_of_year_index(dates, calendar="standard"):
+    """
+    0-based calendar-day slot of every band, from its "YYYY-MM-DD" date.
+
+    standard: days since 1 January, as the index scripts have always counted
+    them (31 December is slot 364, or 365 in leap years). noleap: 0-364.
+    all_leap: 0-365. 360_day: twelve 30-day months, 0-359.
+    """
+    calendar = canonical_calendar(calendar)
+    year, month, day = parse_dates(dates)
+    if calendar == "360_day":
+        return _MONTH_OFFSETS_360[month - 1] + day - 1
+
+    day_of_year = _MONTH_OFFSETS_365[month - 1] + day - 1
+    if calendar == "standard":
+        leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+        day_of_year += leap & (month > 2)
+    elif calendar == "all_leap":
+        day_of_year += month > 2
+    return day_of_year
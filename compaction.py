@@ -0,0 +1,54 @@
+"""
+Valid-pixel compaction for the fused index engines.
+
+The converted CN05.1 grids are rectangles in which every cell outside the
+plateau/China mask is NaN on every day. :class:`ValidPixels` keeps a 1-D
+index of the cells inside the mask so that daily cubes can be gathered from
+(days, H, W) into (days, n_valid) arrays. All index kernels reduce along the
+time axis and work unchanged on that layout; results are scattered back to
+the 2-D grid (NaN outside the mask) only when they are written.
+"""
+
+import numpy as np
+
+
+class ValidPixels:
+    """Flat index of the valid cells of a (height, width) grid."""
+
+    def __init__(self, valid_mask):
+        valid_mask = np.asarray(valid_mask, dtype=bool)
+        self.shape = valid_mask.shape
+        self.index = np.flatnonzero(valid_mask)
+
+    @classmethod
+    def from_data(cls, data):
+        """Cells of a (days, H, W) cube with at least one non-NaN day."""
+        return cls(~np.isnan(data).all(axis=0))
+
+    @property
+    def count(self):
+        return self.index.size
+
+    @property
+    def valid_mask(self):
+        """(height, width) bool mask of the valid cells."""
+        mask = np.zeros(self.shape[0] * self.shape[1], dtype=bool)
+        mask[self.index] = True
+        return mask.reshape(self.shape)
+
+    @property
+    def fraction(self):
+        """Share of the grid that is computed."""
+        return self.count / (self.shape[0] * self.shape[1])
+
+    def gather(self, grid):
+        """(..., H, W) -> C-contiguous (..., n_valid), so time reductions keep their summation order."""
+        grid = np.asarray(grid)
+        return np.take(grid.reshape(grid.shape[:-2] + (-1,)), self.index, axis=-1)
+
+    def scatter(self, values, fill=np.nan):
+        """(..., n_valid) -> (..., H, W), ``fill`` outside the valid cells."""
+        values = np.asarray(values)
+        grid = np.full(values.shape[:-1] + (self.shape[0] * self.shape[1],), fill, dtype=values.dtype)
+        grid[..., self.index] = values
+        return grid.reshape(values.shape[:-1] + self.shape)
@@ -0,0 +1,148 @@
+"""
+Pixel-major, time-contiguous daily cube store.
+
+The converted GeoTIFFs are band-interleaved: one plane per day, so a pixel's
+time series is strided across 365 planes per year. :func:`build_cube_store`
+transposes a variable's whole record once into a memory-mapped float32
+``(n_pixels, n_days)`` array (``data.npy``) over the valid cells only, with
+the valid-cell mask (``pixels.npy``) and an index of year offsets, dates and
+grid metadata (``index.json``). :class:`CubeStoreReader` serves it as an
+input backend; engines get each year as a zero-copy (days, n_valid) view.
+"""
+
+import json
+import os
+
+import numpy as np
+from rasterio.crs import CRS
+from rasterio.transform import Affine
+from tqdm import tqdm
+
+from compaction import ValidPixels
+
+STORE_DATA = "data.npy"
+STORE_PIXELS = "pixels.npy"
+STORE_INDEX = "index.json"
+
+
+def build_cube_store(reader, years, store_dir, pixels=None, desc=None):
+    """
+    Write the years of ``reader`` (see daily_readers.py) into a cube store at ``store_dir``.
+
+    ``pixels`` defaults to the cells with any valid day in the first year.
+    Missing years are left out of the index. ``index.json`` is written last,
+    so an interrupted build is never mistaken for a complete store.
+    """
+    years = [year for year in years if reader.has_year(year)]
+    if not years:
+        raise FileNotFoundError("No input year available for the cube store")
+    os.makedirs(store_dir, exist_ok=True)
+    index_file = os.path.join(store_dir, STORE_INDEX)
+    if os.path.exists(index_file):
+        os.remove(index_file)
+
+    offsets, start = {}, 0
+    for year in years:
+        offsets[year] = (start, start + reader.day_count(year))
+        start = offsets[year][1]
+
+    store, dates, meta = None, [], None
+    for year in tqdm(years, desc=desc):
+        cube, year_dates, year_meta = reader.read_year(year)
+        if store is None:
+            if pixels is None:
+                pixels = ValidPixels.from_data(cube)
+            meta = year_meta
+            np.save(os.path.join(store_dir, STORE_PIXELS), pixels.valid_mask)
+            store = np.lib.format.open_memmap(os.path.join(store_dir, STORE_DATA), mode="w+", dtype=np.float32,
+                                              shape=(pixels.count, start))
+        year_start, year_stop = offsets[year]
+        store[:, year_start:year_stop] = pixels.gather(cube).T  # Transpose to one time series per row
+        dates.extend(year_dates)
+        del cube
+    store.flush()
+    del store
+
+    index = {
+        "calendar": getattr(reader, "calendar", "standard") or "standard",
+        "years": {str(year): list(offset) for year, offset in offsets.items()},
+        "dates": dates,
+        "crs": meta["crs"].to_wkt(),
+        "transform": list(meta["transform"])[:6],
+        "height": meta["height"],
+        "width": meta["width"],
+    }
+    with open(index_file, "w") as f:
+        json.dump(index, f)
+    return store_dir
+
+
+class CubeStoreReader:
+    """Input backend over a store written by :func:`build_cube_store` (memory-mapped, read-only)."""
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, STORE_INDEX)) as f:
+            index = json.load(f)
+        self.store_dir = store_dir
+        self.calendar = index["calendar"]
+        self.offsets = {int(year): tuple(offset) for year, offset in index["years"].items()}
+        self.dates = index["dates"]
+        self.pixels = ValidPixels(np.load(os.path.join(store_dir, STORE_PIXELS)))
+        self.data = np.load(os.path.join(store_dir, STORE_DATA), mmap_mode="r")  # (n_pixels, n_days)
+        self.meta = {"driver": "GTiff", "dtype": "float32", "nodata": np.nan, "width": index["width"],
+                     "height": index["height"], "count": 1, "crs": CRS.from_wkt(index["crs"]),
+                     "transform": Affine(*index["transform"])}
+
+    def years(self):
+        return sorted(self.offsets)
+
+    def has_year(self, year):
+        return year in self.offsets
+
+    def day_count(self, year):
+        start, stop = self.offsets[year]
+        return stop - start
+
+    def source_files(self, year):
+        return [os.path.join(self.store_dir, name) for name in (STORE_INDEX, STORE_PIXELS, STORE_DATA)]
+
+    def read_valid(self, year, pixels=None):
+        """
+        One year as a (days, n_valid) array of ``pixels``, plus its dates and grid meta.
+
+        Zero-copy (a transposed view of the memory map) when ``pixels`` are the
+        store's own cells; other cell sets are gathered from the stored rows.
+        """
+        start, stop = self.offsets[year]
+        data = self.data[:, start:stop].T
+        if pixels is not None and not np.array_equal(pixels.index, self.pixels.index):
+            rows = np.searchsorted(self.pixels.index, pixels.index)
+            rows = np.minimum(rows, self.pixels.count - 1)
+            stored = self.pixels.index[rows] == pixels.index
+            data = np.where(stored, data[:, rows], np.float32(np.nan))  # Cells outside the store are missing
+        meta = self.meta.copy()
+        meta["count"] = stop - start
+        return data, self.dates[start:stop], meta
+
+    def year_meta(self, year):
+        meta = self.meta.copy()
+        meta["count"] = self.day_count(year)
+        return meta
+
+    def read_year(self, year):
+        data, dates, meta = self.read_valid(year)
+        return self.pixels.scatter(data), dates, meta
+
+    def read_window(self, year, window):
+        """One year of a strip of full grid rows (other windows are not contiguous in the store)."""
+        if window.col_off != 0 or window.width != self.meta["width"]:
+            raise ValueError("Cube stores are read in strips of full grid rows")
+        # Stored rows of the valid cells in the strip (the store is ordered row-major)
+        first, last = np.searchsorted(self.pixels.index, [window.row_off * window.width,
+                                                          (window.row_off + window.height) * window.width])
+        strip_pixels = ValidPixels(self.pixels.valid_mask[window.row_off:window.row_off + window.height])
+        start, stop = self.offsets[year]
+        meta = self.meta.copy()
+        meta.update(count=stop - start, height=window.height,
+                    transform=self.meta["transform"] * Affine.translation(0, window.row_off))
+        return strip_pixels.scatter(self.data[first:last, start:stop].T), self.dates[start:stop], meta
@@ -0,0 +1,245 @@
+"""
+Input backends that deliver one year of daily grids to the index engines.
+
+Every reader exposes ``years()``, ``has_year(year)``, ``day_count(year)``,
+``source_files(year)`` (the files holding that year, for fingerprinting) and
+``read_year(year)``, which returns ``(data, dates, meta)``: a float32
+(days, height, width) cube oriented north-up like the converted GeoTIFFs,
+the "YYYY-MM-DD" date of each day and a rasterio profile describing the grid. ``calendar`` is the CF
+calendar of the dates (see calendar_index.py). ``read_window(year, window)``
+reads the same for a rasterio window of the grid only (spatially tiled runs,
+see tiled_engine.py) and ``year_meta(year)`` returns the grid profile alone.
+
+Backends:
+
+- ``geotiff``: the per-year {prefix}_{year}.tif files written by CN051_nc2tiff.py
+- ``netcdf``: CN05.1 or CMIP6 NetCDF files, read by year hyperslab with dates from the CF time axis
+- ``zarr``: a chunked Zarr store with the same CF layout (requires the optional ``zarr`` package)
+- ``store``: a time-contiguous cube store written by cube_store.py (no decoding, zero-copy)
+
+Readers are described by plain dicts (see :func:`open_reader`) so that they can be
+passed to worker processes and re-opened there.
+"""
+
+import os
+from abc import ABC, abstractmethod
+
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+from rasterio.windows import transform as window_transform
+
+from cube_store import CubeStoreReader
+
+# Open readers of this process, keyed by their spec
+_reader_cache = {}
+
+
+def year_bounds(dates):
+    """{year: (start, stop)} day ranges of each year in a sorted list of "YYYY-MM-DD" dates."""
+    years = np.array([int(d.split("-")[0]) for d in dates])
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(years)) + 1))
+    stops = np.append(starts[1:], len(years))
+    return {int(years[start]): (int(start), int(stop)) for start, stop in zip(starts, stops)}
+
+
+def grid_meta(lon, lat, count=1):
+    """GeoTIFF profile of a regular lon/lat grid (cell centres), as CN051_nc2tiff.py georeferences it."""
+    lon_res = (lon.max() - lon.min()) / (len(lon) - 1)
+    lat_res = (lat.max() - lat.min()) / (len(lat) - 1)
+    transform = from_origin(lon.min() - 0.5 * lon_res, lat.max() + 0.5 * abs(lat_res), lon_res, abs(lat_res))
+    return {"driver": "GTiff", "dtype": "float32", "nodata": np.nan, "width": len(lon), "height": len(lat),
+            "count": count, "crs": CRS.from_epsg(4326), "transform": transform}
+
+
+def cf_dates(values, units, calendar):
+    """"YYYY-MM-DD" strings for CF time values in any CF calendar."""
+    import cftime
+
+    return [str(d).split()[0] for d in cftime.num2date(np.asarray(values), units, calendar=calendar)]
+
+
+class GeoTiffReader:
+    """Per-year multi-band GeoTIFFs ({prefix}_{year}.tif) with one band per day."""
+
+    def __init__(self, data_dir, prefix, calendar="standard"):
+        self.data_dir = data_dir
+        self.prefix = prefix
+        self.calendar = calendar  # Calendar of the source data the band dates were written from
+
+    def path(self, year):
+        return os.path.join(self.data_dir, f"{self.prefix}_{year}.tif")
+
+    def years(self):
+        names = (f[len(self.prefix) + 1:-4] for f in os.listdir(self.data_dir)
+                 if f.startswith(self.prefix + "_") and f.endswith(".tif"))
+        return sorted(int(n) for n in names if n.isdigit())
+
+    def has_year(self, year):
+        return os.path.exists(self.path(year))
+
+    def day_count(self, year):
+        with rasterio.open(self.path(year)) as src:
+            return src.count
+
+    def source_files(self, year):
+        return [self.path(year)]
+
+    def year_meta(self, year):
+        with rasterio.open(self.path(year)) as src:
+            return src.meta.copy()
+
+    def read_year(self, year):
+        with rasterio.open(self.path(year)) as src:
+            return src.read(), list(src.descriptions), src.meta.copy()
+
+    def read_window(self, year, window):
+        with rasterio.open(self.path(year)) as src:
+            meta = src.meta.copy()
+            meta.update(height=window.height, width=window.width, transform=src.window_transform(window))
+            return src.read(window=window), list(src.descriptions), meta
+
+
+class CFReader(ABC):
+    """Common logic of the NetCDF and Zarr backends: year index over one or more CF sources."""
+
+    def __init__(self, variable, scale=1.0, offset=0.0):
+        self.variable = variable
+        self.scale = scale  # Unit conversion, e.g. 86400 for kg m-2 s-1 -> mm/day
+        self.offset = offset  # e.g. -273.15 for K -> degC
+        self.index = {}  # year -> list of (source, start, stop, dates)
+        self.paths = {}  # year -> files or stores the year is read from
+        self.meta = None
+        self.flip = False
+        self.calendar = None
+
+    def add_source(self, source, time_values, units, calendar, lon, lat, path=None):
+        dates = cf_dates(time_values, units, calendar)
+        for year, (start, stop) in year_bounds(dates).items():
+            self.index.setdefault(year, []).append((source, start, stop, dates[start:stop]))
+            if path is not None:
+                self.paths.setdefault(year, []).append(path)
+        if self.meta is None:
+            lon, lat = np.asarray(lon), np.asarray(lat)
+            self.meta = grid_meta(lon, lat)
+            self.flip = lat[0] < lat[-1]  # Rows must run north to south
+            self.calendar = calendar
+
+    def years(self):
+        return sorted(self.index)
+
+    def has_year(self, year):
+        return year in self.index
+
+    def day_count(self, year):
+        return sum(stop - start for _, start, stop, _ in self.index[year])
+
+    def source_files(self, year):
+        return self.paths.get(year, [])
+
+    @abstractmethod
+    def read_slab(self, source, start, stop, rows=slice(None), cols=slice(None)):
+        """Days ``start:stop`` of ``rows``/``cols`` of the variable in ``source`` as float32, NaN where missing."""
+
+    def year_meta(self, year):
+        meta = self.meta.copy()
+        meta["count"] = self.day_count(year)
+        return meta
+
+    def read_year(self, year):
+        return self.read_window(year, None)
+
+    def read_window(self, year, window):
+        """One year of the grid cells in ``window`` (a rasterio Window, None for the whole grid)."""
+        rows, cols = (slice(None), slice(None)) if window is None else window.toslices()
+        if self.flip and window is not None:  # Source rows run south to north
+            height = self.meta["height"]
+            rows = slice(height - rows.stop, height - rows.start)
+
+        slabs, dates = [], []
+        for source, start, stop, slab_dates in self.index[year]:
+            slabs.append(self.read_slab(source, start, stop, rows, cols))
+            dates.extend(slab_dates)
+        data = np.concatenate(slabs, axis=0) if len(slabs) > 1 else slabs[0]
+        if self.flip:
+            data = data[:, ::-1, :]
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        if self.scale != 1.0 or self.offset != 0.0:
+            data = data * np.float32(self.scale) + np.float32(self.offset)
+
+        meta = self.meta.copy()
+        meta["count"] = data.shape[0]
+        if window is not None:
+            meta.update(height=window.height, width=window.width,
+                        transform=window_transform(window, self.meta["transform"]))
+        return data, dates, meta
+
+
+class NetCDFReader(CFReader):
+    """One variable from one or more NetCDF files (e.g. CMIP6 files split by period)."""
+
+    def __init__(self, paths, variable, scale=1.0, offset=0.0, lon_name="lon", lat_name="lat", time_name="time"):
+        import netCDF4 as nc
+
+        super().__init__(variable, scale, offset)
+        for path in ([paths] if isinstance(paths, str) else paths):
+            ds = nc.Dataset(path)
+            time_var = ds.variables[time_name]
+            self.add_source(ds, time_var[:], time_var.units, getattr(time_var, "calendar", "standard"),
+                            ds.variables[lon_name][:], ds.variables[lat_name][:], path)
+
+    def read_slab(self, source, start, stop, rows=slice(None), cols=slice(None)):
+        # Masked (missing/fill) values become NaN
+        return np.ma.filled(source.variables[self.variable][start:stop, rows, cols].astype(np.float32), np.nan)
+
+
+class ZarrReader(CFReader):
+    """One variable from a CF-style Zarr store (time, lat, lon arrays with CF attributes)."""
+
+    def __init__(self, path, variable, scale=1.0, offset=0.0, lon_name="lon", lat_name="lat", time_name="time"):
+        try:
+            import zarr
+        except ImportError as e:
+            raise ImportError("The zarr backend requires the 'zarr' package") from e
+
+        super().__init__(variable, scale, offset)
+        group = zarr.open(path, mode="r")
+        time_arr = group[time_name]
+        self.add_source(group, time_arr[:], time_arr.attrs["units"], time_arr.attrs.get("calendar", "standard"),
+                        group[lon_name][:], group[lat_name][:], path)
+
+    def read_slab(self, source, start, stop, rows=slice(None), cols=slice(None)):
+        # Missing/fill values (of the packed data) become NaN, then CF packing is undone like netCDF4 does
+        arr = source[self.variable]
+        raw = arr[start:stop, rows, cols]
+        missing = np.zeros(raw.shape, dtype=bool)
+        for key in ("_FillValue", "missing_value"):
+            if arr.attrs.get(key) is not None:
+                missing |= np.isin(raw, np.atleast_1d(np.asarray(arr.attrs[key], dtype=raw.dtype)))
+        scale_factor, add_offset = arr.attrs.get("scale_factor"), arr.attrs.get("add_offset")
+        if scale_factor is None and add_offset is None:
+            data = raw.astype(np.float32)
+        else:
+            data = raw * (1.0 if scale_factor is None else scale_factor) + (0.0 if add_offset is None else add_offset)
+            data = data.astype(np.float32)
+        data[missing] = np.nan
+        return data
+
+
+BACKENDS = {"geotiff": GeoTiffReader, "netcdf": NetCDFReader, "zarr": ZarrReader, "store": CubeStoreReader}
+
+
+def open_reader(spec):
+    """
+    Open (or reuse, within this process) the reader described by ``spec``.
+
+    ``spec`` is a dict with a ``backend`` key and that backend's arguments, e.g.
+    ``{"backend": "geotiff", "data_dir": ..., "prefix": "tmax"}`` or
+    ``{"backend": "netcdf", "paths": [...], "variable": "tasmax", "offset": -273.15}``.
+    """
+    key = repr(sorted(spec.items()))
+    if key not in _reader_cache:
+        kwargs = {k: v for k, v in spec.items() if k != "backend"}
+        _reader_cache[key] = BACKENDS[spec["backend"]](**kwargs)
+    return _reader_cache[key]
@@ -0,0 +1,517 @@
+"""
+Per-year drivers for the fused precipitation and temperature engines.
+
+Each ``process_*_year`` function reads one year, computes its indices and
+writes them, so years can be fanned out over a process pool with
+:func:`run_years`. The only cross-year state, WSDI/CSDI spells, is returned
+as :class:`temp_indices.SpellSummary` tuples and chained afterwards by
+:func:`merge_spell_summaries` in the parent process.
+
+All computation runs on the valid cells only (``config["valid_pixels"]``, see
+compaction.py); results are scattered back to the full grid when written.
+
+Incremental runs (see build_manifest.py) compute only the stale outputs:
+:func:`plan_outputs` lists the indices to compute per year in
+``config["year_indices"]`` and :func:`record_outputs` records what was written.
+
+With ``config["inbase_bootstrap"]`` the percentile-exceedance indices of the
+baseline years are not computed per year but bootstrapped over the whole
+baseline by :func:`write_inbase_exceedance` (see bootstrap.py).
+
+With ``config["window"]`` (a rasterio Window) the drivers read, compute and
+write only that part of the grid, ``config["valid_pixels"]`` being the valid
+cells of the window; tiled_engine.py runs them strip by strip that way.
+
+Settings of the engine scripts (TempIndicesCN051.py, PrecipIndicesCN051.py)
+that change speed and memory use but not the results:
+
+- ``kernel_backend``: "auto" runs the per-pixel spell and percentile kernels
+  compiled with Numba when it is installed (cached on disk after the first
+  run), "numpy" always uses the NumPy implementations (see
+  numba_kernels.py). The cores are shared among the ``workers``.
+- ``prefetch_years`` (``config["prefetch_years"]``): years decoded ahead on a
+  background thread while the current year is computed (0 = off; see
+  async_io.py). Only the years :func:`run_years` will run in the same
+  process (``config["planned_years"]``) are decoded ahead.
+- ``write_queue`` (``config["write_queue"]``): output rasters that may be
+  queued for writing on a background thread (0 = write synchronously).
+- ``stage_log`` (``config["stage_log"]``): JSON-lines file the open, read,
+  date parsing, masking, compute and write stages of every year are timed
+  into, with bytes read/written and peak memory (see stage_profiler.py), all
+  records of a run tagged ``config["stage_run"]`` (None = off).
+  ``print_stage_summary`` prints the run's summary table at the end.
+- ``tile_memory_mb``: for grids too large to hold a year in memory, the grid
+  is processed in strips of rows whose daily inputs take about this many MB
+  per worker, as (year, strip) tasks that resume from ``tile_work_dir``
+  after an interruption (see tiled_engine.py). None processes whole years.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+import numpy as np
+import rasterio
+from tqdm import tqdm
+
+from async_io import AsyncWriter, prefetching
+from bootstrap import build_inbase_exceedance
+from calendar_index import day_of_year_index
+from compaction import ValidPixels
+from daily_readers import open_reader
+from numba_kernels import process_context
+from precip_indices import compute_precip_indices, rx_windows
+from stage_profiler import StageProfiler, stage_profiler
+from threshold_cache import LOCATION_KEYS
+from temp_indices import (INDEX_VARIABLES, EXCEEDANCE_INDICES, SPELL_INDICES, THRESHOLDS, SpellAccumulator,
+                          absolute_extremes, exceedance_fraction, exceedance_mask, freeze_thaw_index,
+                          frost_ice_dtr_tfr, summarise_spells)
+
+# Rasters read once per process (thresholds, PRwn95), keyed by path
+_raster_cache = {}
+
+# Modules whose sources make up the code version of each engine's outputs (see build_manifest.py)
+PRECIP_MODULES = ("index_engine", "precip_indices", "spell_kernel", "compaction", "daily_readers", "cube_store",
+                  "numba_kernels")
+TEMP_MODULES = ("index_engine", "temp_indices", "bitpack", "spell_kernel", "calendar_index", "compaction",
+                "daily_readers", "cube_store", "bootstrap", "percentile_thresholds", "numba_kernels")
+
+
+def read_cached(path, pixels=None, window=None):
+    """
+    Read all bands of a raster once per process, gathered onto ``pixels`` (one layout per path).
+
+    Parts of the grid (``window``) are read on every call instead, so that a
+    tiled run never holds the whole raster.
+    """
+    if window is not None:
+        with rasterio.open(path) as src:
+            data = src.read(window=window)
+        return data if pixels is None else pixels.gather(data)
+    if path not in _raster_cache:
+        with rasterio.open(path) as src:
+            data = src.read()
+        _raster_cache[path] = data if pixels is None else pixels.gather(data)
+    return _raster_cache[path]
+
+
+def open_year_reader(config, var, year=None):
+    """Reader of ``var`` for the per-year drivers, prefetching ``config["prefetch_years"]`` planned years ahead."""
+    with stage_profiler(config).stage("open", year, var):
+        return prefetching(open_reader(config["readers"][var]), config.get("prefetch_years", 0),
+                           config.get("planned_years", ()))
+
+
+def output_writer(config):
+    """
+    Writer for one year's outputs: an :class:`AsyncWriter` with ``config["write_queue"]`` slots,
+    or synchronous writes (None) if that is 0. All writes are complete when the context exits.
+    """
+    max_pending = config.get("write_queue", 0)
+    return AsyncWriter(max_pending, stage_profiler(config)) if max_pending else nullcontext()
+
+
+def read_valid(reader, year, pixels, profiler=None, var=None, window=None):
+    """
+    One year of ``reader`` on the valid cells: ``(data (days, n_valid), dates, meta)``.
+
+    Cube stores serve this as a zero-copy view of their time-contiguous memory
+    map; other backends decode the grid and gather it. With ``window`` only
+    that part of the grid is read and ``pixels`` are cells of the window. The
+    read and the gather are timed as "read" and "mask" stages of ``profiler``.
+    """
+    profiler = profiler or StageProfiler()
+    if window is None and hasattr(reader, "read_valid"):
+        with profiler.stage("read", year, var) as record:
+            data, dates, meta = reader.read_valid(year, pixels)
+            record["bytes_read"] = data.nbytes
+        return data, dates, meta
+    with profiler.stage("read", year, var) as record:
+        cube, dates, meta = reader.read_year(year) if window is None else reader.read_window(year, window)
+        record["bytes_read"] = cube.nbytes
+    with profiler.stage("mask", year, var):
+        data = pixels.gather(cube)
+    return data, dates, meta
+
+
+def build_valid_pixels(reader_specs, years, keep_files=()):
+    """
+    :class:`ValidPixels` of the cells with at least one valid day in the first year all readers have.
+
+    The data mask is assumed to be the same in every year. Finite cells of the
+    rasters in ``keep_files`` (e.g. PRwn95, where R95p is 0 rather than NaN)
+    are kept as well.
+    """
+    readers = [open_reader(spec) for spec in reader_specs]
+    year = next((year for year in years if all(reader.has_year(year) for reader in readers)), None)
+    if year is None:
+        raise FileNotFoundError("No year with all input variables available")
+
+    valid = None
+    for reader in readers:
+        cell_valid = ~np.isnan(reader.read_year(year)[0]).all(axis=0)
+        valid = cell_valid if valid is None else valid | cell_valid
+    for path in keep_files:
+        if os.path.exists(path):
+            with rasterio.open(path) as src:
+                valid |= ~np.isnan(src.read()).all(axis=0)
+    return ValidPixels(valid)
+
+
+def resolve_temp_thresholds(indices, reader_specs, cache, years, window=5, threshold_files=None,
+                            memory_budget_mb=1024):
+    """
+    {threshold: raster} of the calendar-day thresholds ``indices`` need.
+
+    Entries of ``threshold_files`` are used as given; all others are looked up
+    in the :class:`threshold_cache.ThresholdCache` ``cache`` and built there on
+    a miss, all quantiles of a variable in one pass.
+    """
+    files = dict(threshold_files or {})
+    needed = {key for name, (_, key, _) in list(EXCEEDANCE_INDICES.items()) + list(SPELL_INDICES.items())
+              if name in indices and key not in files}
+    by_variable = {}
+    for key in sorted(needed):
+        var, quantile = THRESHOLDS[key]
+        by_variable.setdefault(var, {})[quantile] = key
+    for var, keys in by_variable.items():
+        paths = cache.calendar_day_thresholds(reader_specs[var], var, list(keys), years, window, memory_budget_mb)
+        files.update({keys[quantile]: path for quantile, path in paths.items()})
+    return files
+
+
+def single_band_meta(meta, **updates):
+    """Metadata for a single-band float32 LZW output on the grid described by ``meta``."""
+    meta = meta.copy()
+    meta.update({"count": 1, "dtype": "float32", "compress": "lzw"}, **updates)  # Adapt for single-band output
+    return meta
+
+
+def index_file(output_dir, name, year):
+    return os.path.join(output_dir, f"{name}_{year}.tif")
+
+
+def save_index(output_dir, name, year, data, meta, writer=None, profiler=None):
+    """
+    Write one index raster as <output_dir>/<name>_<year>.tif, through ``writer`` (an AsyncWriter) if given.
+
+    Synchronous writes are timed as "write" stages of ``profiler``; the
+    writer times its own.
+    """
+    if writer is not None:
+        writer.write(index_file(output_dir, name, year), data, meta, f"{name}_{year}", year, name)
+        return
+    with (profiler or StageProfiler()).stage("write", year, name) as record:
+        with rasterio.open(index_file(output_dir, name, year), "w", **meta) as dst:
+            dst.write(data, 1)
+            dst.set_band_description(1, f"{name}_{year}")
+        record["bytes_written"] = os.path.getsize(index_file(output_dir, name, year))
+
+
+def year_indices(config, year):
+    """Indices to compute for ``year``: the stale ones of an incremental run, otherwise all requested ones."""
+    if "year_indices" in config:
+        return config["year_indices"].get(year, [])
+    return config["indices"]
+
+
+def inbase_years(config, name):
+    """Baseline years whose ``name`` output is bootstrapped (none without ``config["inbase_bootstrap"]``)."""
+    bootstrap = config.get("inbase_bootstrap")
+    if not bootstrap or name not in EXCEEDANCE_INDICES:
+        return []
+    return bootstrap["years"]
+
+
+def run_parameters(config):
+    """Settings other than inputs and thresholds that outputs depend on (reader settings, policies, limits)."""
+    excluded = ("readers", "output_dirs", "indices", "valid_pixels", "threshold_files", "prwn95_file",
+                "year_indices", "planned_years", "prefetch_years", "write_queue", "stage_log", "stage_run")
+    params = {key: value for key, value in config.items() if key not in excluded}
+    params["readers"] = {var: {k: v for k, v in spec.items() if k not in LOCATION_KEYS}
+                         for var, spec in config["readers"].items()}
+    return params
+
+
+def output_dependencies(name, year, config, years):
+    """
+    ``(input files, threshold files)`` the ``name`` output of ``year`` is computed from.
+
+    WSDI/CSDI also depend on the previous and following year (spells crossing
+    the year boundaries) and cross-year RXnday windows on the previous year,
+    as far as those years are part of the run. Bootstrapped in-base years
+    depend on every baseline year instead of a threshold raster.
+    """
+    years = set(years)
+    if year in inbase_years(config, name):
+        # Bootstrapped from the whole baseline, whether or not its years are part of the run
+        variables, thresholds = INDEX_VARIABLES[name], []
+        neighbours = years = [y for y in inbase_years(config, name) if y != year]
+    elif name in INDEX_VARIABLES:
+        variables = INDEX_VARIABLES[name]
+        neighbours = (year - 1, year + 1) if name in SPELL_INDICES else ()
+        thresholds = [config["threshold_files"][key] for index, (_, key, _)
+                      in list(EXCEEDANCE_INDICES.items()) + list(SPELL_INDICES.items()) if index == name]
+    else:
+        variables = ("pre",)
+        windows = rx_windows([name])
+        neighbours = (year - 1,) if config["rx_cross_year"] and windows and max(windows) > 1 else ()
+        thresholds = [config["prwn95_file"]] if name == "R95p" else []
+
+    inputs = []
+    for var in variables:
+        reader = open_reader(config["readers"][var])
+        for input_year in [year] + [y for y in neighbours if y in years]:
+            inputs.extend(reader.source_files(input_year))
+    return inputs, thresholds
+
+
+def plan_outputs(manifest, years, config, incremental=True):
+    """
+    Set ``config["year_indices"]`` to the indices to compute per year and return the (index, year) outputs to write.
+
+    With ``incremental`` only outputs that ``manifest`` (a
+    :class:`build_manifest.BuildManifest`) reports as stale are written. A
+    stale WSDI/CSDI year also needs the spell summaries of its neighbouring
+    years, so the spell index is computed (but not written) for those too.
+    Bootstrapped in-base outputs are left to :func:`write_inbase_exceedance`.
+    """
+    years = list(years)
+    outputs = {(name, year) for year in years for name in config["indices"]
+               if not incremental or not manifest.is_current(index_file(config["output_dirs"][name], name, year),
+                                                             *output_dependencies(name, year, config, years))}
+    plan = {}
+    for name, year in outputs:
+        if year in inbase_years(config, name):
+            continue
+        for needed_year in ((year - 1, year, year + 1) if name in SPELL_INDICES else (year,)):
+            if needed_year in years:
+                plan.setdefault(needed_year, set()).add(name)
+    config["year_indices"] = {year: [name for name in config["indices"] if name in plan[year]] for year in sorted(plan)}
+    return outputs
+
+
+def record_output(manifest, config, name, year, years):
+    manifest.record(index_file(config["output_dirs"][name], name, year), *output_dependencies(name, year, config, years))
+
+
+def record_outputs(year_results, manifest, config, outputs, years):
+    """
+    Pass ``(year, result)`` pairs through, recording each year's written non-spell outputs in ``manifest``.
+
+    Missing years (None results) wrote nothing and stay stale. The manifest is
+    saved after every year, so an interrupted run resumes where it stopped.
+    """
+    for year, result in year_results:
+        if result is not None:
+            for name in year_indices(config, year):
+                if name not in SPELL_INDICES and (name, year) in outputs:
+                    record_output(manifest, config, name, year, years)
+            manifest.save()
+        yield year, result
+
+
+def process_precip_year(year, config):
+    """Read one year of precipitation once and write every requested precipitation index. Returns None if missing."""
+    reader = open_year_reader(config, "pre", year)
+    if not reader.has_year(year):
+        print(f"Warning: precipitation for {year} not found, skipping...")
+        return None
+
+    indices = year_indices(config, year)
+    pixels = config["valid_pixels"]
+    profiler = stage_profiler(config)
+    prwn95 = None
+    if "R95p" in indices and os.path.exists(config["prwn95_file"]):
+        prwn95 = read_cached(config["prwn95_file"], pixels, config.get("window"))[0].astype(np.float32)
+
+    pre_data, _, meta = read_valid(reader, year, pixels, profiler, "pre", config.get("window"))
+    meta = single_band_meta(meta, nodata=np.nan)
+    pre_data = np.asarray(pre_data, dtype=np.float32)  # Shape (num_days, n_valid)
+
+    # Optionally let RXnday windows start in the previous year
+    prev_days = None
+    windows = rx_windows(indices)
+    if config["rx_cross_year"] and windows and max(windows) > 1 and reader.has_year(year - 1):
+        prev_days = read_valid(reader, year - 1, pixels, profiler, "pre", config.get("window"))[0]
+        prev_days = np.asarray(prev_days[1 - max(windows):], dtype=np.float32)
+
+    with profiler.stage("compute", year, indices):
+        results = compute_precip_indices(pre_data, prwn95, indices, config["wet_threshold"], config["nan_policy"],
+                                         config["rx_nan_policy"], prev_days)
+    with output_writer(config) as writer:
+        for name, data in results.items():
+            with profiler.stage("mask", year, name):
+                grid = pixels.scatter(data)
+            save_index(config["output_dirs"][name], name, year, grid, meta, writer, profiler)
+    return year
+
+
+def process_temp_year(year, config):
+    """
+    Read each daily temperature variable of one year once and write all non-spell indices.
+
+    Returns ``(meta, {spell index: SpellSummary})`` for the spell merge step, or
+    None if an input file is missing.
+    """
+    indices = year_indices(config, year)
+    pixels = config["valid_pixels"]
+    variables = sorted({var for name in indices for var in INDEX_VARIABLES[name]})
+    readers = {var: open_year_reader(config, var, year) for var in variables}
+    profiler = stage_profiler(config)
+
+    if not all(reader.has_year(year) for reader in readers.values()):
+        print(f"Skipping {year}, missing data files.")
+        return None
+
+    # Read each daily variable once and keep only the valid cells
+    data, meta, day_of_year = {}, None, None
+    for var, reader in readers.items():
+        # Shape (num_days, n_valid)
+        data[var], dates, var_meta = read_valid(reader, year, pixels, profiler, var, config.get("window"))
+        if meta is None:
+            meta = single_band_meta(var_meta)
+            with profiler.stage("dates", year, var):
+                day_of_year = day_of_year_index(dates, reader.calendar)
+
+    results = {}
+    if any(name in indices for name in ("TXx", "TXn", "TNx", "TNn")):
+        with profiler.stage("compute", year, ["TXx", "TXn", "TNx", "TNn"]):
+            results.update(absolute_extremes(data.get("tmax"), data.get("tmin")))
+    if any(name in indices for name in ("FD", "ID", "DTR", "TFR")):
+        with profiler.stage("compute", year, ["FD", "ID", "DTR", "TFR"]):
+            results.update(frost_ice_dtr_tfr(data["tmin"], data["tmax"], data["tm"], config["tfr_max"]))
+    if "Freeze_Index" in indices or "Thaw_Index" in indices:
+        with profiler.stage("compute", year, ["Freeze_Index", "Thaw_Index"]):
+            results.update(freeze_thaw_index(data["tm"]))
+
+    # Bit-packed exceedance masks, shared where a percentile and a spell index test the same days
+    # (TN10p/CSDI below TNin10, TX90p/WSDI above TXin90)
+    packed_masks = {}
+    for name, (var, key, above) in list(EXCEEDANCE_INDICES.items()) + list(SPELL_INDICES.items()):
+        if name in indices and (var, key, above) not in packed_masks:
+            threshold = read_cached(config["threshold_files"][key], pixels, config.get("window"))
+            with profiler.stage("compute", year, key):
+                packed_masks[var, key, above] = exceedance_mask(data[var], threshold, day_of_year, above)
+
+    for name, (var, key, above) in EXCEEDANCE_INDICES.items():
+        if name in indices:
+            with profiler.stage("compute", year, name):
+                results[name] = exceedance_fraction(packed_masks[var, key, above], data[var])
+
+    # Written in the background while the spell summaries are computed
+    with output_writer(config) as writer:
+        for name, result in results.items():
+            if name in indices:
+                with profiler.stage("mask", year, name):
+                    grid = pixels.scatter(result)
+                save_index(config["output_dirs"][name], name, year, grid, meta, writer, profiler)
+
+        # Spell indices depend on the neighbouring years; hand back a summary instead
+        spell_summaries = {}
+        for name, (var, key, above) in SPELL_INDICES.items():
+            if name in indices:
+                with profiler.stage("compute", year, name):
+                    spell_summaries[name] = summarise_spells(packed_masks[var, key, above], data[var])
+
+    return meta, spell_summaries
+
+
+def run_years(function, years, config, workers=1, desc=None):
+    """
+    Yield ``(year, function(year, config))`` in year order.
+
+    With ``workers`` > 1 the years are processed concurrently in a process pool,
+    each worker taking a contiguous block of years (so that its reads can be
+    prefetched within the block); otherwise they run one after another in this
+    process.
+    """
+    years = list(years)
+    if workers <= 1:
+        config = dict(config, planned_years=years)
+        for year in tqdm(years, desc=desc):
+            yield year, function(year, config)
+        return
+
+    size = -(-len(years) // workers)
+    blocks = [years[start:start + size] for start in range(0, len(years), size)]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=process_context()) as executor:
+        results = executor.map(run_block, [function] * len(blocks), blocks, [config] * len(blocks))
+        block_results = ((year, result) for block, block_result in zip(blocks, results)
+                         for year, result in zip(block, block_result))
+        yield from tqdm(block_results, total=len(years), desc=desc)
+
+
+def run_block(function, years, config):
+    """``function`` over a block of ``years`` in one worker process, prefetching within the block only."""
+    config = dict(config, planned_years=years)
+    return [function(year, config) for year in years]
+
+
+def merge_spell_summaries(year_results, output_dirs, pixels, outputs=None, profiler=None):
+    """
+    Chain per-year :class:`SpellSummary` results in year order and write WSDI/CSDI.
+
+    ``year_results`` yields ``(year, result)`` pairs from :func:`process_temp_year`;
+    a None result (missing year) or a gap between years ends any running spell.
+    ``pixels`` is the :class:`ValidPixels` the summaries were computed on. Only
+    the (index, year) pairs in ``outputs`` are written (all if None); the
+    written pairs are returned. Writes are timed on ``profiler``.
+    """
+    accumulators, meta, written = {}, None, []
+    profiler = profiler or StageProfiler()
+
+    def save(name, finished):
+        if finished is not None and (outputs is None or (name, finished[0]) in outputs):
+            with profiler.stage("mask", finished[0], name):
+                grid = pixels.scatter(finished[1])
+            save_index(output_dirs[name], name, finished[0], grid, meta, profiler=profiler)
+            written.append((name, finished[0]))
+
+    last_year = {}  # Last year added to each accumulator
+    for year, result in year_results:
+        if result is None:
+            for name, accumulator in accumulators.items():
+                save(name, accumulator.finish())
+            continue
+
+        meta, spell_summaries = result
+        for name, summary in spell_summaries.items():
+            accumulator = accumulators.setdefault(name, SpellAccumulator(summary.lead.shape))
+            if last_year.get(name, year - 1) != year - 1:
+                save(name, accumulator.finish())  # Not a continuation of the previous year of this index
+            save(name, accumulator.add_year(year, summary))
+            last_year[name] = year
+
+    # Flush the last year of each spell index
+    for name, accumulator in accumulators.items():
+        save(name, accumulator.finish())
+    return written
+
+
+def write_inbase_exceedance(config, outputs, memory_budget_mb=1024):
+    """
+    Write the bootstrapped in-base exceedance outputs among ``outputs`` and return the written pairs.
+
+    Indices of the same variable (e.g. TN10p and TN90p) share one pass over the
+    baseline record, with the threshold window of ``config["inbase_bootstrap"]``.
+    """
+    pending = sorted((name, year) for name, year in outputs if year in inbase_years(config, name))
+    specs = {}
+    for name, _ in pending:
+        var, key, above = EXCEEDANCE_INDICES[name]
+        specs.setdefault(var, {})[name] = (THRESHOLDS[key][1], above)
+
+    written = []
+    profiler = stage_profiler(config)
+    for var, var_specs in sorted(specs.items()):
+        with profiler.stage("bootstrap", index=list(var_specs)):
+            meta, rates = build_inbase_exceedance(config["readers"][var], config["inbase_bootstrap"]["years"],
+                                                  var_specs, config["inbase_bootstrap"]["window"], memory_budget_mb,
+                                                  desc=f"Bootstrapping in-base {var} exceedances")
+        meta = single_band_meta(meta)
+        for name, year in pending:
+            if name in var_specs and year in rates[name]:
+                save_index(config["output_dirs"][name], name, year, rates[name][year], meta, profiler=profiler)
+                written.append((name, year))
+    return written
@@ -0,0 +1,277 @@
+"""
+Optional compiled kernels (Numba) for the loop-shaped index computations.
+
+Longest dry/wet spells (CDD, CWD), the per-year WSDI/CSDI spell statistics
+of packed exceedance masks and the calendar-day percentiles are per-pixel
+scans over time. Here they are compiled with Numba and run over blocks of
+pixels in parallel threads (``prange``); results are identical to the NumPy
+implementations in spell_kernel.py, bitpack.py and percentile_thresholds.py,
+which dispatch to these kernels when :func:`enabled` and keep their NumPy
+code as the fallback when Numba is not installed.
+
+Compiled kernels are cached on disk (``cache=True``, in ``__pycache__`` or
+``NUMBA_CACHE_DIR``), so only the first run after a code change pays the JIT
+cost. The backend is chosen with :func:`use_backend` or the ``CN051_KERNELS``
+environment variable ("auto", "numba" or "numpy"), which worker processes
+inherit.
+"""
+
+import multiprocessing
+import os
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+BACKENDS = ("auto", "numba", "numpy")
+
+# Pixels per parallel block; each block scans time day by day over contiguous pixels
+BLOCK_PIXELS = 256
+
+# Codes of the CDD/CWD missing-day policies (see spell_kernel.consecutive_dry_wet_days)
+NAN_POLICIES = {"wet": 0, "break": 1, "skip": 2}
+
+
+def use_backend(backend="auto", threads=None):
+    """
+    Select the kernel backend for this process and the worker processes it starts.
+
+    "auto" uses the compiled kernels when Numba is installed, "numba" requires
+    them and "numpy" never uses them. ``threads`` limits the Numba threads per
+    process (e.g. cores divided by the number of worker processes).
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown kernel backend {backend!r}, expected one of {BACKENDS}")
+    if backend == "numba" and numba is None:
+        raise ImportError("The numba kernel backend needs the numba package")
+    os.environ["CN051_KERNELS"] = backend
+    if threads:
+        os.environ["NUMBA_NUM_THREADS"] = str(threads)
+        if numba is not None:
+            numba.set_num_threads(min(threads, numba.config.NUMBA_NUM_THREADS))
+
+
+def enabled():
+    """Whether the index functions dispatch to the compiled kernels."""
+    return numba is not None and os.environ.get("CN051_KERNELS", "auto") != "numpy"
+
+
+def process_context():
+    """
+    multiprocessing context for worker pools (None for the platform default).
+
+    Numba's thread pool is not fork-safe once started (e.g. by a threshold
+    build in the parent), so with Numba loaded POSIX workers are started from
+    a fork server instead of forked from the parent. Windows always spawns.
+    """
+    if numba is None or os.name == "nt":
+        return None
+    return multiprocessing.get_context("forkserver")
+
+
+if numba is not None:
+    @numba.njit(parallel=True, cache=True)
+    def _dry_wet_spells(precip, wet_threshold, policy):
+        days, n_pixels = precip.shape
+        cdd = np.empty(n_pixels, dtype=np.float32)
+        cwd = np.empty(n_pixels, dtype=np.float32)
+        for block in numba.prange((n_pixels + BLOCK_PIXELS - 1) // BLOCK_PIXELS):
+            start = block * BLOCK_PIXELS
+            stop = min(start + BLOCK_PIXELS, n_pixels)
+            dry_run = np.zeros(stop - start, dtype=np.int32)
+            wet_run = np.zeros(stop - start, dtype=np.int32)
+            longest_dry = np.zeros(stop - start, dtype=np.int32)
+            longest_wet = np.zeros(stop - start, dtype=np.int32)
+            valid = np.zeros(stop - start, dtype=np.bool_)
+            for day in range(days):
+                for p in range(start, stop):
+                    i = p - start
+                    value = precip[day, p]
+                    missing = np.isnan(value)
+                    dry = value < wet_threshold
+                    wet = value >= wet_threshold
+                    if policy == 0:  # A missing day is wet
+                        wet = wet or missing
+                    valid[i] = valid[i] or not missing
+
+                    if dry:
+                        dry_run[i] += 1
+                        longest_dry[i] = max(longest_dry[i], dry_run[i])
+                    elif policy != 2 or wet:  # "skip" ignores missing days
+                        dry_run[i] = 0
+                    if wet:
+                        wet_run[i] += 1
+                        longest_wet[i] = max(longest_wet[i], wet_run[i])
+                    elif policy != 2 or dry:
+                        wet_run[i] = 0
+
+            for p in range(start, stop):
+                i = p - start
+                cdd[p] = longest_dry[i] if valid[i] else np.nan
+                cwd[p] = longest_wet[i] if valid[i] else np.nan
+        return cdd, cwd
+
+    @numba.njit(parallel=True, cache=True)
+    def _longest_run(mask, reset):
+        days, n_pixels = mask.shape
+        longest = np.zeros(n_pixels, dtype=np.int32)
+        for block in numba.prange((n_pixels + BLOCK_PIXELS - 1) // BLOCK_PIXELS):
+            start = block * BLOCK_PIXELS
+            stop = min(start + BLOCK_PIXELS, n_pixels)
+            run = np.zeros(stop - start, dtype=np.int32)
+            for day in range(days):
+                for p in range(start, stop):
+                    if reset[day, p]:  # A reset day ends the run even if it is set
+                        run[p - start] = 0
+                    elif mask[day, p]:
+                        run[p - start] += 1
+                        longest[p] = max(longest[p], run[p - start])
+        return longest
+
+    @numba.njit(parallel=True, cache=True)
+    def _packed_spell_summary(packed, num_days, min_length):
+        n_pixels = packed.shape[1]
+        closed_spell_days = np.zeros(n_pixels, dtype=np.int32)
+        lead = np.full(n_pixels, num_days, dtype=np.int32)
+        run = np.zeros(n_pixels, dtype=np.int32)
+        for block in numba.prange((n_pixels + BLOCK_PIXELS - 1) // BLOCK_PIXELS):
+            start = block * BLOCK_PIXELS
+            stop = min(start + BLOCK_PIXELS, n_pixels)
+            in_lead = np.ones(stop - start, dtype=np.bool_)
+            for day in range(num_days):
+                for p in range(start, stop):
+                    if (packed[day >> 3, p] >> (day & 7)) & 1:
+                        run[p] += 1
+                        continue
+                    # The run ending on the previous day is closed (it does not reach the last day)
+                    if run[p] >= min_length:
+                        closed_spell_days[p] += run[p]
+                    if in_lead[p - start]:
+                        lead[p] = run[p]
+                        in_lead[p - start] = False
+                    run[p] = 0
+        return closed_spell_days, lead, run
+
+    @numba.njit(cache=True)
+    def _slide_window(window, n, grouped, leaving_first, leaving_last, entering_first, entering_last, out):
+        """One pass over the sorted window: drop the leaving day's sorted run and merge in the entering day's."""
+        i, leave, enter, k = 0, leaving_first, entering_first, 0
+        while i < n or enter < entering_last:
+            if i < n and leave < leaving_last and window[i] == grouped[leave]:
+                i += 1
+                leave += 1
+            elif enter < entering_last and (i == n or grouped[enter] < window[i]):
+                out[k] = grouped[enter]
+                enter += 1
+                k += 1
+            else:
+                out[k] = window[i]
+                i += 1
+                k += 1
+        return k
+
+    @numba.njit(parallel=True, cache=True)
+    def _window_percentiles(sorted_groups, bounds, members, lower, upper, lower_weight, upper_weight, from_upper):
+        n_pixels, total_days = sorted_groups.shape
+        n_quantiles, days = lower.shape
+        window_size = members.shape[1]
+        thresholds = np.full((n_quantiles, days, n_pixels), np.nan, dtype=np.float32)
+        for p in numba.prange(n_pixels):
+            # NaNs (sorted last in each calendar day) become +inf and flag their day instead
+            grouped = sorted_groups[p]
+            day_nan = np.zeros(days, dtype=np.int32)
+            for day in range(days):
+                for i in range(bounds[day + 1] - 1, bounds[day] - 1, -1):
+                    if not np.isnan(grouped[i]):
+                        break
+                    grouped[i] = np.inf
+                    day_nan[day] = 1
+
+            # Sorted values of the current window, slid by one calendar day at a time
+            window = np.empty(total_days, dtype=np.float32)
+            buffer = np.empty(total_days, dtype=np.float32)
+            n = 0
+            for day in range(days):
+                if day == 0:
+                    for member in members[0]:
+                        n = _slide_window(window, n, grouped, 0, 0, bounds[member], bounds[member + 1], buffer)
+                        window, buffer = buffer, window
+                else:
+                    leaving, entering = members[day - 1][0], members[day][window_size - 1]
+                    n = _slide_window(window, n, grouped, bounds[leaving], bounds[leaving + 1], bounds[entering],
+                                      bounds[entering + 1], buffer)
+                    window, buffer = buffer, window
+
+                has_nan = 0
+                for member in members[day]:
+                    has_nan += day_nan[member]
+                if has_nan or n == 0:
+                    continue
+                for q in range(n_quantiles):
+                    low = window[lower[q, day]]
+                    high = window[upper[q, day]]
+                    diff = high - low
+                    if from_upper[q, day]:
+                        thresholds[q, day, p] = high - diff * upper_weight[q, day]
+                    else:
+                        thresholds[q, day, p] = low + diff * lower_weight[q, day]
+        return thresholds
+
+
+def consecutive_dry_wet_days(precip, wet_threshold=1.0, nan_policy="wet"):
+    """Compiled :func:`spell_kernel.consecutive_dry_wet_days`."""
+    if nan_policy not in NAN_POLICIES:
+        raise ValueError(f"Unknown nan_policy: {nan_policy!r}")
+    precip = np.asarray(precip)
+    flat = np.ascontiguousarray(precip.reshape(precip.shape[0], -1))
+    # Compare in the data's precision, as NumPy does with a Python float threshold
+    cdd, cwd = _dry_wet_spells(flat, flat.dtype.type(wet_threshold), NAN_POLICIES[nan_policy])
+    return cdd.reshape(precip.shape[1:]), cwd.reshape(precip.shape[1:])
+
+
+def longest_run(mask, reset=None):
+    """Compiled :func:`spell_kernel.longest_run`."""
+    mask = np.asarray(mask, dtype=bool)
+    reset = ~mask if reset is None else np.asarray(reset, dtype=bool)
+    shape = mask.shape[1:]
+    longest = _longest_run(np.ascontiguousarray(mask.reshape(mask.shape[0], -1)),
+                           np.ascontiguousarray(reset.reshape(reset.shape[0], -1)))
+    return longest.reshape(shape)
+
+
+def packed_spell_summary(packed, num_days, min_length):
+    """Compiled :func:`bitpack.packed_spell_summary`."""
+    shape = packed.shape[1:]
+    summary = _packed_spell_summary(np.ascontiguousarray(packed.reshape(packed.shape[0], -1)), num_days, min_length)
+    return tuple(result.reshape(shape) for result in summary)
+
+
+def window_percentiles(grouped, bounds, members, ranks):
+    """
+    Compiled calendar-day percentiles from :func:`percentile_thresholds.sorted_calendar_groups` output.
+
+    ``grouped`` is the float32 (T, ...) record grouped and sorted by calendar
+    day with the (start, stop) ``bounds`` of each day, ``members[day]`` the
+    calendar days in the window of ``day`` and ``ranks[q][day]`` the
+    (lower, upper, weight) of :func:`percentile_thresholds.quantile_ranks` for
+    that window. Returns (len(ranks), days, ...), NaN where a window is empty
+    or holds a NaN.
+    """
+    shape = grouped.shape[1:]
+    sorted_groups = np.ascontiguousarray(grouped.reshape(grouped.shape[0], -1).T)  # One row per pixel scan
+    indptr = np.array([start for start, _ in bounds] + [bounds[-1][1]], dtype=np.intp)
+
+    lower = np.array([[rank[0] for rank in day_ranks] for day_ranks in ranks], dtype=np.intp)
+    upper = np.array([[rank[1] for rank in day_ranks] for day_ranks in ranks], dtype=np.intp)
+    weight = [[rank[2] for rank in day_ranks] for day_ranks in ranks]
+    # np.percentile casts the weight and its complement to the data's precision separately
+    lower_weight = np.array(weight, dtype=np.float32)
+    upper_weight = np.array([[1 - w for w in day_weights] for day_weights in weight], dtype=np.float32)
+    from_upper = np.array(weight) >= 0.5
+
+    thresholds = _window_percentiles(sorted_groups, indptr, np.asarray(members, dtype=np.intp), lower, upper,
+                                     lower_weight, upper_weight, from_upper)
+    return thresholds.reshape(thresholds.shape[:2] + shape)
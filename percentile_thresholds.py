@@ -0,0 +1,218 @@
+"""
+Calendar-day percentile thresholds (TNin10, TNin90, TXin10, TXin90) built tile by tile.
+
+The baseline record is streamed through rasterio windows covering a strip of
+rows at a time, so peak memory is bounded by ``memory_budget_mb`` rather than
+by the baseline length times the full grid size. Any number of quantiles is
+computed from the same pass. Thresholds have one band per calendar-day slot
+of the input calendar (366 standard, 365 noleap, 360 for 360_day). The
+baseline can also be read from a time-contiguous cube store (cube_store.py),
+which skips GeoTIFF decoding.
+"""
+
+import os
+from contextlib import ExitStack
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from tqdm import tqdm
+
+from calendar_index import calendar_days, day_of_year_index
+from compaction import ValidPixels
+from cube_store import CubeStoreReader
+import numba_kernels
+
+
+def window_members(day, window=5, days=366):
+    """Calendar days in the moving window centred on ``day`` (cyclic over ``days`` slots)."""
+    half = window // 2
+    return [(day + offset) % days for offset in range(-half, window - half)]
+
+
+def band_day_of_year(tif_file, calendar="standard"):
+    """Calendar-day slot of every band of one yearly file."""
+    with rasterio.open(tif_file) as src:
+        return day_of_year_index(src.descriptions, calendar)
+
+
+def tile_rows(width, total_days, window_days, memory_budget_mb):
+    """Rows per tile so that the tile's baseline record and window working set fit the budget."""
+    # Baseline record and its calendar-day sorted copy, plus the window stack and np.percentile's copy of it
+    bytes_per_pixel = 2 * 4 * total_days + 3 * 8 * window_days
+    rows = int(memory_budget_mb * 1024 ** 2 // (bytes_per_pixel * width))
+    return max(rows, 1)
+
+
+def sorted_calendar_groups(tile_data, day_of_year, days=366):
+    """
+    Group a tile's baseline record by calendar day and sort every group along time.
+
+    Returns the grouped cube and the (start, stop) slice of each calendar day in it.
+    Each day is sorted once here and then shared by every window containing it.
+    """
+    order = np.argsort(day_of_year, kind="stable")
+    grouped = tile_data[order]
+    bounds = np.searchsorted(day_of_year[order], np.arange(days + 1))
+    for day in range(days):
+        start, stop = bounds[day], bounds[day + 1]
+        if stop > start:
+            grouped[start:stop].sort(axis=0)
+    return grouped, list(zip(bounds[:-1], bounds[1:]))
+
+
+def quantile_ranks(n, quantile):
+    """Lower/upper order statistic and weight of numpy's default ('linear') percentile."""
+    virtual_index = (n - 1) * (quantile / 100)
+    lower = int(np.floor(virtual_index))
+    return lower, min(lower + 1, n - 1), virtual_index - lower
+
+
+def linear_interpolate(lower, upper, weight):
+    """Interpolate between order statistics exactly as np.percentile does, in the input dtype."""
+    diff = upper - lower
+    if weight >= 0.5:
+        return upper - diff * (1 - weight)
+    return lower + diff * weight
+
+
+def calendar_day_percentiles(tile_data, day_of_year, quantiles, window=5, calendar="standard"):
+    """
+    Percentiles for every calendar day of one tile, shape (len(quantiles), days, rows, cols).
+
+    Neighbouring windows share ``window - 1`` calendar days, so every day is
+    sorted only once and each window is assembled from pre-sorted runs. All
+    quantiles of a window then come out of a single partition; results are
+    identical to calling np.percentile once per quantile. float32 records use
+    the compiled kernel of numba_kernels.py when Numba is available.
+    """
+    days = calendar_days(calendar)
+    grouped, bounds = sorted_calendar_groups(tile_data, day_of_year, days)
+    del tile_data
+
+    if numba_kernels.enabled() and grouped.dtype == np.float32:
+        members = [window_members(day, window, days) for day in range(days)]
+        ranks = [[quantile_ranks(sum(bounds[m][1] - bounds[m][0] for m in day_members), quantile)
+                  for day_members in members] for quantile in quantiles]
+        return numba_kernels.window_percentiles(grouped, bounds, members, ranks)
+
+    thresholds = np.full((len(quantiles), days) + grouped.shape[1:], np.nan, dtype=np.float32)
+    for day in range(days):
+        runs = [grouped[start:stop] for start, stop in (bounds[m] for m in window_members(day, window, days))
+                if stop > start]
+        if not runs:  # Avoid calculation on empty data
+            continue
+
+        window_data = np.concatenate(runs, axis=0)
+        n = window_data.shape[0]
+        ranks = [quantile_ranks(n, quantile) for quantile in quantiles]
+        kth = sorted({k for lower, upper, _ in ranks for k in (lower, upper)} | {n - 1})
+        window_data.partition(kth, axis=0)
+
+        has_nan = np.isnan(window_data[-1])  # NaNs are partitioned to the end
+        for q, (lower, upper, weight) in enumerate(ranks):
+            thresholds[q, day] = linear_interpolate(window_data[lower], window_data[upper], weight)
+            thresholds[q, day][has_nan] = np.nan
+    return thresholds
+
+
+def build_calendar_thresholds(tif_files, output_files, window=5, memory_budget_mb=1024, calendar="standard",
+                              desc="Computing thresholds"):
+    """
+    Write rasters of per-calendar-day percentiles over the baseline files, one band per calendar day.
+
+    ``output_files`` maps each quantile (0-100) to its output path. For each
+    calendar day the quantile is taken over all baseline values falling in the
+    ``window``-day moving window centred on that day. All quantiles share one
+    pass over the baseline record. ``calendar`` is the CF calendar of the band
+    dates (standard, noleap/365_day, all_leap/366_day or 360_day).
+    """
+    quantiles = list(output_files)
+    days = calendar_days(calendar)
+
+    # Calendar-day slot of every band of every baseline file
+    day_of_year = np.concatenate([band_day_of_year(f, calendar) for f in tif_files])
+    window_days = max(np.count_nonzero(np.isin(day_of_year, window_members(day, window, days)))
+                      for day in range(days))
+
+    with rasterio.open(tif_files[0]) as src:
+        meta = src.meta.copy()  # Copy metadata
+
+    def tile_thresholds(tile):
+        # Baseline record of this strip, all years concatenated along time
+        tile_data = []
+        for f in tif_files:
+            with rasterio.open(f) as src:
+                tile_data.append(src.read(window=tile))
+        tile_data = np.concatenate(tile_data, axis=0)
+        return calendar_day_percentiles(tile_data, day_of_year, quantiles, window, calendar)
+
+    rows = tile_rows(meta["width"], len(day_of_year), window_days, memory_budget_mb)
+    return write_thresholds(tile_thresholds, meta, days, rows, output_files, desc)
+
+
+def build_store_thresholds(store_dir, years, output_files, window=5, memory_budget_mb=1024,
+                           desc="Computing thresholds"):
+    """
+    :func:`build_calendar_thresholds` over the ``years`` of a cube store written by cube_store.py.
+
+    Each strip of rows is one contiguous block of the store's pixel-major
+    memory map, and only its valid cells are computed.
+    """
+    store = CubeStoreReader(store_dir)
+    quantiles = list(output_files)
+    days = calendar_days(store.calendar)
+
+    # Baseline columns of the store and their calendar-day slots
+    columns = np.concatenate([np.arange(*store.offsets[year]) for year in years])
+    day_of_year = day_of_year_index([store.dates[c] for c in columns], store.calendar)
+    window_days = max(np.count_nonzero(np.isin(day_of_year, window_members(day, window, days)))
+                      for day in range(days))
+    contiguous = np.array_equal(columns, np.arange(columns[0], columns[-1] + 1))
+
+    meta = store.meta.copy()
+    width = meta["width"]
+    valid_mask = store.pixels.valid_mask
+
+    def tile_thresholds(tile):
+        # Stored rows of the valid cells in this strip (the store is ordered row-major)
+        first, last = np.searchsorted(store.pixels.index, [tile.row_off * width, (tile.row_off + tile.height) * width])
+        rows = store.data[first:last]
+        rows = rows[:, columns[0]:columns[-1] + 1] if contiguous else rows[:, columns]
+        tile_pixels = ValidPixels(valid_mask[tile.row_off:tile.row_off + tile.height])
+        thresholds = calendar_day_percentiles(rows.T, day_of_year, quantiles, window, store.calendar)
+        return tile_pixels.scatter(thresholds)
+
+    rows = tile_rows(width, len(day_of_year), window_days, memory_budget_mb)
+    return write_thresholds(tile_thresholds, meta, days, rows, output_files, desc)
+
+
+def write_thresholds(tile_thresholds, meta, days, rows, output_files, desc="Computing thresholds"):
+    """
+    Write the threshold rasters strip by strip.
+
+    ``tile_thresholds(window)`` returns the (len(output_files), days, rows, width)
+    thresholds of one rasterio window of ``rows`` rows.
+    """
+    height, width = meta["height"], meta["width"]
+
+    # Update metadata to accommodate one band per calendar day
+    meta = meta.copy()
+    meta.update({"count": days, "dtype": "float32", "compress": "lzw"})
+
+    with ExitStack() as stack:
+        outputs = []
+        for output_file in output_files.values():
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+            dst = stack.enter_context(rasterio.open(output_file, "w", **meta))
+            for day in range(days):
+                dst.set_band_description(day + 1, f"Day-{day + 1}")
+            outputs.append(dst)
+
+        for row_off in tqdm(range(0, height, rows), desc=desc):
+            tile = Window(0, row_off, width, min(rows, height - row_off))
+            thresholds = tile_thresholds(tile)
+            for dst, quantile_thresholds in zip(outputs, thresholds):
+                dst.write(quantile_thresholds, window=tile)
+
+    return output_files
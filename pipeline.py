@@ -0,0 +1,174 @@
+"""
+Dependency-aware runner for the index scripts.
+
+A pipeline is a list of :class:`Node` entries: a script, the nodes it depends
+on and the CPU cores and peak memory it needs. :func:`run_pipeline` starts
+every node whose dependencies have completed as soon as it fits in the
+remaining CPU and memory budget, so independent scripts run concurrently in
+separate processes. Completed nodes are recorded in a JSON state file; a
+rerun after a failure resumes from there and only runs the failed, blocked
+and never-run nodes, plus any node whose code changed (and its dependents).
+A node's code is its script and the modules of the script's directory it
+imports, directly or through those modules (index_engine, spell_kernel, ...).
+"""
+
+import ast
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import namedtuple
+
+from build_manifest import code_version
+
+# script: path relative to the pipeline's working directory; deps: names of the nodes that must complete first;
+# cpus: cores the script keeps busy; memory_mb: approximate peak memory
+Node = namedtuple("Node", ["name", "script", "deps", "cpus", "memory_mb"])
+
+
+def topological_order(nodes):
+    """Nodes sorted so that every node comes after its dependencies; raises ValueError on unknown deps or cycles."""
+    by_name = {node.name: node for node in nodes}
+    for node in nodes:
+        unknown = [dep for dep in node.deps if dep not in by_name]
+        if unknown:
+            raise ValueError(f"{node.name} depends on unknown nodes {unknown}")
+
+    order, state = [], {}  # state: 1 while visiting, 2 when placed
+
+    def visit(node):
+        if state.get(node.name) == 2:
+            return
+        if state.get(node.name) == 1:
+            raise ValueError(f"Dependency cycle through {node.name}")
+        state[node.name] = 1
+        for dep in node.deps:
+            visit(by_name[dep])
+        state[node.name] = 2
+        order.append(node)
+
+    for node in nodes:
+        visit(node)
+    return order
+
+
+def script_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def local_imports(path):
+    """Names of the modules next to the script ``path`` that it imports, directly or through those modules."""
+    directory = os.path.dirname(os.path.abspath(path))
+    found, todo = set(), [path]
+    while todo:
+        with open(todo.pop(), "rb") as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):  # Imports inside functions count too
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                name = name.split(".")[0]
+                module_path = os.path.join(directory, name + ".py")
+                if name not in found and os.path.exists(module_path):
+                    found.add(name)
+                    todo.append(module_path)
+    return sorted(found)
+
+
+def node_digest(path):
+    """Digest of the script ``path`` and of the sources of the local modules it imports (see code_version)."""
+    directory = os.path.dirname(os.path.abspath(path))
+    if directory not in sys.path:
+        sys.path.append(directory)  # code_version imports the modules to find their sources
+    digest = hashlib.sha1(script_digest(path).encode())
+    digest.update(code_version(local_imports(path)).encode())
+    return digest.hexdigest()
+
+
+def load_state(state_file):
+    if os.path.exists(state_file):
+        with open(state_file) as f:
+            return json.load(f)
+    return {}
+
+
+def save_state(state, state_file):
+    partial = state_file + ".partial"
+    with open(partial, "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(partial, state_file)
+
+
+def run_pipeline(nodes, state_file, log_dir, cpu_budget=None, memory_budget_mb=8192, resume=True, cwd=".",
+                 poll_seconds=1.0):
+    """
+    Run ``nodes`` with at most ``cpu_budget`` cores and ``memory_budget_mb`` MB in use at once.
+
+    Each script runs as ``python <script>`` in ``cwd`` with its output in
+    ``<log_dir>/<name>.log``. A node larger than a budget runs alone. A failed
+    node blocks its dependents; independent nodes still run. With ``resume``
+    nodes completed in an earlier run (same script and imported module
+    contents, see :func:`node_digest`; no rerun dependency) are skipped. Returns ``{name: status}`` with status "done",
+    "skipped", "failed" or "blocked".
+    """
+    nodes = topological_order(nodes)
+    cpu_budget = cpu_budget or os.cpu_count() or 1
+    os.makedirs(log_dir, exist_ok=True)
+    state = load_state(state_file) if resume else {}
+    digests = {node.name: node_digest(os.path.join(cwd, node.script)) for node in nodes}
+
+    status = {}
+    for node in nodes:
+        previous = state.get(node.name, {})
+        if (previous.get("status") == "done" and previous.get("code_sha1") == digests[node.name]
+                and all(status.get(dep) == "skipped" for dep in node.deps)):
+            status[node.name] = "skipped"
+    pending = [node for node in nodes if node.name not in status]
+    print(f"{len(nodes) - len(pending)} of {len(nodes)} nodes already completed, {len(pending)} to run")
+
+    running = {}  # name -> (node, process, log file, start time)
+    while pending or running:
+        # Start every ready node that fits in the remaining budget (an oversized node only on an idle pipeline)
+        for node in list(pending):
+            if any(status.get(dep) in ("failed", "blocked") for dep in node.deps):
+                status[node.name] = "blocked"
+                pending.remove(node)
+                print(f"[blocked] {node.name}")
+                continue
+            if not all(status.get(dep) in ("done", "skipped") for dep in node.deps):
+                continue
+            used_cpus = sum(n.cpus for n, _, _, _ in running.values())
+            used_memory = sum(n.memory_mb for n, _, _, _ in running.values())
+            fits = used_cpus + node.cpus <= cpu_budget and used_memory + node.memory_mb <= memory_budget_mb
+            if not (fits or not running):
+                continue
+            log = open(os.path.join(log_dir, f"{node.name}.log"), "w")
+            process = subprocess.Popen([sys.executable, node.script], cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+            running[node.name] = (node, process, log, time.time())
+            pending.remove(node)
+            print(f"[start] {node.name}")
+
+        time.sleep(poll_seconds)
+        for name, (node, process, log, start) in list(running.items()):
+            if process.poll() is None:
+                continue
+            log.close()
+            del running[name]
+            seconds = time.time() - start
+            status[name] = "done" if process.returncode == 0 else "failed"
+            state[name] = {"status": status[name], "code_sha1": digests[name], "seconds": round(seconds, 1),
+                           "finished": time.strftime("%Y-%m-%d %H:%M:%S")}
+            save_state(state, state_file)
+            if status[name] == "done":
+                print(f"[done] {name} ({seconds:.1f} s)")
+            else:
+                print(f"[failed] {name} (exit code {process.returncode}), see {log.name}")
+
+    return {node.name: status[node.name] for node in nodes}
@@ -0,0 +1,162 @@
+"""
+Precipitation extreme indices computed from one in-memory (days, H, W) cube.
+
+Each function reproduces the masking of its stand-alone script
+(SDIICN051.py, R1mm&R10mmCN051.py, ...) so the fused engine writes the
+same rasters while decoding every pre_{year}.tif only once.
+"""
+
+import re
+
+import numpy as np
+
+from spell_kernel import consecutive_dry_wet_days
+
+# Indices produced by compute_precip_indices, in output order
+PRECIP_INDICES = ("SDII", "R1mm", "R10mm", "CDD", "CWD", "RX1day", "RX5day", "PRCPTOT", "R95p")
+
+# Any RXnday index (maximum n-day total) and RXnday_DOY (day of year the maximum window ends on)
+RX_INDEX = re.compile(r"RX([1-9]\d*)day(_DOY)?")
+
+
+def sdii(pre_data, wet_threshold=1.0):
+    """Simple daily intensity: mean precipitation on wet days, NaN without wet days."""
+    wet_mask = pre_data >= wet_threshold
+    total_precip = np.sum(np.where(wet_mask, pre_data, 0), axis=0, dtype=np.float32)
+    wet_days = np.sum(wet_mask, axis=0, dtype=np.int32)
+    return np.where(wet_days > 0, total_precip / wet_days, np.nan).astype(np.float32)
+
+
+def heavy_precip_days(pre_data, threshold):
+    """Number of days with precipitation >= threshold (R1mm, R10mm, ...)."""
+    days = np.sum(pre_data >= threshold, axis=0, dtype=np.int32).astype(np.float32)
+    days[np.isnan(pre_data[-1])] = np.nan  # Invalid areas follow the last day, as in R1mm&R10mmCN051.py
+    return days
+
+
+def rx_windows(indices):
+    """Sorted window lengths n of the RXnday / RXnday_DOY names in ``indices``."""
+    return sorted({int(match.group(1)) for match in map(RX_INDEX.fullmatch, indices) if match})
+
+
+def rx_nday(pre_data, windows=(1, 5), nan_policy="zero", prev_days=None):
+    """
+    Maximum n-day precipitation totals for every n in ``windows`` from one cumulative sum along time.
+
+    Returns ``{n: (rx, day)}``: the float32 maximum n-day total and the 1-based
+    day (band) of the year on which that window ends, earliest on ties. A
+    window belongs to the year it ends in.
+
+    ``nan_policy``:
+
+    - ``"zero"``: missing days count as 0 and pixels missing on the first day are
+      NaN (the RX1day&RX5dayCN051.py behaviour)
+    - ``"skip"``: windows containing a missing day are ignored; NaN without any complete window
+
+    ``prev_days`` optionally holds the last days of the previous year (at least
+    ``max(windows) - 1``), so that windows may start before 1 January.
+    """
+    if min(windows) < 1:
+        raise ValueError(f"Window lengths must be at least 1 day: {windows!r}")
+    lead = 0 if prev_days is None else prev_days.shape[0]
+    data = pre_data if prev_days is None else np.concatenate([prev_days, pre_data])
+    total_days = data.shape[0]
+    missing = np.isnan(data)
+    filled = np.where(missing, 0, data)
+
+    if nan_policy == "zero":
+        invalid = np.isnan(pre_data[0])
+    elif nan_policy == "skip":
+        invalid = None
+        missing_count = np.zeros((total_days + 1,) + data.shape[1:], dtype=np.int32)
+        np.cumsum(missing, axis=0, out=missing_count[1:])
+    else:
+        raise ValueError(f"Unknown nan_policy: {nan_policy!r}")
+
+    # Cumulative totals in float64, so differences of long sums keep float32 accuracy
+    cumulative = None
+    if max(windows) > 1:
+        cumulative = np.zeros((total_days + 1,) + data.shape[1:], dtype=np.float64)
+        np.cumsum(filled, axis=0, dtype=np.float64, out=cumulative[1:])
+
+    results = {}
+    for n in windows:
+        first_end = max(lead, n - 1)  # First window ending in this year
+        if first_end >= total_days:
+            empty = np.full(pre_data.shape[1:], np.nan, dtype=np.float32)
+            results[n] = (empty, empty.copy())
+            continue
+
+        if n == 1:
+            totals = filled[first_end:]
+        else:
+            totals = cumulative[first_end + 1:] - cumulative[first_end + 1 - n:total_days + 1 - n]
+        if nan_policy == "skip":
+            complete = missing_count[first_end + 1:] == missing_count[first_end + 1 - n:total_days + 1 - n]
+            totals = np.where(complete, totals, -np.inf)
+            invalid = ~complete.any(axis=0)
+
+        end = np.argmax(totals, axis=0)
+        rx = np.take_along_axis(totals, end[np.newaxis], axis=0)[0].astype(np.float32)
+        day = (end + first_end - lead + 1).astype(np.float32)
+        rx[invalid] = np.nan
+        day[invalid] = np.nan
+        results[n] = (rx, day)
+    return results
+
+
+def prcptot(pre_data, wet_threshold=1.0):
+    """Total precipitation on wet days."""
+    total = np.sum(np.where(pre_data >= wet_threshold, pre_data, 0), axis=0, dtype=np.float32)
+    total[np.isnan(pre_data[0])] = np.nan
+    return total
+
+
+def r95p(pre_data, prwn95, wet_threshold=1.0):
+    """Total precipitation in excess of the wet-day PRwn95 threshold on wet days."""
+    excess = np.where((pre_data >= wet_threshold) & (pre_data > prwn95), pre_data - prwn95, 0)
+    excess[np.isnan(pre_data)] = 0
+    total = np.sum(excess, axis=0, dtype=np.float32)
+    total[np.isnan(prwn95)] = np.nan
+    return total
+
+
+def compute_precip_indices(pre_data, prwn95=None, indices=PRECIP_INDICES, wet_threshold=1.0, nan_policy="wet",
+                           rx_nan_policy="zero", prev_days=None):
+    """
+    Compute the requested indices from one year of daily precipitation.
+
+    Returns a dict mapping index name to a float32 (H, W) array. R95p needs
+    ``prwn95`` and is skipped when it is None. Any RXnday / RXnday_DOY names
+    are computed together by :func:`rx_nday`, with ``prev_days`` allowing
+    windows that start in the previous year.
+    """
+    pre_data = np.asarray(pre_data, dtype=np.float32)
+    results = {}
+
+    if "SDII" in indices:
+        results["SDII"] = sdii(pre_data, wet_threshold)
+    if "R1mm" in indices:
+        results["R1mm"] = heavy_precip_days(pre_data, 1)
+    if "R10mm" in indices:
+        results["R10mm"] = heavy_precip_days(pre_data, 10)
+    if "CDD" in indices or "CWD" in indices:
+        cdd, cwd = consecutive_dry_wet_days(pre_data, wet_threshold, nan_policy)
+        if "CDD" in indices:
+            results["CDD"] = cdd
+        if "CWD" in indices:
+            results["CWD"] = cwd
+
+    windows = rx_windows(indices)
+    if windows:
+        for n, (rx, day) in rx_nday(pre_data, windows, rx_nan_policy, prev_days).items():
+            for name, result in ((f"RX{n}day", rx), (f"RX{n}day_DOY", day)):
+                if name in indices:
+                    results[name] = result
+
+    if "PRCPTOT" in indices:
+        results["PRCPTOT"] = prcptot(pre_data, wet_threshold)
+    if "R95p" in indices and prwn95 is not None:
+        results["R95p"] = r95p(pre_data, prwn95, wet_threshold)
+
+    return results
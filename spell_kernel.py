@@ -0,0 +1,170 @@
+"""
+Vectorised run-length kernels for spell-type climate extreme indices.
+
+All functions operate on whole cubes shaped (days, height, width)
+and reduce along the time axis, so no per-pixel Python loop is needed.
+Longest runs and CDD/CWD use the compiled kernels of numba_kernels.py when
+Numba is available.
+"""
+
+import numpy as np
+
+import numba_kernels
+
+# Minimum spell length (days) used by WSDI and CSDI
+SPELL_MIN_LENGTH = 6
+
+
+def run_lengths(mask, reset=None):
+    """
+    Length of the True run ending at each day, shape (days, ...).
+
+    By default every False day ends a run. If ``reset`` is given, only days where
+    it is True end a run; other False days are skipped without breaking it.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    reset = ~mask if reset is None else np.asarray(reset, dtype=bool)
+    # Cumulative count of True days; at each reset day remember the count so far
+    counts = np.cumsum(mask, axis=0, dtype=np.int32)
+    resets = np.where(reset, counts, 0)
+    np.maximum.accumulate(resets, axis=0, out=resets)
+    return counts - resets
+
+
+def longest_run(mask, reset=None):
+    """Length of the longest True run along the time axis (see :func:`run_lengths`)."""
+    if numba_kernels.enabled():
+        return numba_kernels.longest_run(mask, reset)
+    return run_lengths(mask, reset).max(axis=0, initial=0)
+
+
+def consecutive_dry_wet_days(precip, wet_threshold=1.0, nan_policy="wet"):
+    """
+    Longest dry (CDD) and wet (CWD) spells of a (days, H, W) precipitation cube.
+
+    Days with precipitation below ``wet_threshold`` (mm) are dry, the rest wet.
+    ``nan_policy`` controls missing days inside an otherwise valid series:
+
+    - ``"wet"``: a missing day counts as wet (the original CDD&CWDCN051.py behaviour)
+    - ``"break"``: a missing day ends both dry and wet spells
+    - ``"skip"``: a missing day is ignored and does not end either spell
+
+    Pixels without any valid day are NaN in both outputs.
+    """
+    if numba_kernels.enabled():
+        return numba_kernels.consecutive_dry_wet_days(precip, wet_threshold, nan_policy)
+
+    precip = np.asarray(precip)
+    missing = np.isnan(precip)
+    dry = precip < wet_threshold
+    wet = precip >= wet_threshold
+
+    if nan_policy == "wet":
+        wet |= missing
+        dry_reset, wet_reset = None, None
+    elif nan_policy == "break":
+        dry_reset, wet_reset = None, None
+    elif nan_policy == "skip":
+        dry_reset, wet_reset = wet, dry
+    else:
+        raise ValueError(f"Unknown nan_policy: {nan_policy!r}")
+
+    cdd = longest_run(dry, dry_reset).astype(np.float32)
+    cwd = longest_run(wet, wet_reset).astype(np.float32)
+
+    all_missing = missing.all(axis=0)
+    cdd[all_missing] = np.nan
+    cwd[all_missing] = np.nan
+    return cdd, cwd
+
+
+def leading_run(mask):
+    """Number of consecutive True days from the first day onwards."""
+    mask = np.asarray(mask, dtype=bool)
+    not_mask = ~mask
+    first_false = np.argmax(not_mask, axis=0)
+    return np.where(not_mask.any(axis=0), first_false, mask.shape[0]).astype(np.int32)
+
+
+def trailing_run(mask):
+    """Number of consecutive True days ending on the last day."""
+    return leading_run(np.asarray(mask, dtype=bool)[::-1])
+
+
+def spell_summary(mask, min_length=SPELL_MIN_LENGTH):
+    """
+    Per-year spell statistics that do not depend on neighbouring years.
+
+    Returns ``(closed_spell_days, lead, year_end_tail)``: days in runs of at
+    least ``min_length`` that end before the last day, the leading run length
+    and the run length ending on the last day. Together with the number of days
+    these are all that :func:`apply_carry_over` and :func:`merge_year_boundary`
+    need, so years can be summarised independently and chained afterwards.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    lengths = run_lengths(mask)
+
+    # A run ends on day d if d is a spell day and day d + 1 is not
+    run_end = mask[:-1] & ~mask[1:]
+    closed = np.where(run_end & (lengths[:-1] >= min_length), lengths[:-1], 0)
+    closed_spell_days = closed.sum(axis=0, dtype=np.int32)
+
+    return closed_spell_days, leading_run(mask), lengths[-1].astype(np.int32)
+
+
+def apply_carry_over(closed_spell_days, lead, year_end_tail, num_days, prev_tail, min_length=SPELL_MIN_LENGTH):
+    """
+    Combine a year's :func:`spell_summary` with the spell carried over from the previous year.
+
+    Returns ``(spell_days, year_end_tail, prev_tail)`` as :func:`count_spell_days` does.
+    """
+    all_spell = year_end_tail == num_days  # No non-spell day at all this year
+    carried = (prev_tail > 0) & ~all_spell
+
+    # Leading runs shorter than min_length still count when they continue a carried spell
+    spell_days = closed_spell_days + np.where(carried & (lead < min_length), lead, 0).astype(np.int32)
+
+    prev_tail = np.where(carried, 0, prev_tail).astype(np.int32)
+    return spell_days, year_end_tail, prev_tail
+
+
+def count_spell_days(mask, prev_tail, min_length=SPELL_MIN_LENGTH):
+    """
+    Count days belonging to spells of at least ``min_length`` days within one year.
+
+    ``prev_tail`` holds, per pixel, the spell days carried over from the start of
+    this year (set by :func:`merge_year_boundary` for the previous year). Where it
+    is positive the leading run of this year is counted unconditionally, because
+    it continues a spell that already qualified across the year boundary.
+
+    The run touching the last day is not counted here; it is returned as
+    ``year_end_tail`` and resolved by :func:`merge_year_boundary`.
+
+    Returns ``(spell_days, year_end_tail, prev_tail)`` where ``prev_tail`` is the
+    carry-over left after consuming it (zero wherever a non-spell day occurred).
+    """
+    mask = np.asarray(mask, dtype=bool)
+    closed_spell_days, lead, year_end_tail = spell_summary(mask, min_length)
+    return apply_carry_over(closed_spell_days, lead, year_end_tail, mask.shape[0], prev_tail, min_length)
+
+
+def merge_year_boundary(spell_days, year_end_tail, next_mask, invalid, min_length=SPELL_MIN_LENGTH,
+                        next_start=None):
+    """
+    Resolve the spell running over the year boundary.
+
+    ``next_mask`` holds the first days (at most ``min_length``) of the following
+    year. Where the year-end run plus the leading run of the next year reaches
+    ``min_length``, the year-end run is added to ``spell_days`` in place and the
+    next year's leading run is returned as the new carry-over. The leading run
+    may be passed directly as ``next_start`` (with ``next_mask=None``) when only
+    the next year's :func:`spell_summary` is available.
+    """
+    if next_start is None:
+        next_start = leading_run(np.asarray(next_mask, dtype=bool)[:min_length])
+    else:
+        next_start = np.minimum(next_start, min_length)
+    merged = (year_end_tail + next_start >= min_length) & ~invalid
+
+    spell_days += np.where(merged, year_end_tail, 0).astype(spell_days.dtype)
+    return np.where(merged, next_start, 0).astype(np.int32)
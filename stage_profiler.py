@@ -0,0 +1,164 @@
+"""
+Stage-level timings of the index runs, logged as JSON lines.
+
+A :class:`StageProfiler` appends one record per timed stage to a JSON-lines
+file: the stage, the year and index (or variable) it worked on, wall-clock
+and CPU seconds of the calling thread, bytes read and written, the peak
+resident memory of the process so far and the run, process and thread it
+ran in. Worker processes append to the same file (one short line per write).
+
+Stages recorded by the engines (index_engine.py) and CN051_nc2tiff.py:
+
+- ``open``: opening a daily reader; CF backends parse their time axis here
+- ``read``: decoding one year of a variable (``bytes_read`` is the decoded
+  size). With ``prefetch_years`` > 0 this is the time spent waiting for the
+  year decoded in the background; set it to 0 to time decoding itself
+- ``dates``: parsing the band dates into calendar-day slots
+- ``mask``: gathering the valid cells and scattering results back to the
+  grid (NaN outside the mask), or NaN-filling missing values
+- ``compute``: index kernels
+- ``write``: compressing and writing an output (``bytes_written`` is the
+  file size); ``background`` is true for writes on the AsyncWriter thread,
+  which overlap the other stages
+- ``thresholds``, ``bootstrap``: threshold cache lookups/builds and the
+  in-base bootstrap, for the whole run
+
+Run ``python stage_profiler.py <log file> [stage|index|year] [run id]`` for a
+summary table of the latest (or given) run.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Profilers of this process, keyed by log file
+_profiler_cache = {}
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far in MB (None if unavailable)."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 1024 ** 2
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024  # Bytes on macOS, KB elsewhere
+
+
+def new_run_id(label):
+    """Identifier shared by the records of one run (and its worker processes)."""
+    return f"{label}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+
+
+class StageProfiler:
+    """
+    Times stages and appends their records to ``log_file`` (nothing is recorded if it is None).
+
+    Use :meth:`stage` as a context manager; it yields the record, in which the
+    caller can set ``bytes_read``/``bytes_written`` or extra fields before the
+    stage ends.
+    """
+
+    def __init__(self, log_file=None, run=None):
+        self.log_file = log_file
+        self.run = run
+        self.lock = threading.Lock()
+        if log_file is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.log_file is not None
+
+    @contextmanager
+    def stage(self, stage, year=None, index=None, **fields):
+        record = {"stage": stage, "year": year, "index": index, "bytes_read": 0, "bytes_written": 0}
+        record.update(fields)
+        if not self.enabled:
+            yield record
+            return
+
+        start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            record["cpu_seconds"] = time.thread_time() - cpu_start
+            self.log(record)
+
+    def log(self, record):
+        thread = threading.current_thread()
+        record = dict(record, run=self.run, pid=os.getpid(), thread=thread.name,
+                      background=thread is not threading.main_thread(), peak_rss_mb=peak_rss_mb(),
+                      time=time.strftime("%Y-%m-%d %H:%M:%S"))
+        line = json.dumps(record, default=str) + "\n"
+        with self.lock, open(self.log_file, "a") as f:
+            f.write(line)
+
+
+def stage_profiler(config):
+    """The (per-process) profiler of ``config["stage_log"]`` for ``config["stage_run"]``; disabled if not set."""
+    key = (config.get("stage_log"), config.get("stage_run"))
+    if key not in _profiler_cache:
+        _profiler_cache[key] = StageProfiler(*key)
+    return _profiler_cache[key]
+
+
+def load_records(log_file, run=None):
+    """Records of ``run`` in ``log_file``, or of the latest run in it if None."""
+    with open(log_file) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if run is None and records:
+        run = records[-1]["run"]
+    return [record for record in records if record["run"] == run]
+
+
+def summarise(records, by="stage"):
+    """
+    Totals per ``by`` value ("stage", "index" or "year"): calls, seconds, CPU seconds, bytes and peak memory.
+
+    Background writes are kept apart from the stages they overlap.
+    """
+    rows = {}
+    for record in records:
+        key = record[by]
+        if isinstance(key, list):
+            key = ",".join(key)
+        if record.get("background"):
+            key = f"{key} (background)"
+        row = rows.setdefault(key, {"calls": 0, "seconds": 0.0, "cpu_seconds": 0.0, "bytes_read": 0,
+                                    "bytes_written": 0, "peak_rss_mb": 0.0})
+        row["calls"] += 1
+        for field in ("seconds", "cpu_seconds", "bytes_read", "bytes_written"):
+            row[field] += record[field]
+        row["peak_rss_mb"] = max(row["peak_rss_mb"], record["peak_rss_mb"] or 0.0)
+    return rows
+
+
+def print_summary(records, by="stage"):
+    rows = summarise(records, by)
+    foreground = sum(row["seconds"] for key, row in rows.items() if not str(key).endswith("(background)"))
+    print(f"{by:<28} {'calls':>6} {'seconds':>9} {'share':>6} {'cpu s':>9} {'MB read':>9} {'MB written':>10} "
+          f"{'peak MB':>8}")
+    for key, row in sorted(rows.items(), key=lambda item: -item[1]["seconds"]):
+        share = "" if str(key).endswith("(background)") else f"{row['seconds'] / max(foreground, 1e-9):.0%}"
+        print(f"{str(key):<28} {row['calls']:>6} {row['seconds']:9.2f} {share:>6} {row['cpu_seconds']:9.2f} "
+              f"{row['bytes_read'] / 1024 ** 2:9.1f} {row['bytes_written'] / 1024 ** 2:10.1f} "
+              f"{row['peak_rss_mb']:8.0f}")
+
+
+if __name__ == "__main__":
+    log_file = sys.argv[1]
+    by = sys.argv[2] if len(sys.argv) > 2 else "stage"
+    records = load_records(log_file, sys.argv[3] if len(sys.argv) > 3 else None)
+    if not records:
+        sys.exit(f"No records in {log_file}")
+    print(f"Run {records[0]['run']}: {len(records)} records")
+    print_summary(records, by)
@@ -0,0 +1,176 @@
+"""
+Temperature extreme indices computed from in-memory (days, H, W) cubes.
+
+Each function reproduces the masking of its stand-alone script
+(TXxTXnTNxTNnCN051.py, FDIDDTRTFRCN051.py, FreezeAndThawIndex.py, TN10p_CN051.py, ...)
+so the fused engine writes the same rasters while decoding every
+tmax/tmin/tm file only once.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from bitpack import count_days, pack_exceedance, packed_spell_summary
+from spell_kernel import SPELL_MIN_LENGTH, apply_carry_over, merge_year_boundary
+
+# Indices produced by the fused temperature engine, in output order
+TEMP_INDICES = ("TXx", "TXn", "TNx", "TNn", "FD", "ID", "DTR", "TFR", "Freeze_Index", "Thaw_Index",
+                "TN10p", "TX10p", "TN90p", "TX90p", "WSDI", "CSDI")
+
+# Daily variables each index depends on
+INDEX_VARIABLES = {
+    "TXx": ("tmax",), "TXn": ("tmax",), "TNx": ("tmin",), "TNn": ("tmin",),
+    "FD": ("tmin", "tmax", "tm"), "ID": ("tmin", "tmax", "tm"), "DTR": ("tmin", "tmax", "tm"),
+    "TFR": ("tmin", "tmax", "tm"), "Freeze_Index": ("tm",), "Thaw_Index": ("tm",),
+    "TN10p": ("tmin",), "TX10p": ("tmax",), "TN90p": ("tmin",), "TX90p": ("tmax",),
+    "WSDI": ("tmax",), "CSDI": ("tmin",),
+}
+
+# Percentile-exceedance indices: (variable, threshold, True if counting days above the threshold)
+EXCEEDANCE_INDICES = {
+    "TN10p": ("tmin", "TNin10", False),
+    "TX10p": ("tmax", "TXin10", False),
+    "TN90p": ("tmin", "TNin90", True),
+    "TX90p": ("tmax", "TXin90", True),
+}
+
+# Spell indices: (variable, threshold, True if spell days are above the threshold)
+SPELL_INDICES = {
+    "WSDI": ("tmax", "TXin90", True),
+    "CSDI": ("tmin", "TNin10", False),
+}
+
+# Calendar-day thresholds: (variable, quantile)
+THRESHOLDS = {
+    "TNin10": ("tmin", 10),
+    "TNin90": ("tmin", 90),
+    "TXin10": ("tmax", 10),
+    "TXin90": ("tmax", 90),
+}
+
+
+def exceedance_mask(data, threshold, day_of_year, above):
+    """Days beyond the calendar-day threshold (False on missing days), bit-packed along time."""
+    return pack_exceedance(data, threshold, day_of_year, above)
+
+
+def exceedance_fraction(packed_mask, data):
+    """Fraction of valid days of ``data`` set in a packed exceedance mask (TN10p, TX90p, ...)."""
+    count = count_days(packed_mask).astype(np.float32)
+    valid_count = np.sum(~np.isnan(data), axis=0, dtype=np.int32).astype(np.float32)
+
+    valid_mask = valid_count > 0
+    count[valid_mask] /= valid_count[valid_mask]
+    count[~valid_mask] = np.nan
+    return count
+
+
+def absolute_extremes(tmax_data=None, tmin_data=None):
+    """TXx, TXn (from tmax) and TNx, TNn (from tmin); NaN where a pixel has no valid day."""
+    results = {}
+    for prefix, data in (("TX", tmax_data), ("TN", tmin_data)):
+        if data is None:
+            continue
+        valid = ~np.isnan(data)
+        no_data = ~valid.any(axis=0)
+        high = np.max(np.where(valid, data, -np.inf), axis=0).astype(np.float32)
+        low = np.min(np.where(valid, data, np.inf), axis=0).astype(np.float32)
+        high[no_data] = np.nan
+        low[no_data] = np.nan
+        results[f"{prefix}x"] = high
+        results[f"{prefix}n"] = low
+    return results
+
+
+def frost_ice_dtr_tfr(tn_data, tx_data, tm_data, tfr_max=1000):
+    """FD, ID, DTR and TFR; NaN wherever any of TN, TX or TM has a missing day."""
+    nan_mask = np.isnan(tn_data).any(axis=0) | np.isnan(tx_data).any(axis=0) | np.isnan(tm_data).any(axis=0)
+
+    fd = np.sum(tn_data < 0, axis=0, dtype=np.int32).astype(np.float32)
+    id = np.sum(tx_data < 0, axis=0, dtype=np.int32).astype(np.float32)
+    dtr = np.mean(tx_data - tn_data, axis=0, dtype=np.float32)
+    thaw_index = np.sum(np.where(tm_data > 0, tm_data, 0), axis=0, dtype=np.float32)
+    freeze_index = np.abs(np.sum(np.where(tm_data < 0, tm_data, 0), axis=0, dtype=np.float32))
+    for arr in (fd, id, dtr, thaw_index, freeze_index):
+        arr[nan_mask] = np.nan
+
+    # TFR = thawing index / freezing index, with the same outlier handling as FDIDDTRTFRCN051.py
+    tfr = np.divide(thaw_index, freeze_index, out=np.full_like(thaw_index, np.nan), where=freeze_index != 0)
+    tfr[freeze_index < 1] = np.nan
+    tfr[tfr > tfr_max] = np.nan
+
+    return {"FD": fd, "ID": id, "DTR": dtr, "TFR": tfr}
+
+
+def freeze_thaw_index(tm_data):
+    """Freezing and thawing indices (FreezeAndThawIndex.py); NaN where any day is missing."""
+    nan_mask = np.isnan(tm_data).any(axis=0)
+    freeze_index = np.sum(np.abs(tm_data) * (tm_data < 0), axis=0, dtype=np.float32)
+    thaw_index = np.sum(tm_data * (tm_data > 0), axis=0, dtype=np.float32)
+    freeze_index[nan_mask] = np.nan
+    thaw_index[nan_mask] = np.nan
+    return {"Freeze_Index": freeze_index, "Thaw_Index": thaw_index}
+
+
+# Everything about one year that WSDI/CSDI need from it, independent of other years
+SpellSummary = namedtuple("SpellSummary", ["closed_spell_days", "lead", "year_end_tail", "num_days",
+                                           "nan_mask", "head_nan_mask"])
+
+
+def summarise_spells(packed_mask, data, min_length=SPELL_MIN_LENGTH):
+    """Reduce one year's packed spell-day mask and its daily data to a :class:`SpellSummary`."""
+    num_days = data.shape[0]
+    closed_spell_days, lead, year_end_tail = packed_spell_summary(packed_mask, num_days, min_length)
+    return SpellSummary(closed_spell_days, lead, year_end_tail, num_days,
+                        np.isnan(data).any(axis=0), np.isnan(data[:min_length]).any(axis=0))
+
+
+class SpellAccumulator:
+    """
+    Year-by-year WSDI/CSDI state, equivalent to WSDI_CN051.py / CSDI_CN051.py.
+
+    Years must be added in order, as :class:`SpellSummary` tuples that may have
+    been computed independently (e.g. in worker processes). A year's result is
+    only final once the first days of the following year are known, so
+    :meth:`add_year` returns the previous year's ``(year, index)`` pair (or
+    None) and :meth:`finish` returns the last one.
+    """
+
+    def __init__(self, shape, min_length=SPELL_MIN_LENGTH):
+        self.min_length = min_length
+        self.prev_year_tail = np.zeros(shape, dtype=np.int32)
+        self.pending = None  # (year, spell_days, year_end_tail, nan_mask) awaiting the next year
+
+    def add_year(self, year, summary):
+        """Add the next year's :class:`SpellSummary`."""
+        finished = None
+        if self.pending is not None:
+            finished = self._merge_boundary(summary.lead, summary.head_nan_mask)
+
+        spell_days, year_end_tail, self.prev_year_tail = apply_carry_over(
+            summary.closed_spell_days, summary.lead, summary.year_end_tail, summary.num_days,
+            self.prev_year_tail, self.min_length)
+        self.pending = (year, spell_days.astype(np.float32), year_end_tail, summary.nan_mask)
+        return finished
+
+    def finish(self):
+        """Finalise the pending year without a following year (end of run or a missing year)."""
+        self.prev_year_tail[:] = 0
+        return self._pop()
+
+    def _merge_boundary(self, next_lead, next_head_nan_mask):
+        year, index, year_end_tail, nan_mask = self.pending
+        nan_mask = nan_mask | next_head_nan_mask
+        self.prev_year_tail = merge_year_boundary(index, year_end_tail, None, nan_mask, self.min_length,
+                                                  next_start=next_lead)
+        self.pending = (year, index, year_end_tail, nan_mask)
+        return self._pop()
+
+    def _pop(self):
+        if self.pending is None:
+            return None
+        year, index, _, nan_mask = self.pending
+        self.pending = None
+        index[nan_mask] = np.nan
+        return year, index
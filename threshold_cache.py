@@ -0,0 +1,235 @@
+"""
+Persistent cache of percentile threshold products.
+
+The calendar-day thresholds (TNin10, TNin90, TXin10, TXin90) and the wet-day
+percentiles (PRwn95, ...) are the most expensive artifacts of the workflow.
+:class:`ThresholdCache` stores each product in one directory under a key made
+of its kind, variable, quantile, window width, baseline years, reader
+settings and a fingerprint of the input contents, with the key written next to it as JSON.
+Engines look thresholds up by key and rebuild only on a miss, so a changed
+input year, baseline or model never reuses a stale threshold and an
+unchanged one is never recomputed.
+
+Input fingerprints hash the bytes of the files a reader serves the baseline
+from (see ``source_files`` in daily_readers.py). File digests are memoised by
+size and modification time in ``digests.json``, so unchanged files are hashed
+only once. :meth:`ThresholdCache.prune` removes earlier builds of the
+products looked up in a run, e.g. after the baseline files were corrected.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import rasterio
+
+from daily_readers import open_reader
+from percentile_thresholds import build_calendar_thresholds, build_store_thresholds
+from wet_day_store import WET_DAY_THRESHOLD, WetDayStore
+
+DIGEST_MEMO = "digests.json"
+
+# Reader arguments that only locate the data; the fingerprint covers their contents instead
+LOCATION_KEYS = ("data_dir", "paths", "path", "store_dir")
+
+
+def file_digest(path, memo=None):
+    """SHA-1 of a file's bytes (of every file below it for a directory such as a Zarr store)."""
+    path = os.path.abspath(path)
+    if os.path.isdir(path):
+        digest = hashlib.sha1()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                digest.update(os.path.relpath(file_path, path).encode())
+                digest.update(file_digest(file_path, memo).encode())
+        return digest.hexdigest()
+
+    stat = os.stat(path)
+    if memo is not None and memo.get(path, {}).get("stat") == [stat.st_size, stat.st_mtime_ns]:
+        return memo[path]["sha1"]
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    if memo is not None:
+        memo[path] = {"stat": [stat.st_size, stat.st_mtime_ns], "sha1": digest.hexdigest()}
+    return digest.hexdigest()
+
+
+def reader_settings(reader_spec):
+    """Reader arguments other than the data location."""
+    return {k: v for k, v in reader_spec.items() if k not in LOCATION_KEYS}
+
+
+def product_id(key):
+    """The part of a cache key that identifies the product regardless of the input contents."""
+    return json.dumps({k: v for k, v in key.items() if k != "fingerprint"}, sort_keys=True)
+
+
+def input_fingerprint(reader_spec, years, memo=None):
+    """Fingerprint of the data ``reader_spec`` serves for ``years``: reader settings plus file contents."""
+    reader = open_reader(reader_spec)
+    digest = hashlib.sha1()
+    digest.update(json.dumps(reader_settings(reader_spec), sort_keys=True).encode())
+    for year in years:
+        if reader.has_year(year):
+            digest.update(str(year).encode())
+            for path in reader.source_files(year):
+                digest.update(file_digest(path, memo).encode())
+    return digest.hexdigest()
+
+
+class ThresholdCache:
+    """Directory of threshold rasters, each stored with the JSON key it was built for."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.memo_file = os.path.join(cache_dir, DIGEST_MEMO)
+        self.memo = {}
+        self.fingerprints = {}  # product_id -> fingerprints looked up through this instance
+        if os.path.exists(self.memo_file):
+            with open(self.memo_file) as f:
+                self.memo = json.load(f)
+
+    def fingerprint(self, reader_spec, years):
+        fingerprint = input_fingerprint(reader_spec, years, self.memo)
+        with open(self.memo_file, "w") as f:
+            json.dump(self.memo, f)
+        return fingerprint
+
+    def path(self, key):
+        """Raster path of ``key``: readable prefix plus a hash of the whole key."""
+        key_hash = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:12]
+        parts = [key["variable"], key["kind"], f"q{key['quantile']:g}"]
+        if key.get("window"):
+            parts.append(f"w{key['window']}")
+        parts += [f"{key['baseline'][0]}-{key['baseline'][1]}", key_hash]
+        return os.path.join(self.cache_dir, "_".join(parts) + ".tif")
+
+    def lookup(self, key):
+        """Path of the cached raster for ``key``, or None on a miss."""
+        self.fingerprints.setdefault(product_id(key), set()).add(key["fingerprint"])
+        path = self.path(key)
+        key_file = path[:-4] + ".json"
+        if not (os.path.exists(path) and os.path.exists(key_file)):
+            return None
+        with open(key_file) as f:
+            return path if json.load(f) == key else None
+
+    def build(self, keys, build_files):
+        """
+        Build the rasters of several missing ``keys`` in one pass and register them.
+
+        ``build_files(paths)`` writes ``paths[i]`` for ``keys[i]``. The rasters are
+        written under temporary names and the keys last, so an interrupted build
+        is never mistaken for a cached product.
+        """
+        paths = [self.path(key) for key in keys]
+        partial = [path[:-4] + ".partial.tif" for path in paths]
+        build_files(partial)
+        for key, path, partial_path in zip(keys, paths, partial):
+            os.replace(partial_path, path)
+            with open(path[:-4] + ".json", "w") as f:
+                json.dump(key, f, indent=1, sort_keys=True)
+        return paths
+
+    def prune(self):
+        """
+        Remove earlier builds of the products looked up through this cache; returns the removed raster paths.
+
+        An entry is removed only if its kind, variable, quantile, window,
+        baseline years and reader settings equal those of a key looked up
+        here while its input fingerprint differs, i.e. it was built from
+        earlier contents of the inputs. Entries of other baselines, quantiles,
+        windows, variables or reader settings are kept. Inputs are told apart
+        by their reader settings, not their location, so prune only when a
+        single archive per reader setup shares the cache directory. Digests
+        of files that no longer exist are dropped from the memo.
+        """
+        removed = []
+        for name in sorted(os.listdir(self.cache_dir)):
+            if not name.endswith(".json") or name == DIGEST_MEMO:
+                continue
+            key_file = os.path.join(self.cache_dir, name)
+            with open(key_file) as f:
+                key = json.load(f)
+            current = self.fingerprints.get(product_id(key))
+            if current is None or key["fingerprint"] in current:
+                continue
+            # The key goes first, so an interrupted prune never leaves a registered entry without its raster
+            os.remove(key_file)
+            path = key_file[:-5] + ".tif"
+            if os.path.exists(path):
+                os.remove(path)
+            removed.append(path)
+
+        self.memo = {path: entry for path, entry in self.memo.items() if os.path.exists(path)}
+        with open(self.memo_file, "w") as f:
+            json.dump(self.memo, f)
+        return removed
+
+    def calendar_day_thresholds(self, reader_spec, variable, quantiles, years, window=5, memory_budget_mb=1024):
+        """
+        {quantile: threshold raster} of the calendar-day percentiles of ``variable`` over ``years``.
+
+        Cached rasters are reused; the missing quantiles are built together in
+        one pass. GeoTIFF inputs are streamed tile by tile, cube stores
+        (cube_store.py) are read directly; other backends need a cube store.
+        """
+        reader = open_reader(reader_spec)
+        years = [year for year in years if reader.has_year(year)]
+        if not years:
+            raise FileNotFoundError(f"No baseline year available for the {variable} thresholds")
+        fingerprint = self.fingerprint(reader_spec, years)
+        keys = {quantile: {"kind": "calendar_day", "variable": variable, "quantile": quantile, "window": window,
+                           "baseline": [years[0], years[-1]], "years": years, "calendar": reader.calendar,
+                           "reader": reader_settings(reader_spec), "fingerprint": fingerprint}
+                for quantile in quantiles}
+        missing = [quantile for quantile in quantiles if self.lookup(keys[quantile]) is None]
+
+        if missing:
+            def build_files(paths):
+                output_files = dict(zip(missing, paths))
+                desc = f"Computing {variable} thresholds"
+                if reader_spec["backend"] == "geotiff":
+                    tif_files = [reader.path(year) for year in years]
+                    build_calendar_thresholds(tif_files, output_files, window, memory_budget_mb, reader.calendar, desc)
+                elif reader_spec["backend"] == "store":
+                    build_store_thresholds(reader_spec["store_dir"], years, output_files, window, memory_budget_mb,
+                                           desc)
+                else:
+                    raise ValueError(f"Thresholds cannot be built from the {reader_spec['backend']} backend, "
+                                     "convert it to a cube store with BuildCubeStoreCN051.py first")
+
+            self.build([keys[quantile] for quantile in missing], build_files)
+        return {quantile: self.path(keys[quantile]) for quantile in quantiles}
+
+    def wet_day_thresholds(self, reader_spec, variable, quantiles, years, wet_threshold=WET_DAY_THRESHOLD):
+        """{quantile: raster} of the wet-day percentiles (PRwn95, ...) over ``years``, built on a miss."""
+        reader = open_reader(reader_spec)
+        years = [year for year in years if reader.has_year(year)]
+        if not years:
+            raise FileNotFoundError(f"No baseline year available for the {variable} wet-day percentiles")
+        fingerprint = self.fingerprint(reader_spec, years)
+        keys = {quantile: {"kind": "wet_day", "variable": variable, "quantile": quantile, "window": None,
+                           "baseline": [years[0], years[-1]], "years": years, "wet_threshold": wet_threshold,
+                           "reader": reader_settings(reader_spec), "fingerprint": fingerprint}
+                for quantile in quantiles}
+        missing = [quantile for quantile in quantiles if self.lookup(keys[quantile]) is None]
+
+        if missing:
+            def build_files(paths):
+                store = WetDayStore.collect(reader, years, wet_threshold, desc="Collecting wet day precipitation")
+                meta = store.meta.copy()
+                meta.update({"count": 1, "dtype": "float32", "compress": "lzw"})
+                for quantile, percentile, path in zip(missing, store.percentiles(missing), paths):
+                    with rasterio.open(path, "w", **meta) as dst:
+                        dst.write(percentile.astype(np.float32), 1)
+                        dst.set_band_description(1, f"PRwn{quantile:g} ({years[0]}-{years[-1]})")
+
+            self.build([keys[quantile] for quantile in missing], build_files)
+        return {quantile: self.path(keys[quantile]) for quantile in quantiles}
@@ -0,0 +1,286 @@
+"""
+Spatially tiled, resumable execution of the fused engines for large grids.
+
+The per-year drivers of index_engine.py hold a whole year of every daily
+variable, which is fine for the QTP subset but not for national 0.25 degree
+or downscaled 1-km grids. Here the grid is split into strips of full grid
+rows (rasterio windows) sized by a memory budget, and every (year, strip)
+pair is a task: the driver reads, computes and writes only that strip
+(``config["window"]``), into strip rasters in a work directory. Tasks are
+queued on a pool of local worker processes.
+
+Completed tasks are recorded in a JSON state file in the work directory, so
+a crashed or interrupted run resumes with the missing tasks; a change of
+code, settings, years or strip size starts over. As soon as every strip of a
+year is done, its outputs are assembled strip by strip (windowed writes)
+into the usual <name>_<year>.tif rasters. WSDI/CSDI spell summaries are
+stored per task and chained across years strip by strip once all tasks are
+done. The work directory is removed after a complete run.
+"""
+
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from rasterio.windows import transform as window_transform
+from tqdm import tqdm
+
+from build_manifest import params_digest
+from compaction import ValidPixels
+from daily_readers import open_reader
+from index_engine import index_file, merge_spell_summaries, run_parameters, single_band_meta, year_indices
+from numba_kernels import process_context
+from stage_profiler import stage_profiler
+from temp_indices import INDEX_VARIABLES, SPELL_INDICES, SpellSummary
+
+STATE_FILE = "tiles_state.json"
+VALID_MASK_FILE = "valid_mask.npy"
+
+# Valid-cell masks of this process, keyed by path
+_mask_cache = {}
+
+
+def strip_rows(width, days, n_variables, memory_budget_mb):
+    """Rows per strip so that a year of the strip's daily variables, with working copies, fits the budget."""
+    bytes_per_pixel = 4 * days * n_variables * 3  # Decoded cube, valid-cell copy and intermediates
+    return max(int(memory_budget_mb * 1024 ** 2 // (bytes_per_pixel * width)), 1)
+
+
+def strip_windows(height, width, rows):
+    return [Window(0, row_off, width, min(rows, height - row_off)) for row_off in range(0, height, rows)]
+
+
+def tile_dir(work_dir, window):
+    return os.path.join(work_dir, f"rows_{window.row_off}")
+
+
+def tiled_valid_mask(reader_specs, years, windows, keep_files=()):
+    """
+    (H, W) mask of the cells with at least one valid day in the first year all readers have, read strip by strip.
+
+    The strip-wise equivalent of :func:`index_engine.build_valid_pixels`.
+    """
+    readers = [open_reader(spec) for spec in reader_specs]
+    year = next((year for year in years if all(reader.has_year(year) for reader in readers)), None)
+    if year is None:
+        raise FileNotFoundError("No year with all input variables available")
+
+    meta = readers[0].year_meta(year)
+    valid = np.zeros((meta["height"], meta["width"]), dtype=bool)
+    for window in tqdm(windows, desc="Finding valid cells"):
+        rows = slice(window.row_off, window.row_off + window.height)
+        for reader in readers:
+            valid[rows] |= ~np.isnan(reader.read_window(year, window)[0]).all(axis=0)
+        for path in keep_files:
+            if os.path.exists(path):
+                with rasterio.open(path) as src:
+                    valid[rows] |= ~np.isnan(src.read(window=window)).all(axis=0)
+    return valid, meta
+
+
+def load_valid_mask(work_dir):
+    path = os.path.join(work_dir, VALID_MASK_FILE)
+    if path not in _mask_cache:
+        _mask_cache[path] = np.load(path)
+    return _mask_cache[path]
+
+
+def spell_file(work_dir, window, year):
+    return os.path.join(tile_dir(work_dir, window), f"spells_{year}.npz")
+
+
+def save_spell_summaries(path, spell_summaries):
+    arrays = {f"{name}.{field}": np.asarray(value) for name, summary in spell_summaries.items()
+              for field, value in summary._asdict().items()}
+    np.savez(path, **arrays)
+
+
+def load_spell_summaries(path):
+    with np.load(path) as f:
+        fields = {}
+        for key in f.files:
+            name, field = key.split(".")
+            fields.setdefault(name, {})[field] = f[key]
+    return {name: SpellSummary(**dict(values, num_days=int(values["num_days"]))) for name, values in fields.items()}
+
+
+def process_tile(function, year, window, config, work_dir):
+    """
+    Run the per-year driver ``function`` on one strip and keep its results in the work directory.
+
+    Non-spell outputs are written as strip rasters, spell summaries (the
+    temperature engine's return value) as an .npz file. Returns False if an
+    input year is missing.
+    """
+    rows = slice(window.row_off, window.row_off + window.height)
+    os.makedirs(tile_dir(work_dir, window), exist_ok=True)
+    tile_config = dict(config, window=window, valid_pixels=ValidPixels(load_valid_mask(work_dir)[rows]),
+                       output_dirs={name: tile_dir(work_dir, window) for name in config["output_dirs"]})
+    result = function(year, tile_config)
+    if result is None:
+        return False
+    if isinstance(result, tuple) and result[1]:
+        save_spell_summaries(spell_file(work_dir, window, year), result[1])
+    return True
+
+
+def load_state(work_dir, version):
+    """Completed tasks and assembled years of an earlier run with the same ``version``; otherwise a fresh start."""
+    path = os.path.join(work_dir, STATE_FILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            state = json.load(f)
+        if state["version"] == version:
+            return state
+        shutil.rmtree(work_dir)  # Strips of other settings or code
+    os.makedirs(work_dir, exist_ok=True)
+    return {"version": version, "tasks": {}, "assembled": []}
+
+
+def save_state(state, work_dir):
+    path = os.path.join(work_dir, STATE_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def task_key(year, window):
+    return f"{year}:{window.row_off}"
+
+
+def strip_spell_summaries(state, work_dir, window, years, strip_meta):
+    """``(year, (meta, {spell index: SpellSummary}))`` of one strip for :func:`index_engine.merge_spell_summaries`."""
+    for year in years:
+        path = spell_file(work_dir, window, year)
+        if not state["tasks"].get(task_key(year, window)):
+            yield year, None  # Missing input year
+        else:
+            yield year, (strip_meta, load_spell_summaries(path) if os.path.exists(path) else {})
+
+
+def assemble(output_path, name, year, grid_meta, windows, strip_path):
+    """
+    Write the strip rasters ``strip_path(window)`` of one output into ``output_path``, NaN where missing.
+
+    The profile (dtype, nodata) is that of the strips, on the grid of
+    ``grid_meta``, LZW-compressed like all engine outputs.
+    """
+    with rasterio.open(next(strip_path(w) for w in windows if os.path.exists(strip_path(w)))) as src:
+        meta = src.meta.copy()
+    meta.update(height=grid_meta["height"], width=grid_meta["width"], transform=grid_meta["transform"], compress="lzw")
+    with rasterio.open(output_path, "w", **meta) as dst:
+        for window in windows:
+            path = strip_path(window)
+            if os.path.exists(path):
+                with rasterio.open(path) as src:
+                    data = src.read(1)
+            else:  # Strip without valid cells
+                data = np.full((window.height, window.width), np.nan, dtype=np.float32)
+            dst.write(data, 1, window=window)
+        dst.set_band_description(1, f"{name}_{year}")
+
+
+def run_tiled(function, config, years, outputs, work_dir, memory_budget_mb=1024, workers=1, version="",
+              keep_files=(), desc=None):
+    """
+    Compute the (name, year) ``outputs`` with the driver ``function`` strip by strip; returns the written pairs.
+
+    ``config`` is the engine configuration with ``config["year_indices"]``
+    from :func:`index_engine.plan_outputs`; ``version`` identifies the code
+    (e.g. :func:`build_manifest.code_version`) so that strips of other code
+    are never reused. ``keep_files`` are passed to the valid-cell mask (see
+    :func:`index_engine.build_valid_pixels`).
+    """
+    years = list(years)
+    task_years = sorted(config["year_indices"])
+    if not task_years:
+        return []
+    variables = sorted({var for name in config["indices"] for var in INDEX_VARIABLES.get(name, ("pre",))})
+    readers = [open_reader(config["readers"][var]) for var in variables]
+    first_year = next((year for year in task_years if all(reader.has_year(year) for reader in readers)), None)
+    if first_year is None:
+        print("No year with all input variables available")
+        return []
+    meta = readers[0].year_meta(first_year)
+    rows = strip_rows(meta["width"], 366, len(variables), memory_budget_mb)
+    windows = strip_windows(meta["height"], meta["width"], rows)
+
+    version = params_digest({"version": version, "rows": rows, "years": years, "year_indices": config["year_indices"],
+                             "outputs": sorted(outputs), "params": run_parameters(config)})
+    state = load_state(work_dir, version)
+    if not os.path.exists(os.path.join(work_dir, VALID_MASK_FILE)):
+        valid, _ = tiled_valid_mask(config["readers"].values(), years, windows, keep_files)
+        np.save(os.path.join(work_dir, VALID_MASK_FILE), valid)
+    valid = load_valid_mask(work_dir)
+    print(f"{len(windows)} strips of {rows} rows, {valid.sum()} valid cells ({valid.mean():.0%} of the grid)")
+
+    # Strips without valid cells hold only NaN and are not computed
+    active = [window for window in windows if valid[window.row_off:window.row_off + window.height].any()]
+    tasks = [(year, window) for year in task_years for window in active
+             if task_key(year, window) not in state["tasks"]]
+    print(f"{len(tasks)} of {len(task_years) * len(active)} strip tasks to compute")
+
+    profiler = stage_profiler(config)
+    written = []
+
+    def assemble_year(year):
+        # Non-spell outputs of a year whose strips are all done
+        if year in state["assembled"]:
+            return
+        if any(not state["tasks"].get(task_key(year, window)) for window in active):
+            return  # A missing input year writes nothing
+        for name in year_indices(config, year):
+            if name in SPELL_INDICES or (name, year) not in outputs:
+                continue
+            with profiler.stage("assemble", year, name):
+                assemble(index_file(config["output_dirs"][name], name, year), name, year, meta, windows,
+                         lambda window: index_file(tile_dir(work_dir, window), name, year))
+            written.append((name, year))
+        state["assembled"].append(year)
+        save_state(state, work_dir)
+
+    def task_done(year, window, completed):
+        state["tasks"][task_key(year, window)] = completed
+        save_state(state, work_dir)
+        if all(task_key(year, w) in state["tasks"] for w in active):
+            assemble_year(year)
+
+    if workers <= 1:
+        for year, window in tqdm(tasks, desc=desc):
+            task_done(year, window, process_tile(function, year, window, config, work_dir))
+    else:
+        # All tasks are queued at once; workers take the next one as they finish
+        with ProcessPoolExecutor(max_workers=workers, mp_context=process_context()) as executor:
+            futures = {executor.submit(process_tile, function, year, window, config, work_dir): (year, window)
+                       for year, window in tasks}
+            for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+                task_done(*futures[future], future.result())
+
+    # Years completed by an earlier run that stopped before assembling them
+    for year in task_years:
+        assemble_year(year)
+
+    # WSDI/CSDI: chain each strip's spell summaries over the years, then assemble the strips
+    spell_names = sorted({name for year in task_years for name in year_indices(config, year) if name in SPELL_INDICES})
+    spell_outputs = set()
+    if spell_names:
+        for window in tqdm(active, desc="Merging spells per strip"):
+            strip_pixels = ValidPixels(valid[window.row_off:window.row_off + window.height])
+            strip_meta = single_band_meta(meta, height=window.height,
+                                          transform=window_transform(window, meta["transform"]))
+            spell_outputs.update(merge_spell_summaries(strip_spell_summaries(state, work_dir, window, task_years,
+                                                                             strip_meta),
+                                                       {name: tile_dir(work_dir, window) for name in spell_names},
+                                                       strip_pixels, outputs, profiler))
+    for name, year in sorted(spell_outputs):
+        with profiler.stage("assemble", year, name):
+            assemble(index_file(config["output_dirs"][name], name, year), name, year, meta, windows,
+                     lambda window: index_file(tile_dir(work_dir, window), name, year))
+        written.append((name, year))
+
+    shutil.rmtree(work_dir)
+    return written
@@ -0,0 +1,124 @@
+"""
+Wet-day precipitation of a baseline period in a compact CSR layout.
+
+PRwn95 (and PRwn99, ...) is a percentile of the wet-day (>= 1 mm) precipitation
+of every cell over the whole baseline. Instead of stacking every day of every
+year as a NaN-padded (days_total, H, W) cube, :class:`WetDayStore` keeps only
+the wet days: ``values`` holds the wet-day amounts of cell 0, then cell 1, ...
+(each cell's run sorted ascending) and ``indptr[cell]:indptr[cell + 1]`` is
+the run of a cell, like the rows of a CSR matrix. Memory scales with the
+number of wet days, and any number of percentiles are order-statistic
+lookups in the sorted runs.
+"""
+
+import numpy as np
+from tqdm import tqdm
+
+# Wet-day threshold of the ETCCDI precipitation indices (mm)
+WET_DAY_THRESHOLD = 1.0
+
+
+def _sortable_bits(values):
+    """uint32 keys of float32 values that sort in the same order as the values."""
+    bits = values.view(np.uint32)
+    return bits ^ np.where(bits >> 31, np.uint32(0xFFFFFFFF), np.uint32(0x80000000))
+
+
+def _values_from_bits(keys):
+    """Inverse of :func:`_sortable_bits`."""
+    return (keys ^ np.where(keys >> 31, np.uint32(0x80000000), np.uint32(0xFFFFFFFF))).view(np.float32)
+
+
+def interpolate_order_statistics(lower, upper, weight):
+    """
+    Per-cell linear interpolation between order statistics, as np.nanpercentile does for one cell.
+
+    ``weight`` and ``1 - weight`` are rounded to the dtype of the values, like
+    numpy's scalar-quantile path, so the result is bit-identical to it.
+    """
+    diff = upper - lower
+    return np.where(weight >= 0.5, upper - diff * (1 - weight).astype(lower.dtype),
+                    lower + diff * weight.astype(lower.dtype))
+
+
+class WetDayStore:
+    """Sorted wet-day values of every cell of a (height, width) grid in CSR layout."""
+
+    def __init__(self, indptr, values, shape, meta=None):
+        self.indptr = indptr  # (n_cells + 1,) int64
+        self.values = values  # (n_wet_days,) float32, ascending within each cell
+        self.shape = shape
+        self.meta = meta  # Grid profile of the input, when collected from a reader
+
+    @classmethod
+    def collect(cls, reader, years, wet_threshold=WET_DAY_THRESHOLD, desc=None):
+        """
+        Stream ``years`` of ``reader`` (see daily_readers.py) and keep the days >= ``wet_threshold``.
+
+        Each year is reduced to one uint64 key per wet day (cell in the high
+        word, the value's sortable bits in the low word) before the next year is
+        read; a single in-place sort of all keys then groups the days by cell in
+        ascending order.
+        """
+        chunks, counts, shape, meta = [], None, None, None
+        for year in tqdm(years, desc=desc):
+            data, _, year_meta = reader.read_year(year)
+            if shape is None:
+                meta = year_meta
+                shape = (meta["height"], meta["width"])
+                counts = np.zeros(shape[0] * shape[1], dtype=np.int64)
+            data = data.reshape(data.shape[0], -1)
+            day, cell = np.nonzero(data >= wet_threshold)  # NaN days are never wet
+            keys = cell.astype(np.uint64) << np.uint64(32)
+            keys |= _sortable_bits(data[day, cell]).astype(np.uint64)
+            chunks.append(keys)
+            counts += np.bincount(cell, minlength=counts.size)
+            del data, day, cell
+
+        if shape is None:
+            raise FileNotFoundError("No input year available for the wet-day store")
+        indptr = np.zeros(counts.size + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        keys = np.empty(indptr[-1], dtype=np.uint64)
+        start = 0
+        for chunk in chunks:
+            keys[start:start + chunk.size] = chunk
+            start += chunk.size
+        chunks.clear()
+        keys.sort()
+        values = _values_from_bits((keys & np.uint64(0xFFFFFFFF)).astype(np.uint32))
+        return cls(indptr, values, shape, meta)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(f["indptr"], f["values"], tuple(int(n) for n in f["shape"]))
+
+    def save(self, path):
+        np.savez(path, indptr=self.indptr, values=self.values, shape=np.array(self.shape))
+
+    @property
+    def counts(self):
+        """(height, width) number of wet days of every cell."""
+        return np.diff(self.indptr).reshape(self.shape)
+
+    def percentiles(self, quantiles):
+        """
+        (len(quantiles), height, width) float32 percentiles of each cell's wet days.
+
+        Identical to ``np.nanpercentile(wet_cube, q, axis=0)`` of the NaN-padded
+        cube for every ``q``; cells without a wet day are NaN.
+        """
+        counts = np.diff(self.indptr)
+        has_wet = counts > 0
+        starts = self.indptr[:-1][has_wet]
+        n = counts[has_wet]
+
+        result = np.full((len(quantiles), counts.size), np.nan, dtype=np.float32)
+        for i, quantile in enumerate(quantiles):
+            virtual_index = (n - 1) * (quantile / 100)
+            lower = np.floor(virtual_index).astype(np.int64)
+            upper = np.minimum(lower + 1, n - 1)
+            result[i, has_wet] = interpolate_order_statistics(self.values[starts + lower], self.values[starts + upper],
+                                                              virtual_index - lower)
+        return result.reshape((len(quantiles),) + self.shape)